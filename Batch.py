@@ -0,0 +1,330 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, PngImagePlugin
+from Main import COMPRESSION_LEVELS, Compression_Settings, Start_QuadTree, Create_Image, Create_Gif, Get_Leaf_Quadrants
+from Filters import FILTERS
+from Pixels import IMAGE_EXTENSIONS
+
+REPORT_FIELDS = ['input', 'output', 'status', 'error', 'width', 'height', 'nodes', 'leaves', 'input_bytes', 'output_bytes',
+                 'decode_seconds', 'build_seconds', 'render_seconds', 'encode_seconds', 'total_seconds']
+
+def Output_Stems(names):
+    '''
+    description:
+        This function gets the output stem of every image of one folder. An image is written under its own stem, but
+        images sharing a stem, like a.png and a.jpg, keep their extension in it, a_png and a_jpg, so neither overwrites the other.
+    Args:
+        names: file names of the images of the folder
+    Returns:
+        stems: dictionary with the output stem of every name
+    '''
+    counts = {}
+    for name in names:
+        stem = os.path.splitext(name)[0].lower() # without case, as the file systems of windows and macos compare names
+        counts[stem] = counts.get(stem, 0) + 1
+
+    stems = {}
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        stems[name] = f'{stem}_{extension[1:].lower()}' if counts[stem.lower()] > 1 else stem
+    return stems
+
+def Inside_Directory(path, directory):
+    # flag for a path that is the directory or somewhere below it
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def Output_Settings(option, color_mode, need_gif):
+    # settings an output png was made with, stored in its 'settings' text chunk so a rerun with other settings redoes it
+    return {'level': option, 'filter': color_mode, 'gif': bool(need_gif)}
+
+def Stored_Settings(path):
+    # settings stored in an output png by Compress_File(), or None for a png without them or a file that is not a png
+    try:
+        with Image.open(path) as image:
+            return json.loads(image.info['settings'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def Up_To_Date(input_path, output_path, gif_path, settings):
+    '''
+    description:
+        This function checks whether the outputs of an image are up to date: every output is newer than the image
+        and the png was made with the same level and filter, and with a gif when a gif is wanted.
+    Args:
+        input_path: path of the image
+        output_path: path of the compressed png
+        gif_path: path of the gif, or None for no gif
+        settings: settings of this run, see Output_Settings()
+    Returns:
+        up_to_date: flag for outputs that do not need to be made again
+    '''
+    outputs = [path for path in (output_path, gif_path) if path]
+    if not all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(input_path) for path in outputs):
+        return False
+
+    stored = Stored_Settings(output_path)
+    return stored is not None and (stored.get('level'), stored.get('filter')) == (settings['level'], settings['filter']) and \
+        (stored.get('gif') or not settings['gif']) # a gif made before is still up to date when none is wanted
+
+def Find_Jobs(in_dir, out_dir, need_gif=False, force=False, option='Average', color_mode='No Filter'):
+    '''
+    description:
+        This function walks the input directory and generates a compression job for every image in it, one at a time,
+        so the directory is never listed into memory as a whole. The outputs keep the folder layout of the inputs.
+        An output directory inside the input directory is not walked, so earlier outputs are never compressed again.
+        Two images that would still be written to the same output are both failed instead of one overwriting the other.
+    Args:
+        in_dir: directory with the images to compress
+        out_dir: directory to write the compressed images to, it can not be the input directory
+        need_gif: flag to also write the gif of every image
+        force: flag to compress images whose outputs are already up to date
+        option: compression level of the outputs, an output made with another level is not up to date
+        color_mode: name of the colour filter of the outputs, an output made with another filter is not up to date
+    Returns:
+        jobs: generator of (input path, output path, gif path or None, up to date flag, error or None) tuples
+    '''
+    if os.path.realpath(in_dir) == os.path.realpath(out_dir):
+        raise ValueError('The output directory must not be the input directory')
+    settings = Output_Settings(option, color_mode, need_gif)
+
+    for directory, folders, files in os.walk(in_dir):
+        folders[:] = sorted(folder for folder in folders if not Inside_Directory(os.path.join(directory, folder), out_dir))
+        names = sorted(name for name in files if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        stems = Output_Stems(names)
+        claimed = {} # input names of every output stem, without case
+        for name in names:
+            claimed.setdefault(stems[name].lower(), []).append(name)
+
+        for name in names:
+            input_path = os.path.join(directory, name)
+            output_stem = os.path.normpath(os.path.join(out_dir, os.path.relpath(directory, in_dir), stems[name]))
+            output_path = output_stem + '.png'
+            gif_path = output_stem + '.gif' if need_gif else None
+
+            others = [other for other in claimed[stems[name].lower()] if other != name]
+            if others: # an image named a_jpg.png still meets a.jpg next to a.png
+                yield input_path, output_path, gif_path, False, f'Output also written by {", ".join(others)}'
+                continue
+
+            up_to_date = not force and Up_To_Date(input_path, output_path, gif_path, settings)
+
+            yield input_path, output_path, gif_path, up_to_date, None
+
+def Save_Bytes(data):
+    # save function for Save_Atomically() that writes raw bytes
+    def save(path):
+        with open(path, 'wb') as file:
+            file.write(data)
+    return save
+
+def Save_Atomically(save, path):
+    # writing to a temporary file first means a crash never leaves a half written output that looks up to date
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.part'
+    try:
+        save(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+def Compress_File(input_path, output_path, gif_path, option, color_mode):
+    '''
+    description:
+        This function compresses one image and times every stage of it. It runs in a worker process.
+    Args:
+        input_path: path of the image to compress
+        output_path: path to write the compressed png to
+        gif_path: path to write the gif to, or None for no gif
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        color_mode: name of the colour filter
+    Returns:
+        row: dictionary with the report fields of the image
+    '''
+    row = {'input': input_path, 'output': output_path, 'status': 'done'}
+    start = time.perf_counter()
+
+    try:
+        row['input_bytes'] = os.path.getsize(input_path) # the image can be gone or unreadable by now
+        DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+
+        image = Image.open(input_path)
+        image.load()
+        decoded = time.perf_counter()
+
+        tree, max_depth = Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD)
+        built = time.perf_counter()
+
+        user_depth = min(MAX_DEPTH, max_depth) # an image without detail has a shallower tree
+        compressed_image = Create_Image(tree, max_depth, user_depth, color_mode=color_mode)
+        gif = Create_Gif(tree, max_depth, user_depth, color_mode=color_mode, show_lines=True) if gif_path else None
+        rendered = time.perf_counter()
+
+        settings = PngImagePlugin.PngInfo()
+        settings.add_text('settings', json.dumps(Output_Settings(option, color_mode, gif_path is not None)))
+        Save_Atomically(lambda path: compressed_image.save(path, format='PNG', pnginfo=settings), output_path)
+        if gif:
+            Save_Atomically(Save_Bytes(gif.getvalue()), gif_path)
+        encoded = time.perf_counter()
+
+        row.update({
+            'width': image.size[0],
+            'height': image.size[1],
+            'nodes': len(tree),
+            'leaves': len(Get_Leaf_Quadrants(tree, max_depth, user_depth)),
+            'output_bytes': os.path.getsize(output_path),
+            'decode_seconds': round(decoded - start, 4),
+            'build_seconds': round(built - decoded, 4),
+            'render_seconds': round(rendered - built, 4),
+            'encode_seconds': round(encoded - rendered, 4),
+        })
+    except Exception as error: # one broken image must not stop the batch
+        row.update({'status': 'failed', 'error': f'{type(error).__name__}: {error}'})
+
+    row['total_seconds'] = round(time.perf_counter() - start, 4)
+    return row
+
+def Run_Batch(in_dir, out_dir, option='Average', color_mode='No Filter', jobs=None, need_gif=False, force=False):
+    '''
+    description:
+        This function compresses every image of a directory in a pool of worker processes. No more than two images
+        per worker are queued at a time and the jobs are read from the directory as the pool frees up,
+        so the memory used stays the same however many images the directory holds. A worker that dies, like one
+        killed for running out of memory, fails its image and the batch goes on in a new pool.
+    Args:
+        in_dir: directory with the images to compress
+        out_dir: directory to write the compressed images to
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        color_mode: name of the colour filter
+        jobs: number of worker processes, by default one per cpu
+        need_gif: flag to also write the gif of every image
+        force: flag to compress images whose outputs are already up to date
+    Returns:
+        rows: generator with the report row of every image, in the order the images finish
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    pending = {} # arguments of Compress_File() of every future, to name the image when its worker fails
+    executor = ProcessPoolExecutor(jobs)
+
+    def finished():
+        # report rows of the futures that are done, running the jobs of a broken pool again
+        nonlocal executor
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        broken = []
+        for future in done:
+            arguments = pending.pop(future)
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                broken.append(arguments)
+            except Exception as error:
+                yield Failed_Row(arguments, error)
+        if not broken:
+            return
+
+        # a worker died, like one killed for running out of memory on a huge image, which fails every job of the pool,
+        # so the pool is started again and the jobs it held are run again one at a time, failing only the image that kills its worker
+        for future in wait(pending)[0]:
+            arguments = pending.pop(future)
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                broken.append(arguments)
+            except Exception as error:
+                yield Failed_Row(arguments, error)
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = ProcessPoolExecutor(jobs)
+
+        for arguments in broken:
+            try:
+                yield executor.submit(Compress_File, *arguments).result()
+            except BrokenProcessPool:
+                yield Failed_Row(arguments, 'The worker process compressing the image died')
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(jobs)
+            except Exception as error:
+                yield Failed_Row(arguments, error)
+
+    try:
+        for input_path, output_path, gif_path, up_to_date, error in Find_Jobs(in_dir, out_dir, need_gif, force, option, color_mode):
+            if error:
+                yield {'input': input_path, 'output': output_path, 'status': 'failed', 'error': error}
+                continue
+            if up_to_date:
+                yield {'input': input_path, 'output': output_path, 'status': 'skipped'}
+                continue
+
+            if len(pending) >= 2 * jobs:
+                yield from finished()
+
+            arguments = (input_path, output_path, gif_path, option, color_mode)
+            pending[executor.submit(Compress_File, *arguments)] = arguments
+
+        while pending:
+            yield from finished()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def Failed_Row(arguments, error):
+    # report row of an image whose worker failed, from the arguments of Compress_File()
+    message = error if isinstance(error, str) else f'{type(error).__name__}: {error}'
+    return {'input': arguments[0], 'output': arguments[1], 'status': 'failed', 'error': message}
+
+def Write_Report(rows, report_path):
+    '''
+    description:
+        This function writes the report rows to a csv file, or to a json lines file when the path ends in .json or .jsonl,
+        one row at a time as the images finish. The rows are added to the end of an existing report, so a rerun
+        that skips the images already compressed does not lose the rows of the run that compressed them.
+    Returns:
+        counts: dictionary with the number of images of every status
+    '''
+    counts = {}
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+
+    with open(report_path, 'a', newline='') as report:
+        if report_path.endswith(('.json', '.jsonl')):
+            write_row = lambda row: report.write(json.dumps(row) + '\n')
+        else:
+            writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS)
+            if report.tell() == 0: # the header only starts a new report
+                writer.writeheader()
+            write_row = writer.writerow
+
+        for row in rows:
+            write_row(row)
+            report.flush()
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+            print(f"{row['status']:>7} {row['input']}" + (f" ({row['error']})" if row.get('error') else ''))
+
+    return counts
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress every image of a directory with the QuadTree image compressor.')
+    parser.add_argument('in_dir', help='directory with the images to compress')
+    parser.add_argument('out_dir', help='directory to write the compressed images to')
+    parser.add_argument('--level', choices=list(COMPRESSION_LEVELS), default='Average', help='compression level')
+    parser.add_argument('--filter', choices=['No Filter'] + list(FILTERS), default='No Filter', help='colour filter')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes, one per cpu by default')
+    parser.add_argument('--gif', action='store_true', help='also write the gif of every image')
+    parser.add_argument('--force', action='store_true', help='compress images whose outputs are already up to date')
+    parser.add_argument('--report', default=None, help='path of the csv or json lines report to add the rows to, a new out_dir/report-<date>-<time>.csv by default')
+    args = parser.parse_args(argv)
+    if os.path.realpath(args.in_dir) == os.path.realpath(args.out_dir):
+        parser.error('out_dir must not be in_dir, the outputs would overwrite the images')
+
+    report_path = args.report or os.path.join(args.out_dir, time.strftime('report-%Y%m%d-%H%M%S.csv')) # every run keeps its own report
+    rows = Run_Batch(args.in_dir, args.out_dir, args.level, args.filter, args.jobs, args.gif, args.force)
+    counts = Write_Report(rows, report_path)
+
+    print(', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'No images found', f'- report written to {report_path}')
+    return 1 if counts.get('failed') else 0
+
+if __name__ == '__main__':
+    raise SystemExit(Main())
@@ -0,0 +1,364 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+from Main import COMPRESSION_LEVELS, BAND_PIXELS, Compression_Settings, Start_QuadTree, Create_Image, Create_Gif, Get_Leaf_Quadrants
+from Codec import Encode_Tree, Decode_Image
+from Result import FORMATS
+
+SIZES = [1, 4, 16, 50] # megapixels of the benchmark images
+PRESETS = list(COMPRESSION_LEVELS)
+STAGES = ['decode', 'build', 'render', 'gif', 'encode'] # timed stages, in the order they run
+QTC_COMPRESSIONS = ['zlib', 'lzma'] # compressions of the .qtc files compared with the download formats
+
+def Synthetic_Image(width, height, seed=0):
+    '''
+    description:
+        This function draws a reproducible test image with smooth gradients, flat shapes with sharp edges and noise,
+        which gives the quad tree both large quiet areas and detailed ones.
+    Args:
+        width: width of the image
+        height: height of the image
+        seed: seed of the random shapes and noise
+    Returns:
+        image: RGB image
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:, :, 0] = x
+    pixels[:, :, 1] = y
+    pixels[:, :, 2] = (x + y) / 2
+
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        left, top = int(rng.integers(0, width)), int(rng.integers(0, height))
+        shape_width, shape_height = int(rng.integers(width // 40 + 1, width // 4 + 2)), int(rng.integers(height // 40 + 1, height // 4 + 2))
+        colour = tuple(int(value) for value in rng.integers(0, 256, 3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((left, top, left + shape_width, top + shape_height), fill=colour)
+
+    # noise on one band of rows at a time, to keep the temporary arrays small
+    pixels = np.array(image)
+    step = max(1, BAND_PIXELS // width)
+    for top in range(0, height, step):
+        band = pixels[top:top + step]
+        band[...] = np.clip(band + rng.integers(-8, 9, band.shape, dtype=np.int16), 0, 255)
+    return Image.fromarray(pixels)
+
+def Benchmark_Size(megapixels, aspect=4 / 3):
+    # width and height of an image with the given number of megapixels
+    width = round(math.sqrt(megapixels * 1e6 * aspect))
+    return width, round(megapixels * 1e6 / width)
+
+def Luminance_Bands(image, overlap=0):
+    # luminance of an image as float64, one band of rows at a time, each band also holding the first rows of the next
+    pixels = np.asarray(image.convert('RGB'))
+    step = max(1, BAND_PIXELS // pixels.shape[1])
+    for top in range(0, pixels.shape[0] - overlap, step):
+        yield pixels[top:top + step + overlap].astype(np.float64) @ np.array([0.2989, 0.5870, 0.1140])
+
+def Psnr(original, compressed):
+    '''
+    description:
+        This function gets the peak signal to noise ratio of the compressed image against the original over the RGB channels.
+    Returns:
+        psnr: psnr in decibels, infinite for identical images
+    '''
+    original, compressed = np.asarray(original.convert('RGB')), np.asarray(compressed.convert('RGB'))
+    step = max(1, BAND_PIXELS // original.shape[1])
+    squared_error = sum(float(np.square(original[top:top + step].astype(np.int64) - compressed[top:top + step]).sum()) for top in range(0, original.shape[0], step))
+    mse = squared_error / original.size
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def Ssim(original, compressed, window=7):
+    '''
+    description:
+        This function gets the mean structural similarity of the luminance of the compressed image against the original,
+        with a uniform window and the usual constants, one band of rows at a time.
+    Returns:
+        ssim: mean ssim, 1 for identical images
+    '''
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    count = window * window
+    total, windows = 0.0, 0
+
+    for x, y in zip(Luminance_Bands(original, window - 1), Luminance_Bands(compressed, window - 1)):
+        if len(x) < window or x.shape[1] < window:
+            continue
+
+        def window_means(values):
+            # mean of every window, from the summed-area table of the band
+            table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+            np.cumsum(np.cumsum(values, axis=0), axis=1, out=table[1:, 1:])
+            return (table[window:, window:] - table[:-window, window:] - table[window:, :-window] + table[:-window, :-window]) / count
+
+        mean_x, mean_y = window_means(x), window_means(y)
+        correction = count / (count - 1) # sample variances and covariance
+        variance_x = (window_means(x * x) - mean_x * mean_x) * correction
+        variance_y = (window_means(y * y) - mean_y * mean_y) * correction
+        covariance = (window_means(x * y) - mean_x * mean_y) * correction
+
+        ssim = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)) / ((mean_x ** 2 + mean_y ** 2 + c1) * (variance_x + variance_y + c2))
+        total += float(ssim.sum())
+        windows += ssim.size
+
+    return total / windows if windows else 1.0
+
+def Output_Formats(tree, user_depth, compressed):
+    '''
+    description:
+        This function writes the compressed image in every download format of Result.py and the quad tree as .qtc files,
+        and reads every one of them back to an image, timing both, so the .qtc format is compared with png and webp
+        on the same tree. A .qtc file is read back with Decode_Image(), which renders the same image.
+    Args:
+        tree: QuadTree of the image
+        user_depth: depth the tree is cut at for the compressed image
+        compressed: compressed image of the tree
+    Returns:
+        formats: dictionary with the 'bytes', 'encode_seconds' and 'decode_seconds' of every format, png, webp and qtc-zlib, qtc-lzma
+    '''
+    formats = {}
+    for name, (_, _, options) in FORMATS.items():
+        start = time.perf_counter()
+        data = io.BytesIO()
+        compressed.save(data, format=name, **options)
+        encoded = time.perf_counter()
+        data.seek(0)
+        Image.open(data).load()
+        formats[name.lower()] = {'bytes': data.getbuffer().nbytes, 'encode_seconds': round(encoded - start, 4), 'decode_seconds': round(time.perf_counter() - encoded, 4)}
+
+    for compression in QTC_COMPRESSIONS:
+        start = time.perf_counter()
+        data = io.BytesIO()
+        Encode_Tree(data, tree, compression, user_depth)
+        encoded = time.perf_counter()
+        data.seek(0)
+        Decode_Image(data, user_depth)
+        formats[f'qtc-{compression}'] = {'bytes': data.getbuffer().nbytes, 'encode_seconds': round(encoded - start, 4), 'decode_seconds': round(time.perf_counter() - encoded, 4)}
+
+    return formats
+
+def Run_Case(path, preset, need_gif=True, need_formats=True):
+    '''
+    description:
+        This function runs the whole pipeline on one image with one preset, timing every stage.
+        It is run in a process of its own so the peak memory belongs to the case alone.
+    Args:
+        path: path of the benchmark image
+        preset: compression level, 'Pixelated', 'Average' or 'Refined'
+        need_gif: flag to also time the gif
+        need_formats: flag to also compare the .qtc format with png and webp, see Output_Formats()
+    Returns:
+        result: dictionary with the timings in seconds, counts, sizes and quality of the case
+    '''
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(preset)
+    seconds = {}
+
+    start = time.perf_counter()
+    image = Image.open(path)
+    image.load()
+    seconds['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree, max_depth = Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD)
+    seconds['build'] = time.perf_counter() - start
+
+    user_depth = min(MAX_DEPTH, max_depth)
+    start = time.perf_counter()
+    compressed = Create_Image(tree, max_depth, user_depth)
+    seconds['render'] = time.perf_counter() - start
+
+    gif_bytes = None
+    if need_gif:
+        start = time.perf_counter()
+        gif_bytes = len(Create_Gif(tree, max_depth, user_depth, show_lines=True).getvalue())
+        seconds['gif'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    png = io.BytesIO()
+    compressed.save(png, format='PNG')
+    seconds['encode'] = time.perf_counter() - start
+
+    formats = Output_Formats(tree, user_depth, compressed) if need_formats else None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024) # bytes on macOS, kilobytes elsewhere
+
+    return {
+        'width': image.size[0],
+        'height': image.size[1],
+        'preset': preset,
+        'seconds': {stage: round(value, 4) for stage, value in seconds.items()},
+        'total_seconds': round(sum(seconds.values()), 4),
+        'nodes': len(tree),
+        'leaves': len(Get_Leaf_Quadrants(tree, max_depth, user_depth)),
+        'max_depth': max_depth,
+        'peak_rss_bytes': peak_rss,
+        'input_bytes': os.path.getsize(path),
+        'output_bytes': len(png.getvalue()),
+        'gif_bytes': gif_bytes,
+        'formats': formats,
+        'psnr': round(Psnr(image, compressed), 4),
+        'ssim': round(Ssim(image, compressed), 6),
+    }
+
+def Prepare_Images(sizes, image_paths, directory):
+    '''
+    description:
+        This function writes the benchmark images: a synthetic image and every given image, at every size.
+    Args:
+        sizes: megapixels of the images
+        image_paths: paths of real images, which are resized to every size
+        directory: directory to write the images to
+    Returns:
+        images: list of (name, megapixels, path) tuples
+    '''
+    images = []
+    for megapixels in sizes:
+        sources = [('synthetic', None)] + [(os.path.splitext(os.path.basename(path))[0], path) for path in image_paths]
+        for name, source in sources:
+            if source is None:
+                image = Synthetic_Image(*Benchmark_Size(megapixels))
+            else:
+                with Image.open(source) as original:
+                    image = original.convert('RGB')
+                    image = image.resize(Benchmark_Size(megapixels, image.size[0] / image.size[1]), Image.Resampling.LANCZOS)
+
+            path = os.path.join(directory, f'{name}-{megapixels}mp.png')
+            image.save(path, compress_level=1) # quick to write, the decode is what is timed
+            images.append((name, megapixels, path))
+    return images
+
+def Environment():
+    # versions and machine the benchmark ran on, so runs on different setups are not compared by mistake
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def Run_Benchmark(sizes=SIZES, presets=PRESETS, image_paths=(), need_gif=True, isolate=True, need_formats=True):
+    '''
+    description:
+        This function benchmarks the pipeline on every image, size and preset.
+    Args:
+        sizes: megapixels of the images
+        presets: compression levels to run
+        image_paths: paths of real images to run besides the synthetic one
+        need_gif: flag to also time the gif
+        need_formats: flag to also compare the .qtc format with png and webp
+        isolate: flag to run every case in a fresh process, which keeps the peak memory of the cases apart
+    Returns:
+        results: dictionary with the 'environment' and the list of 'cases'
+    '''
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, megapixels, path in Prepare_Images(sizes, image_paths, directory):
+            for preset in presets:
+                if isolate:
+                    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                        result = executor.submit(Run_Case, path, preset, need_gif, need_formats).result()
+                else:
+                    result = Run_Case(path, preset, need_gif, need_formats)
+
+                cases.append(dict(image=name, megapixels=megapixels, **result))
+                print(f"{name:>12} {megapixels:>4} MP {preset:>9}: {result['total_seconds']:8.3f} s, {result['nodes']:>9} nodes, "
+                      f"{result['peak_rss_bytes'] / 2 ** 20:8.1f} MB, psnr {result['psnr']:.2f}, ssim {result['ssim']:.4f}", file=sys.stderr)
+                for format, entry in (result['formats'] or {}).items():
+                    print(f"{'':>31}{format:>9}: {entry['bytes']:>10} bytes, encode {entry['encode_seconds']:7.3f} s, decode {entry['decode_seconds']:7.3f} s", file=sys.stderr)
+
+    return {'environment': Environment(), 'cases': cases}
+
+def Compare_Results(results, baseline, threshold=0.1, minimum_seconds=0.05):
+    '''
+    description:
+        This function compares a benchmark run against an earlier one and lists the regressions: stages that got slower,
+        and runs that used more memory, wrote more bytes or lost quality, by more than the threshold.
+    Args:
+        results: results of Run_Benchmark()
+        baseline: results of an earlier run
+        threshold: relative change that counts as a regression
+        minimum_seconds: stages faster than this in both runs are too noisy to compare
+    Returns:
+        regressions: list of dictionaries describing every regression
+    '''
+    earlier = {(case['image'], case['megapixels'], case['preset']): case for case in baseline['cases']}
+    regressions = []
+
+    for case in results['cases']:
+        old = earlier.get((case['image'], case['megapixels'], case['preset']))
+        if old is None:
+            continue
+
+        checks = [(f'seconds.{stage}', old['seconds'].get(stage), case['seconds'].get(stage)) for stage in STAGES]
+        checks += [(key, old.get(key), case.get(key)) for key in ('peak_rss_bytes', 'output_bytes', 'gif_bytes')]
+        old_formats, formats = old.get('formats') or {}, case.get('formats') or {}
+        checks += [(f'formats.{format}.{key}', old_formats[format][key], entry[key]) for format, entry in formats.items() if format in old_formats
+                   for key in ('bytes', 'encode_seconds', 'decode_seconds')]
+        for key, before, after in checks:
+            if before is None or after is None:
+                continue
+            if (key.startswith('seconds.') or key.endswith('_seconds')) and max(before, after) < minimum_seconds:
+                continue
+            if after > before * (1 + threshold):
+                regressions.append({'image': case['image'], 'megapixels': case['megapixels'], 'preset': case['preset'], 'metric': key, 'before': before, 'after': after})
+
+        for key in ('psnr', 'ssim'): # quality is worse when it goes down, and should not move at all for the same settings
+            if case[key] < old[key] - (0.01 if key == 'psnr' else 1e-4):
+                regressions.append({'image': case['image'], 'megapixels': case['megapixels'], 'preset': case['preset'], 'metric': key, 'before': old[key], 'after': case[key]})
+
+    return regressions
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the QuadTree image compressor.')
+    parser.add_argument('--sizes', type=float, nargs='+', default=SIZES, help='megapixels of the benchmark images')
+    parser.add_argument('--presets', nargs='+', choices=PRESETS, default=PRESETS, help='compression levels to run')
+    parser.add_argument('--images', nargs='*', default=[], help='real images to run besides the synthetic one')
+    parser.add_argument('--no-gif', action='store_true', help='skip the gif stage')
+    parser.add_argument('--no-formats', action='store_true', help='skip the comparison of the .qtc format with png and webp')
+    parser.add_argument('--in-process', action='store_true', help='run every case in this process, the peak memory then only grows')
+    parser.add_argument('--output', default=None, help='path of the json results, printed when not given')
+    parser.add_argument('--compare', default=None, help='json results of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) if size == int(size) else size for size in args.sizes]
+    results = Run_Benchmark(sizes, args.presets, args.images, not args.no_gif, not args.in_process, not args.no_formats)
+
+    if args.compare:
+        with open(args.compare) as file:
+            results['regressions'] = Compare_Results(results, json.load(file), args.threshold)
+        for regression in results['regressions']:
+            print('regression: {image} {megapixels} MP {preset} {metric}: {before} -> {after}'.format(**regression), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    return 1 if results.get('regressions') else 0
+
+if __name__ == '__main__':
+    raise SystemExit(Main())
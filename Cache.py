@@ -0,0 +1,189 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from QuadTree import QuadTree
+from RateControl import RateControl
+
+class Cache:
+    '''
+    description:
+        Least recently used cache of results, bounded by the bytes they take up. When a directory is given, the results
+        are also written to disk, so they outlive the process and the memory bound, and the oldest files are removed
+        once the directory holds more than max_disk_bytes. The cache can be used from several threads at once.
+    Attributes:
+        max_bytes: most bytes of results kept in memory
+        directory: directory of the disk tier, or None for no disk tier
+        max_disk_bytes: most bytes of results kept on disk
+        sizeof: function giving the bytes taken up by a result in memory
+        dump: function converting a result to bytes for the disk tier
+        load: function converting the bytes of the disk tier back to a result
+        stats: dictionary counting the 'hits' in memory, the 'disk_hits', the 'misses' and the 'evictions' from memory
+    '''
+
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=1 << 30, sizeof=len, dump=bytes, load=bytes):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.sizeof, self.dump, self.load = sizeof, dump, load
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.bytes = 0 # bytes of the results kept in memory
+        self._entries = OrderedDict() # key of every result in memory and its (result, size), the least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        description:
+            This function looks a result up in memory and then on disk.
+        Args:
+            key: key of the result, see Cache_Key()
+        Returns:
+            value: the result, or None when it is not cached
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key][0]
+
+        path = self.path(key)
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as file:
+                    value = self.load(file.read())
+                os.utime(path) # the modification time orders the files from least to most recently used
+            except (OSError, ValueError):
+                value = None # a file removed or cut short by another process is a miss
+            if value is not None:
+                self.put(key, value, write=False)
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                return value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value, write=True):
+        '''
+        description:
+            This function adds a result to the cache, evicting the least recently used results that no longer fit.
+        Args:
+            key: key of the result, see Cache_Key()
+            value: the result
+            write: flag to also write the result to the disk tier
+        '''
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+                self.stats['evictions'] += 1
+
+        path = self.path(key)
+        if write and path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+            with open(temporary_path, 'wb') as file:
+                file.write(self.dump(value))
+            os.replace(temporary_path, path) # readers never see a half written file
+            self.evict_disk()
+
+    def path(self, key):
+        # path of the file of a result in the disk tier, spread over subdirectories to keep them small
+        return os.path.join(self.directory, key[:2], key) if self.directory else None
+
+    def evict_disk(self):
+        '''
+        description:
+            This function removes the least recently used files of the disk tier until it holds no more than max_disk_bytes.
+        '''
+        files = []
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.part'):
+                    try:
+                        status = os.stat(os.path.join(directory, name))
+                    except OSError:
+                        continue
+                    files.append((status.st_mtime, status.st_size, os.path.join(directory, name)))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        # empties the memory tier, the disk tier is kept
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+def Cache_Key(*parts):
+    '''
+    description:
+        This function gets the key of a result from everything it depends on.
+    Args:
+        parts: strings and numbers the result depends on, like the hash of the image and the settings
+    Returns:
+        key: hexadecimal sha256 of the parts
+    '''
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+def Image_Bytes(image_path):
+    # the bytes of an image given by its path or as a file object, like an uploaded file
+    if hasattr(image_path, 'read'):
+        image_path.seek(0)
+        return image_path.read()
+    with open(image_path, 'rb') as file:
+        return file.read()
+
+def Image_Key(data):
+    # hash of the bytes of an image, the same image always getting the same key however it was given
+    return hashlib.sha256(data).hexdigest()
+
+def Dump_Image(image):
+    # png bytes of an image for the disk tier
+    data = io.BytesIO()
+    image.save(data, format='PNG')
+    return data.getvalue()
+
+def Load_Image(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+def Image_Size(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+CACHE_DIRECTORY = os.environ.get('QUADTREE_CACHE_DIR') # the disk tier is only used when a directory is set
+CACHE_BYTES = int(os.environ.get('QUADTREE_CACHE_BYTES', 256 << 20)) # memory of every cache
+CACHE_DISK_BYTES = int(os.environ.get('QUADTREE_CACHE_DISK_BYTES', 1 << 30)) # disk space of every cache
+
+def Disk_Directory(name):
+    return os.path.join(CACHE_DIRECTORY, name) if CACHE_DIRECTORY else None
+
+TREE_CACHE = Cache(CACHE_BYTES, Disk_Directory('trees'), CACHE_DISK_BYTES, lambda tree: tree.nbytes, QuadTree.to_bytes, QuadTree.from_bytes)
+IMAGE_CACHE = Cache(CACHE_BYTES, Disk_Directory('images'), CACHE_DISK_BYTES, Image_Size, Dump_Image, Load_Image)
+GIF_CACHE = Cache(CACHE_BYTES, Disk_Directory('gifs'), CACHE_DISK_BYTES)
+RATE_CACHE = Cache(CACHE_BYTES, Disk_Directory('rates'), CACHE_DISK_BYTES, lambda rate: rate.nbytes, RateControl.to_bytes, RateControl.from_bytes)
+
+def Cache_Stats():
+    '''
+    description:
+        This function gets the hit and miss counters of the caches of the trees, images, gifs and full trees of the targets.
+    Returns:
+        stats: dictionary with the stats and the bytes in memory of every cache
+    '''
+    return {name: dict(cache.stats, bytes=cache.bytes) for name, cache in (('trees', TREE_CACHE), ('images', IMAGE_CACHE), ('gifs', GIF_CACHE), ('rates', RATE_CACHE))}
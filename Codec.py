@@ -0,0 +1,315 @@
+import lzma
+import math
+import mmap
+import struct
+import zlib
+import numpy as np
+from QuadTree import QuadTree, Child_Cells
+from Main import Grid_Edges, Integral_Image, Level_Stream, Paint_Cells
+from Filters import Apply_Filter
+from Pixels import Image_Pixels, Array_Image
+
+# A .qtc file stores the quad tree itself instead of a render of it. After the header come the levels of the tree,
+# breadth first, each as a (quadrant count, payload size) record followed by the payload. The payload holds one split bit
+# per quadrant, packed eight to a byte, and then the values of every channel of the quadrants, grey or red, green and blue
+# followed by alpha when the image has it, each stored as the difference to the colour of its parent, which is mostly
+# small and compresses well. The levels end with an empty record, followed by an index with the byte offset of every
+# level and a trailer pointing at the index, so a reader can find the bytes of the first few levels without reading
+# the rest of the file.
+MAGIC = b'QTC'
+VERSION = 1
+HEADER = struct.Struct('<3sBBB2xIIIIII') # magic, version, compression, channels, padding, width, height, left, top, right, bottom
+LEVEL = struct.Struct('<II') # number of quadrants in the level, size of the payload in bytes
+INDEX_MAGIC = b'QTCI'
+TRAILER = struct.Struct('<QI4s') # byte offset of the index, number of levels, index magic
+
+COMPRESSIONS = { # name of every compression, its id in the header and the functions to compress and decompress a payload
+    'none': (0, bytes, bytes),
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'lzma': (2, lzma.compress, lzma.decompress),
+}
+
+def Encode_Levels(fp, size, bbox, levels, compression='zlib', channels=3):
+    '''
+    description:
+        This function writes a quad tree to a .qtc file one level at a time, so only the level being written
+        and the colours of its parents are held in memory.
+    Args:
+        fp: file object to write to
+        size: (width, height) of the image
+        bbox: pixel bounding box of the root quadrant
+        levels: iterable with a (colour, split) tuple of arrays for every depth of the tree, starting at the root
+        compression: 'none', 'zlib' or 'lzma'
+        channels: number of channels of the colours, see Pixels.py
+    Returns:
+        written: number of bytes written
+    '''
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+    compression_id, compress, _ = COMPRESSIONS[compression]
+
+    written = fp.write(HEADER.pack(MAGIC, VERSION, compression_id, channels, *size, *map(int, bbox)))
+    parents = np.zeros((1, channels), dtype=np.uint8) # the root quadrant is stored as the difference to black
+    count = 1
+    offsets = [] # byte offset of every level, for the index
+
+    for colour, split in levels:
+        colour, split = np.asarray(colour, dtype=np.uint8), np.asarray(split, dtype=bool)
+        if len(colour) != count:
+            raise ValueError(f'Expected a level with {count} quadrants but got {len(colour)}')
+
+        residuals = colour - parents # wraps around, which the decoder undoes by adding the parent colour back
+        payload = compress(np.packbits(split).tobytes() + residuals.T.tobytes()) # one channel after another
+        offsets.append(written)
+        written += fp.write(LEVEL.pack(count, len(payload))) + fp.write(payload)
+
+        parents = np.repeat(colour[split], 4, axis=0) # the four children of every split quadrant follow each other
+        count = len(parents)
+        if count == 0:
+            break
+
+    offsets.append(written) # the end of the last level
+    written += fp.write(LEVEL.pack(0, 0))
+    index = np.array(offsets, dtype='<u8').tobytes()
+    written += fp.write(index) + fp.write(TRAILER.pack(written, len(offsets) - 1, INDEX_MAGIC))
+
+    return written
+
+def Encode_Tree(fp, tree, compression='zlib', user_depth=None):
+    '''
+    description:
+        This function writes a QuadTree to a .qtc file, see Encode_Levels().
+    Args:
+        fp: file object to write to
+        tree: QuadTree of the image
+        compression: 'none', 'zlib' or 'lzma'
+        user_depth: depth to cut the tree at, the quadrants at that depth being written as leaves, by default the whole tree is written
+    Returns:
+        written: number of bytes written
+    '''
+    last = tree.max_depth if user_depth is None else min(user_depth, tree.max_depth)
+    levels = ((tree.colour[tree.level(depth)], ~tree.leaf[tree.level(depth)] & (depth < last)) for depth in range(last + 1))
+    return Encode_Levels(fp, tree.size, tree.bbox[0].tolist(), levels, compression, tree.colour.shape[1])
+
+def Encode_Image(fp, image, bbox, MAX_DEPTH, DETAIL_THRESHOLD, compression='zlib', user_depth=None, measure='weighted_std'):
+    '''
+    description:
+        This function builds the quad tree of an image with Level_Stream() and writes every level to a .qtc file as soon
+        as it is built, so the tree is never held in memory as a whole; the file is the same as Encode_Tree() writes for
+        the tree of Build_Levels(). The image can be the memory-mapped pixels of an image too large for memory, see Tiled.py,
+        which are read one band at a time into summed-area tables whose size only depends on MAX_DEPTH.
+    Args:
+        fp: file object to write to
+        image: input image, or its pixels from Image_Pixels() or a memory-mapped .npy file
+        bbox: bounding box of the root quadrant
+        compression: 'none', 'zlib' or 'lzma'
+        user_depth: depth to cut the tree at, the quadrants at that depth being written as leaves, by default the whole tree is written
+        measure: detail measure of the quadrants, see Metrics.py
+    Returns:
+        written: number of bytes written
+    '''
+    pixels = Image_Pixels(image)
+    height, width, channels = pixels.shape
+    tables = Integral_Image(pixels, bbox, MAX_DEPTH + 1, measure) # quadrants at MAX_DEPTH can still be split once more
+    stop_depth = None if user_depth is None else user_depth + 1
+    levels = ((colour, split & (user_depth is None or depth < user_depth))
+              for depth, (_, _, colour, split) in enumerate(Level_Stream(tables, [bbox], 0, MAX_DEPTH, DETAIL_THRESHOLD, stop_depth)))
+    return Encode_Levels(fp, (width, height), bbox, levels, compression, channels)
+
+def Read_Exactly(fp, size):
+    # reads a number of bytes from the file, which must not end before them
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError('The file is truncated')
+    return data
+
+def Read_Level(fp, decompress, expected, channels, record=None):
+    '''
+    description:
+        This function reads the record and the payload of one level, laid out as Encode_Levels() writes it, and checks
+        them. It is shared by the .qtc files and the .qts streams of Sequence.py, which store their levels the same way.
+    Args:
+        fp: file object to read from, placed at the level record, or after it when the record is given
+        decompress: function decompressing the payload
+        expected: number of quadrants the level must have, the children of the split quadrants of the level above
+        channels: number of channels of the colours
+        record: bytes of the level record when they have been read already
+    Returns:
+        level: (split, values) tuple with the split flag and the stored channel values of every quadrant, as a (N,) bool
+               and a read-only (N, channels) uint8 array, or None for the empty record that ends the levels
+    '''
+    count, payload_size = LEVEL.unpack(record or Read_Exactly(fp, LEVEL.size))
+    if count == 0:
+        return None
+    if count != expected:
+        raise ValueError(f'Expected a level with {expected} quadrants but got {count}')
+
+    payload = decompress(Read_Exactly(fp, payload_size))
+    split_size = (count + 7) // 8
+    if len(payload) != split_size + channels * count:
+        raise ValueError('The payload of a level is corrupt')
+
+    split = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, count=split_size), count=count).astype(bool)
+    values = np.frombuffer(payload, dtype=np.uint8, offset=split_size).reshape(channels, count).T # one channel after another
+    return split, values
+
+def Read_Index(buffer):
+    '''
+    description:
+        This function reads the level index at the end of a .qtc file.
+    Args:
+        buffer: bytes or memory map of the whole file
+    Returns:
+        offsets: array with the byte offset of every level and the end of the last level, or None when the file has no index
+    '''
+    if len(buffer) < HEADER.size + TRAILER.size:
+        return None
+
+    index_offset, levels, magic = TRAILER.unpack(buffer[-TRAILER.size:])
+    if magic != INDEX_MAGIC or index_offset + 8 * (levels + 1) > len(buffer) - TRAILER.size:
+        return None
+    return np.frombuffer(buffer[index_offset:index_offset + 8 * (levels + 1)], dtype='<u8').astype(np.int64)
+
+def Read_Header(fp):
+    '''
+    description:
+        This function reads the header of a .qtc file.
+    Args:
+        fp: file object to read from, placed at the start of the file
+    Returns:
+        header: dictionary with the 'size' of the image, the 'bbox' of the root quadrant, the name of the 'compression'
+                and the number of 'channels' of the colours
+    '''
+    magic, version, compression_id, channels, width, height, *bbox = HEADER.unpack(Read_Exactly(fp, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('Not a .qtc file')
+    if version != VERSION:
+        raise ValueError(f'Unsupported .qtc version: {version}')
+
+    names = {value[0]: name for name, value in COMPRESSIONS.items()}
+    if compression_id not in names:
+        raise ValueError(f'Unknown .qtc compression id: {compression_id}')
+
+    if not 1 <= channels <= 4:
+        raise ValueError(f'Unsupported number of .qtc channels: {channels}')
+
+    return {'size': (width, height), 'bbox': tuple(bbox), 'compression': names[compression_id], 'channels': channels}
+
+def Decode_Levels(fp, header):
+    '''
+    description:
+        This function reads the levels of a .qtc file one at a time, after its header, holding no more than one level in memory.
+    Args:
+        fp: file object to read from, placed after the header
+        header: header of the file from Read_Header()
+    Returns:
+        levels: generator of (depth, cells, colour, split) tuples, where cells holds the column and row of every quadrant
+                of the level, see QuadTree.cells()
+    '''
+    decompress = COMPRESSIONS[header['compression']][2]
+    channels = header['channels']
+    parents = np.zeros((1, channels), dtype=np.uint8)
+    cells = np.zeros((1, 2), dtype=np.int32)
+    depth = 0
+
+    while len(cells):
+        level = Read_Level(fp, decompress, len(cells), channels)
+        if level is None:
+            break # the levels were cut short when the file was written
+        split, residuals = level
+        colour = residuals + parents
+        yield depth, cells, colour, split
+
+        parents = np.repeat(colour[split], 4, axis=0)
+        cells = Child_Cells(cells, split)
+        depth += 1
+
+def Decode_Tree(fp):
+    '''
+    description:
+        This function reads a whole .qtc file into a QuadTree. The file does not store the detail of the quadrants,
+        so it is zero in the tree.
+    Args:
+        fp: file object to read from, placed at the start of the file
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    header = Read_Header(fp)
+    levels = []
+
+    for depth, cells, colour, split in Decode_Levels(fp, header):
+        x, y = Grid_Edges(header['bbox'], depth)
+        column, row = cells.T
+        bbox = np.stack([x[column], y[row], x[column + 1], y[row + 1]], axis=1)
+        levels.append((bbox, np.zeros(len(cells), dtype=np.float32), colour, split))
+
+    tree = QuadTree.from_levels(levels)
+    return tree, tree.max_depth
+
+def Decode_Image(fp, user_depth=None, color_mode='Color', show_lines=False, max_size=None):
+    '''
+    description:
+        This function renders a .qtc file straight to an image, painting the levels of the tree one at a time
+        as they are read, so the tree is never held in memory as a whole.
+    Args:
+        fp: file object to read from, placed at the start of the file
+        user_depth: depth to cut the tree at, by default the whole tree is rendered
+        color_mode: name of the colour filter applied to the quadrants
+        show_lines: flag to draw a line on the left and top edges of every quadrant
+        max_size: longest side of the image, by default the image has the size it was compressed at
+    Returns:
+        image: the rendered image, the same as Create_Image() gives for the tree of the file when it is not scaled down
+    '''
+    header = Read_Header(fp)
+    (width, height), bbox = header['size'], header['bbox']
+
+    if max_size and max(width, height) > max_size:
+        # the grid of the quadrants is laid over the scaled down bounding box of the root quadrant
+        scale = max_size / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        bbox = tuple(int(value) for value in np.rint(np.array(bbox) * scale))
+
+    canvas = None
+
+    for depth, cells, colour, split in Decode_Levels(fp, header):
+        colour = Apply_Filter(colour, color_mode)
+        if canvas is None:
+            canvas = np.zeros((height, width, colour.shape[1]), dtype=np.uint8) # a filter can colour a grey image
+        Paint_Cells(canvas, bbox, depth, cells, colour, show_lines)
+        if depth == user_depth:
+            break # stopping before the next level is read
+
+    if canvas is None:
+        canvas = np.zeros((height, width, header['channels']), dtype=np.uint8)
+    return Array_Image(canvas)
+
+def Preview_Image(path, max_size=256, user_depth=None, color_mode='Color', show_lines=False):
+    '''
+    description:
+        This function renders a small preview of a .qtc file. Only the first levels of the tree, which are the first bytes
+        of the file, are decoded, and the file is memory-mapped so no other part of it is read from disk.
+        By default the preview stops at the depth whose quadrants are about one pixel of the preview, so the time it takes
+        depends on the size of the preview instead of the size of the image.
+    Args:
+        path: path of the .qtc file
+        max_size: longest side of the preview, None keeps the size the image was compressed at
+        user_depth: depth to cut the tree at, by default the deepest depth that shows in the preview
+        color_mode: name of the colour filter applied to the quadrants
+        show_lines: flag to draw a line on the left and top edges of every quadrant
+    Returns:
+        image: the preview image
+    '''
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        index = Read_Index(mapped)
+        width, height = Read_Header(mapped)['size']
+        mapped.seek(0)
+
+        if user_depth is None and max_size:
+            scale = min(1, max_size / max(width, height))
+            area = max(1, round(width * scale) * round(height * scale))
+            user_depth = int(math.log(area, 4)) # the deepest grid of quadrants with no more cells than the preview has pixels
+        if index is not None and user_depth is not None:
+            user_depth = min(user_depth, len(index) - 2) # the index knows how many levels there are without reading them
+
+        return Decode_Image(mapped, user_depth, color_mode, show_lines, max_size)
@@ -0,0 +1,96 @@
+import numpy as np
+from Pixels import Has_Alpha
+
+FILTERS = {} # name of every colour filter and the function applying it
+
+def Register_Filter(name):
+    '''
+    description:
+        This function registers a colour filter under the name shown in the filter selection.
+        The filter gets an (N, 3) int64 array with the red, green and blue values of the quadrants
+        and returns an (N, 3) array with their new colours, or an (N,) array for a grey colour.
+    Args:
+        name: name of the filter
+    '''
+    def register(function):
+        FILTERS[name] = function
+        return function
+    return register
+
+def Apply_Filter(colours, color_mode='Color'):
+    '''
+    description:
+        This function applies a colour filter to the colours of many quadrants at once. The colours can have any
+        layout of Pixels.py: grey colours are filtered as the RGB colours with the same value in every channel
+        and stay grey when the filter gives a grey colour, and the alpha channel is kept as it is.
+    Args:
+        colours: (N, channels) array with the average colours of the quadrants
+        color_mode: name of the filter, any name that is not registered keeps the colours as they are
+    Returns:
+        colours: (N, channels) uint8 array with the filtered colours, grey colours having 3 colour channels
+                 when the filter coloured them
+    '''
+    colours = np.asarray(colours)
+    function = FILTERS.get(color_mode)
+    if function is None:
+        return colours.astype(np.uint8)
+
+    alpha = colours[:, -1:] if Has_Alpha(colours.shape[1]) else colours[:, :0]
+    colour = colours[:, :colours.shape[1] - alpha.shape[1]].astype(np.int64)
+    filtered = function(np.repeat(colour, 3, axis=1) if colour.shape[1] == 1 else colour)
+    if filtered.ndim == 1:
+        filtered = np.repeat(filtered[:, None], colour.shape[1], axis=1) # a grey value is used for all the colour channels
+
+    filtered = np.clip(filtered, 0, 255).astype(np.uint8) # values out of range are clipped just like ImageDraw does
+    return np.concatenate([filtered, alpha.astype(np.uint8)], axis=1) if alpha.shape[1] else filtered
+
+def Grey_Value(colours):
+    # grey value of the colours, weighted for eye sensitivity
+    r, g, b = colours.T
+    return (0.2989 * r + 0.5870 * g + 0.1140 * b).astype(np.int64)
+
+@Register_Filter('Gray Scale')
+def Gray_Scale(colours):
+    return Grey_Value(colours)
+
+@Register_Filter('Black and White')
+def Black_And_White(colours):
+    return np.where(Grey_Value(colours) < 128, 0, 255)
+
+@Register_Filter('Sepia')
+def Sepia(colours):
+    sepia = np.array([[0.393, 0.769, 0.189],
+                      [0.349, 0.686, 0.168],
+                      [0.272, 0.534, 0.131]])
+    r, g, b = colours.T
+    return np.stack([weights[0] * r + weights[1] * g + weights[2] * b for weights in sepia], axis=1).astype(np.int64)
+
+@Register_Filter('Inverted')
+def Inverted(colours):
+    return 255 - colours
+
+@Register_Filter('Thresholded')
+def Thresholded(colours):
+    threshold_value = 128
+    return np.where(colours > threshold_value, 255, 0)
+
+@Register_Filter('Brightened')
+def Brightened(colours):
+    brightness_adjustment = 50
+    return np.minimum(255, colours + brightness_adjustment)
+
+@Register_Filter('High Contrast')
+def High_Contrast(colours):
+    contrast_adjustment = 50
+    average = colours.sum(axis=1, keepdims=True) / 3
+    return np.minimum(255, (average + contrast_adjustment * (colours - average)).astype(np.int64))
+
+@Register_Filter('Soft Blur')
+def Soft_Blur(colours):
+    blur_adjustment = 100
+    return np.maximum(0, colours - blur_adjustment)
+
+@Register_Filter('Emboss-like')
+def Emboss_Like(colours):
+    emboss_adjustment = 50
+    return np.minimum(255, np.maximum(0, colours + emboss_adjustment))
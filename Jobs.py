@@ -0,0 +1,195 @@
+import io
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from Main import Compression_Settings, main
+
+MAX_FINISHED_JOBS = 32 # finished jobs kept until their sessions claim them, see JobPool.claim()
+MAX_FINISHED_BYTES = 256 << 20 # memory of the results of those jobs
+
+class Cancelled(Exception):
+    # raised from the progress callback to stop a job that was cancelled
+    pass
+
+class Job:
+    '''
+    description:
+        Compression job run by a JobPool. Its progress is updated from the worker thread running it
+        and read from the thread of the page showing it.
+    Attributes:
+        id: unique id of the job
+        stage: 'queued', 'build', 'render', 'gif' or 'done'
+        depth: depth reached in the current stage
+        nodes: number of quadrants built or shown in the current stage
+        fraction: fraction of the job that is done, from 0 to 1
+        submitted, started, finished: times the job was submitted, started and finished, None until they happen
+        future: future holding the result of main() for the job
+    '''
+
+    def __init__(self, MAX_DEPTH, need_gif):
+        self.id = uuid.uuid4().hex
+        self.stage, self.depth, self.nodes, self.fraction = 'queued', 0, 0, 0.0
+        self.submitted, self.started, self.finished = time.time(), None, None
+        self.future = None
+        self._levels = MAX_DEPTH + 2 # levels of the tree, quadrants at MAX_DEPTH can still be split once more
+        self._need_gif = need_gif
+        self._cancel = threading.Event()
+
+    def update(self, stage, depth, nodes):
+        '''
+        description:
+            This function is the progress callback of main(). It raises Cancelled once the job has been cancelled,
+            which stops main() at the next level or frame.
+        '''
+        if self._cancel.is_set():
+            raise Cancelled(self.id)
+
+        # the build takes most of the time, then the gif when there is one
+        build, render = (0.6, 0.7) if self._need_gif else (0.9, 1.0)
+        if stage == 'build':
+            fraction = build * (depth + 1) / self._levels
+        elif stage == 'render':
+            fraction = render
+        else:
+            fraction = render + (1 - render) * (depth + 1) / (self._levels - 1)
+
+        self.stage, self.depth, self.nodes, self.fraction = stage, depth, nodes, min(max(fraction, self.fraction), 1.0)
+
+    def cancel(self):
+        # stops the job, before it starts when it is still queued
+        self._cancel.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def cancelled(self):
+        return self._cancel.is_set() and self.done() and (self.future.cancelled() or isinstance(self.future.exception(), Cancelled))
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self):
+        '''
+        description:
+            This function gets the result of main() for the job, waiting for it to finish.
+            It raises CancelledError for a cancelled job and the error of main() for a failed one.
+        '''
+        try:
+            return self.future.result()
+        except Cancelled:
+            raise CancelledError(self.id) from None
+
+    def nbytes(self):
+        # memory held by the result of the job, nothing until it has finished without an error
+        if not self.done() or self.future.cancelled() or self.future.exception() is not None:
+            return 0
+        return self.future.result().nbytes
+
+    def message(self):
+        # short description of the progress of the job
+        if self.stage == 'queued':
+            return 'Waiting for a free worker...'
+        if self.stage == 'build':
+            return f'Building the quad tree: depth {self.depth}, {self.nodes:,} quadrants'
+        if self.stage == 'render':
+            return 'Rendering the compressed image'
+        if self.stage == 'gif':
+            return f'Writing the gif: frame {self.depth + 1} of {self._levels - 1}'
+        return 'Done'
+
+    def _run(self, data, option, color_mode, need_gif, target, palette):
+        if self._cancel.is_set():
+            raise Cancelled(self.id)
+        self.started = time.time()
+        try:
+            return main(io.BytesIO(data), option, color_mode, need_gif, progress=self.update, target=target, palette=palette)
+        finally:
+            self.stage, self.finished = 'done', time.time()
+
+class JobPool:
+    '''
+    description:
+        Bounded pool of worker threads shared by every session of the app. Jobs are started in the order they were
+        submitted, so the sessions take turns instead of all compressing at once, and a session submitting a new job
+        cancels the one it submitted before. A finished job is claimed by its session, which keeps it with its result,
+        so the pool only holds the finished jobs no session came back for, no more than MAX_FINISHED_JOBS of them
+        and MAX_FINISHED_BYTES of results.
+    Attributes:
+        workers: number of jobs run at the same time
+    '''
+
+    def __init__(self, workers=None):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='compression')
+        self._jobs = OrderedDict() # every job by id, in the order they were submitted
+        self._lock = threading.Lock()
+
+    def submit(self, data, option, color_mode, need_gif=False, replaces=None, target=None, palette=None):
+        '''
+        description:
+            This function queues the compression of an image.
+        Args:
+            data: bytes of the image
+            option: compression level, 'Pixelated', 'Average' or 'Refined'
+            color_mode: name of the colour filter
+            need_gif: flag to also create the gif
+            replaces: id of an earlier job of the same session, which is cancelled
+            target: leaf budget, png size or psnr the compressed image should meet instead of the detail threshold of the level, see main()
+            palette: number of dominant colours of the compressed image to find, see main()
+        Returns:
+            job: the queued Job
+        '''
+        previous = self.get(replaces)
+        if previous is not None:
+            previous.cancel()
+
+        _, MAX_DEPTH = Compression_Settings(option)
+        job = Job(MAX_DEPTH, need_gif)
+        with self._lock:
+            job.future = self._executor.submit(job._run, data, option, color_mode, need_gif, target, palette)
+            self._jobs[job.id] = job
+            self._forget_finished()
+        return job
+
+    def get(self, job_id):
+        # the job with the id, or None when it is unknown or has been forgotten
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def claim(self, job_id):
+        '''
+        description:
+            This function hands a finished job over to its session and forgets it in the pool, so its result lives
+            as long as the session keeps it instead of until other jobs push it out.
+        Args:
+            job_id: id of the job
+        Returns:
+            job: the finished job, or None when it is unknown, has been forgotten or has not finished yet
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.done():
+                return None
+            del self._jobs[job_id]
+            return job
+
+    def position(self, job):
+        # number of jobs that will start before the job, 0 once it has started
+        with self._lock:
+            if job.started is not None or job.done():
+                return 0
+            return sum(1 for other in self._jobs.values() if other.submitted < job.submitted and other.started is None and not other.done())
+
+    def _forget_finished(self):
+        # forgets the oldest finished jobs no session has claimed, until they are within both limits
+        finished = [job for job in self._jobs.values() if job.done()]
+        total = sum(job.nbytes() for job in finished)
+        for count, job in zip(range(len(finished), 0, -1), finished):
+            if count <= MAX_FINISHED_JOBS and total <= MAX_FINISHED_BYTES:
+                break
+            total -= job.nbytes()
+            del self._jobs[job.id]
+
+JOB_POOL = JobPool() # shared by every session, the module is only imported once by the server
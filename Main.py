@@ -1,7 +1,28 @@
 import numpy as np 
 from PIL import Image, ImageDraw
 import io
+import os
+import math
+import time
+import tempfile
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from QuadTree import QuadTree
+from Filters import Apply_Filter
+from Cache import TREE_CACHE, IMAGE_CACHE, GIF_CACHE, RATE_CACHE, Cache_Key, Image_Bytes, Image_Key
+from RateControl import RateControl
+from Profiling import Profile, Profiled, Stage, Active_Profile, PROFILE_ALL, PROFILE_MEMORY
+from Metrics import MEASURES, Histogram_Statistics, Lab_Pixels, Moment_Detail, Pixel_Detail, Region_Mad
+from Palette import Tree_Palette
+from Result import Result
+from Pixels import LAYOUTS, Normalize_Image, Image_Pixels, Array_Image, Line_Colour, Opaque_Colours
 
+BAND_PIXELS = 1 << 20 # most pixels converted to int64 at a time by Cell_Sums()
+BEST_FIRST_BATCH = 64 # fewest quadrants split together by Build_Best_First(), whose children are measured with one Level_Statistics() call
+BEST_FIRST_TABLE_DEPTH = 7 # depth of the first summed-area tables of a best first build with a deadline, they take about one pass over the pixels
+MIN_DETAIL = 1e-4 # detail below which a quadrant of the full tree of Start_Rate_Control() is flat, its squared error being far below one
+
+@Profiled('weighted_average')
 def Weighted_Average(histogram):
     histogram = np.array(histogram)
     total = histogram.sum()
@@ -13,25 +34,25 @@ def Weighted_Average(histogram):
 
     return error
 
-def Get_Detail(histogram):
+@Profiled('detail')
+def Get_Detail(histogram, measure='weighted_std'):
     '''
     Description: 
         This function calculates the detail intensity of the image by taking the weighted average of the histogram of the image.
+        The histogram can have any number of bands, see Metrics.py for the measures.
     
     Args:
         histogram: list of pixel values.
+        measure: 'weighted_std', 'max_std' or 'mad'
     
     Returns:
         detail_intensity: float value of the detail intensity.
     '''
-    red_detail = Weighted_Average(histogram[:256]) # taking values from 0 to 255 for red colour channel
-    green_detail = Weighted_Average(histogram[256:512]) # taking values from 256 to 511 for green colour channel
-    blue_detail = Weighted_Average(histogram[512:768]) # taking values from 512 to 767 for blue colour channel
-
-    detail_intensity = red_detail * 0.2989 + green_detail * 0.5870 + blue_detail * 0.1140  # weighted average of the three colour channels for eye sensitivity
+    detail_intensity, _ = Histogram_Statistics(histogram, measure)
 
     return detail_intensity
 
+@Profiled('average_colour')
 def Average_Colour(image):
     """
     Description:
@@ -41,15 +62,515 @@ def Average_Colour(image):
         We are giving an image.
 
     Returns:
-        A tuple of three integers representing the average red, green, and blue values for the entire image.
+        A tuple of integers representing the average value of every channel of the image, see Pixels.py.
     """
 
 
-    image_arr = np.asarray(image) # convert image to np array
+    image_arr = Image_Pixels(image) # convert image to np array
     # get average of whole image
     avg_color = np.average(image_arr, axis=(0, 1))
     # return tuple(map(int, avg_color))
-    return (int(avg_color[0]), int(avg_color[1]), int(avg_color[2]))
+    return tuple(int(value) for value in avg_color)
+
+def Grid_Edges(bbox, depth):
+    '''
+    description:
+        This function gets the pixel edges of the quadrants at a depth of the tree, which split the bounding box of the
+        root quadrant into a grid of 2 ** depth by 2 ** depth cells. Edges that fall between two pixels are rounded
+        with halves to even, just like round() in Image.crop, so neighbouring cells can start on the same pixel.
+    Args:
+        bbox: bounding box of the root quadrant
+        depth: depth of the quadrants
+    Returns:
+        x: array with the 2 ** depth + 1 pixel columns of the edges
+        y: array with the 2 ** depth + 1 pixel rows of the edges
+    '''
+    left, top, right, bottom = bbox
+    x = np.rint(left + np.arange(2 ** depth + 1) * (right - left) / 2 ** depth).astype(np.intp)
+    y = np.rint(top + np.arange(2 ** depth + 1) * (bottom - top) / 2 ** depth).astype(np.intp)
+    return x, y
+
+@Profiled('integral_image')
+def Integral_Image(image, bbox=None, depth=None, measure='weighted_std'):
+    '''
+    description:
+        This function converts the image to a numpy array once and precomputes its summed-area tables,
+        so the pixel sum of any rectangle can be read with four lookups instead of cropping the image.
+        When the bounding box and depth of a quad tree are given, the tables only keep the pixel rows and columns
+        that quadrants of that tree can start or end on, which keeps them small no matter how large the image is.
+    Args:
+        image: input image, or its pixels from Image_Pixels()
+        bbox: bounding box of the root quadrant
+        depth: deepest depth that quadrants can have
+        measure: detail measure of the quadrants read from the tables, see Detail_Tables()
+    Returns:
+        tables: dictionary holding the per-channel 'sums' and 'squares' tables of the image, and the pixel
+                coordinates 'x' and 'y' of their columns and rows
+    '''
+    pixels = Image_Pixels(image) # every channel of the layout takes part in the detail and colour, alpha included
+    height, width, channels = pixels.shape
+    left, top, right, bottom = (0, 0, width, height) if bbox is None else bbox
+
+    if depth is None:
+        x, y = np.arange(left, right + 1), np.arange(top, bottom + 1)
+    else:
+        # edges of the quadrants at the deepest depth, which include the edges of every shallower quadrant
+        x, y = map(np.unique, Grid_Edges((left, top, right, bottom), depth))
+
+    return Detail_Tables(Summed_Area_Tables(*Cell_Sums(pixels, x, y), x, y), pixels, measure)
+
+def Detail_Tables(tables, pixels, measure='weighted_std'):
+    '''
+    description:
+        This function adds what the detail measure needs to the summed-area tables of an image, see Metrics.py.
+        'weighted_std' and 'max_std' only need the sums of the pixels, 'lab' needs the 'detail_sums' and 'detail_squares'
+        tables of the CIELAB pixels and 'mad' needs the 'pixels' themselves.
+    Args:
+        tables: summed-area tables of the image
+        pixels: (height, width, channels) array of the image
+        measure: any of MEASURES
+    Returns:
+        tables: the same tables, with the 'measure' they are read with
+    '''
+    if measure not in MEASURES:
+        raise ValueError(f'Unknown detail measure: {measure}')
+    tables['measure'] = measure
+    if measure == 'lab':
+        lab = Summed_Area_Tables(*Cell_Sums(pixels, tables['x'], tables['y'], Lab_Pixels), tables['x'], tables['y'])
+        tables['detail_sums'], tables['detail_squares'] = lab['sums'], lab['squares']
+    elif measure == 'mad':
+        tables['pixels'] = pixels
+    return tables
+
+@Profiled('cell_sums')
+def Cell_Sums(pixels, x, y, convert=None):
+    '''
+    description:
+        This function sums the pixel values and their squares over the cells between the given pixel columns and rows,
+        one band of at most BAND_PIXELS pixels at a time to keep the temporary arrays small.
+    Args:
+        pixels: (height, width, channels) array of the image
+        x: increasing pixel columns of the cell edges
+        y: increasing pixel rows of the cell edges
+        convert: function converting a band of pixels before it is summed, like Lab_Pixels(), none by default
+    Returns:
+        sums: (len(y) - 1, len(x) - 1, channels) array with the pixel sums of the cells
+        squares: (len(y) - 1, len(x) - 1, channels) array with the sums of the squared pixels of the cells
+    '''
+    channels = pixels.shape[2] if convert is None else convert(pixels[:1, :1]).shape[2]
+    sums = np.zeros((max(len(y) - 1, 0), max(len(x) - 1, 0), channels), dtype=np.int64)
+    squares = np.zeros_like(sums)
+    if sums.size == 0:
+        return sums, squares # a quadrant that covers no pixels
+
+    step = max(1, BAND_PIXELS // max(x[-1] - x[0], 1)) # pixel rows in a band
+    for row, (start, stop) in enumerate(zip(y[:-1], y[1:])):
+        for band_start in range(start, stop, step):
+            band = pixels[band_start:min(band_start + step, stop), x[0]:x[-1]]
+            band = (band if convert is None else convert(band)).astype(np.int64)
+            sums[row] += np.add.reduceat(band.sum(axis=0), x[:-1] - x[0], axis=0)
+            squares[row] += np.add.reduceat((band * band).sum(axis=0), x[:-1] - x[0], axis=0)
+
+    return sums, squares
+
+def Summed_Area_Tables(sums, squares, x, y):
+    # accumulates the cell sums into summed-area tables, padded with a zero row and column so lookups need no bounds checks
+    tables = {'x': x, 'y': y}
+    for key, cells in (('sums', sums), ('squares', squares)):
+        table = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1, cells.shape[2]), dtype=np.int64)
+        np.cumsum(cells, axis=0, out=table[1:, 1:])
+        np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:]) # accumulating in place avoids temporary copies of the tables
+        tables[key] = table
+    return tables
+
+def Region_Sums(tables, key, left, top, right, bottom, as_list=True):
+    # sum of a table over the rectangles using the four corner lookups of the summed-area table
+    left, right = np.searchsorted(tables['x'], left), np.searchsorted(tables['x'], right) # pixel coordinates to table columns
+    top, bottom = np.searchsorted(tables['y'], top), np.searchsorted(tables['y'], bottom) # pixel coordinates to table rows
+    table = tables[key]
+    sums = table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+    return sums.tolist() if as_list else sums
+
+@Profiled('integral_quadrant')
+def Integral_Quadrant(tables, bbox, depth):
+    '''
+    description:
+        This function creates the same quadrant as Quadrant() but reads the detail and the average colour
+        from the summed-area tables of the image, so no pixels are copied for the quadrant.
+    Args:
+        tables: summed-area tables of the image from Integral_Image()
+        bbox: bounding box of the quadrant
+        depth: depth of the quadrant in the tree
+    '''
+    quadrant = {} # dictionary to store the details of the quadrant
+    quadrant['bbox'] = bbox # bounding box of the quadrant
+    quadrant['depth'] = depth # depth of the quadrant in the tree
+    quadrant['children'] = None # children of the quadrant
+    quadrant['leaf'] = False # flag to check if the quadrant is a leaf node
+
+    if tables.get('measure', 'weighted_std') != 'weighted_std' or tables['sums'].shape[2] != 3:
+        _, detail, colour = Level_Statistics(tables, np.asarray([bbox], dtype=np.float64)) # the other measures and layouts work on whole levels
+        quadrant['detail'], quadrant['colour'] = float(detail[0]), tuple(colour[0].tolist())
+        return quadrant
+
+    left, top, right, bottom = map(int, map(round, bbox)) # rounding the bounding box the same way as Image.crop
+    right, bottom = max(left, right), max(top, bottom)
+    count = (right - left) * (bottom - top) # number of pixels in the quadrant
+
+    if count > 0:
+        sums = Region_Sums(tables, 'sums', left, top, right, bottom)
+        squares = Region_Sums(tables, 'squares', left, top, right, bottom)
+
+        # standard deviation of every channel, which is what Weighted_Average() computes from the histogram
+        red_detail, green_detail, blue_detail = (((count * square - total * total) / (count * count)) ** 0.5 for total, square in zip(sums, squares))
+        quadrant['detail'] = red_detail * 0.2989 + green_detail * 0.5870 + blue_detail * 0.1140 # same eye sensitivity weights as Get_Detail()
+        quadrant['colour'] = tuple(total // count for total in sums) # same truncated average as Average_Colour()
+    else:
+        quadrant['detail'] = 0 # an empty quadrant has no detail to split
+        quadrant['colour'] = (0, 0, 0)
+
+    return quadrant
+
+@Profiled('level_statistics')
+def Level_Statistics(tables, bboxes):
+    '''
+    description:
+        This function calculates the detail and the average colour of a whole level of quadrants at once
+        from the summed-area tables of the image, with the detail measure of the tables.
+    Args:
+        tables: summed-area tables of the image from Integral_Image()
+        bboxes: (N, 4) array with the bounding boxes of the quadrants
+    Returns:
+        bounds: (N, 4) array with the pixel bounding boxes of the quadrants
+        detail: (N,) array with the detail intensity of every quadrant
+        colour: (N, channels) array with the average colour of every quadrant, in the layout of the image
+    '''
+    left, top, right, bottom = np.rint(bboxes).astype(np.intp).T # np.rint rounds halves to even just like round() in Image.crop
+    right, bottom = np.maximum(left, right), np.maximum(top, bottom)
+    count = ((right - left) * (bottom - top))[:, None] # number of pixels in every quadrant
+
+    sums = Region_Sums(tables, 'sums', left, top, right, bottom, as_list=False)
+    squares = Region_Sums(tables, 'squares', left, top, right, bottom, as_list=False)
+
+    bounds = np.stack([left, top, right, bottom], axis=1)
+    measure = tables.get('measure', 'weighted_std')
+    if measure == 'lab':
+        detail = Moment_Detail(Region_Sums(tables, 'detail_sums', left, top, right, bottom, as_list=False),
+                               Region_Sums(tables, 'detail_squares', left, top, right, bottom, as_list=False), count, measure)
+    elif measure == 'mad':
+        detail = Region_Mad(tables['pixels'], bounds, sums / np.maximum(count, 1))
+    else:
+        detail = Moment_Detail(sums, squares, count, measure) # the 'weighted_std' uses the same eye sensitivity weights as Get_Detail()
+
+    colour = sums // np.maximum(count, 1) # same truncated average as Average_Colour()
+
+    return bounds, detail, colour
+
+def Level_Stream(tables, bboxes, depth, MAX_DEPTH, DETAIL_THRESHOLD, stop_depth=None, progress=None):
+    '''
+    description:
+        This function builds the quad tree breadth first and hands out every level as soon as it is built, so a caller
+        writing the levels out, like Codec.Encode_Image(), never holds more than one level of the tree. Every depth of
+        the tree is handled as one set of numpy arrays, with a mask deciding which quadrants of the level are split,
+        so the python work grows with the number of levels instead of the number of quadrants.
+    Args:
+        tables: summed-area tables of the image from Integral_Image()
+        bboxes: (N, 4) array with the bounding boxes of the quadrants to start from
+        depth: depth of the quadrants to start from
+        stop_depth: depth at which to stop growing the tree, by default it grows until no quadrant is split
+        progress: function called with the depth and the number of quadrants built so far after every level
+    Returns:
+        levels: generator of a (bbox, detail, colour, split) tuple of arrays for every depth that is built, which returns
+                the bounding boxes of the children of the quadrants split at the last depth that was built
+    '''
+    nodes = 0
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+
+    while len(bboxes) and depth != stop_depth:
+        bounds, detail, colour = Level_Statistics(tables, bboxes)
+        split = detail >= DETAIL_THRESHOLD if depth <= MAX_DEPTH else np.zeros(len(bboxes), dtype=bool) # same split rule as Build()
+        nodes += len(bboxes)
+        if progress:
+            progress(depth, nodes)
+        yield bounds.astype(np.int32), detail.astype(np.float32), colour.astype(np.uint8), split # only the compact arrays of the level are handed out
+        depth += 1
+
+        bboxes = Child_Boxes(bboxes[split])
+
+    return bboxes
+
+@Profiled('grow_levels')
+def Grow_Levels(tables, bboxes, depth, MAX_DEPTH, DETAIL_THRESHOLD, stop_depth=None, progress=None):
+    '''
+    description:
+        This function builds the quad tree breadth first with Level_Stream() and keeps every level.
+    Args:
+        tables: summed-area tables of the image from Integral_Image()
+        bboxes: (N, 4) array with the bounding boxes of the quadrants to start from
+        depth: depth of the quadrants to start from
+        stop_depth: depth at which to stop growing the tree, by default it grows until no quadrant is split
+        progress: function called with the depth and the number of quadrants built so far after every level
+    Returns:
+        levels: list with a (bbox, detail, colour, split) tuple of arrays for every depth that was built
+        bboxes: bounding boxes of the children of the quadrants split at the last depth that was built
+    '''
+    levels, stream = [], Level_Stream(tables, bboxes, depth, MAX_DEPTH, DETAIL_THRESHOLD, stop_depth, progress)
+    while True:
+        try:
+            levels.append(next(stream))
+        except StopIteration as stop:
+            return levels, stop.value
+
+def Child_Boxes(bboxes):
+    '''
+    description:
+        This function splits bounding boxes into the bounding boxes of their four children.
+    Args:
+        bboxes: (N, 4) float array with the bounding boxes to split
+    Returns:
+        bboxes: (4 * N, 4) array with the upper left, upper right, lower left and lower right children of every
+                bounding box, in the order of Split_Quadrant()
+    '''
+    left, top, right, bottom = bboxes.T
+    middle_x = left + (right - left) / 2 # getting the middle x coordinates of the split quadrants
+    middle_y = top + (bottom - top) / 2 # getting the middle y coordinates of the split quadrants
+
+    return np.stack([
+        np.stack([left, top, middle_x, middle_y], axis=1),
+        np.stack([middle_x, top, right, middle_y], axis=1),
+        np.stack([left, middle_y, middle_x, bottom], axis=1),
+        np.stack([middle_x, middle_y, right, bottom], axis=1),
+    ], axis=1).reshape(-1, 4)
+
+def Build_Levels(tables, bbox, MAX_DEPTH, DETAIL_THRESHOLD, progress=None):
+    '''
+    description:
+        This function builds the whole quad tree breadth first with Grow_Levels().
+    Args:
+        tables: summed-area tables of the image from Integral_Image()
+        bbox: bounding box of the root quadrant
+        progress: function called with the depth and the number of quadrants built so far after every level
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    levels, _ = Grow_Levels(tables, [bbox], 0, MAX_DEPTH, DETAIL_THRESHOLD, progress=progress)
+    tree = QuadTree.from_levels(levels)
+    return tree, tree.max_depth
+
+@Profiled('build_best_first')
+def Build_Best_First(image, bbox, MAX_DEPTH, DETAIL_THRESHOLD, max_nodes=None, deadline=None, progress=None, measure='weighted_std'):
+    '''
+    description:
+        This function builds the quad tree best first. The quadrants that can still be split wait as candidates keyed by
+        their size-weighted variance, pixel count * detail ** 2, which is about the squared error splitting them takes away,
+        and the quadrants with the most are split next. The build can stop after any number of quadrants or at a deadline,
+        and the tree built so far is then the most detailed one for its size; without a limit it builds the same tree
+        as Build_Levels(). The candidates with the most priority are split together in batches, BEST_FIRST_BATCH of them
+        or a sixteenth of the candidates when that is more, which keeps the python work per quadrant small at the cost of
+        splitting a few quadrants out of order.
+        With a deadline the summed-area tables start at BEST_FIRST_TABLE_DEPTH and are only rebuilt finer when the
+        candidate with the most priority needs them and they can be ready before the deadline, so the time of the tables
+        does not come out of a small budget.
+    Args:
+        image: input image, or its pixels from Image_Pixels(), which the summed-area tables are rebuilt from
+        bbox: bounding box of the root quadrant
+        max_nodes: most quadrants in the tree, no limit by default
+        deadline: time.perf_counter() value after which no more quadrants are split, no limit by default
+        progress: function called with the deepest depth and the number of quadrants built so far after every batch,
+                  it can stop the build by raising an exception
+        measure: detail measure of the quadrants, see Metrics.py
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    table_depth = MAX_DEPTH + 1 if deadline is None else min(MAX_DEPTH + 1, BEST_FIRST_TABLE_DEPTH) # quadrants at MAX_DEPTH can still be split once more
+    start = time.perf_counter()
+    tables = Integral_Image(image, bbox, table_depth, measure)
+    table_seconds = time.perf_counter() - start
+
+    bounds, detail, colour = Level_Statistics(tables, np.asarray([bbox], dtype=np.float64))
+    quadrants = [(bounds, detail, colour, np.zeros(1, dtype=np.intp))] # (bounds, detail, colour, depth) of every batch of quadrants, in the order they were built
+    parents, first_children = [], [] # split quadrants and the indices of their first children, for every batch
+    nodes, deepest = 1, 0
+
+    # priority, index, depth and bounding box of the quadrants that can still be split, the root only to start with
+    priority, index, depths, boxes = np.zeros(1), np.zeros(1, dtype=np.intp), np.zeros(1, dtype=np.intp), np.asarray([bbox], dtype=np.float64)
+    if MAX_DEPTH < 0 or detail[0] < DETAIL_THRESHOLD: # same split rule as Build()
+        priority, index, depths, boxes = priority[:0], index[:0], depths[:0], boxes[:0]
+
+    while len(priority):
+        room = len(priority) if max_nodes is None else (max_nodes - nodes) // 4 # every split adds four quadrants
+        if room <= 0 or (deadline is not None and time.perf_counter() >= deadline):
+            break
+
+        if depths[np.argmax(priority)] >= table_depth: # the children of the next quadrant start and end between the edges of the tables
+            if time.perf_counter() + 4 * table_seconds >= deadline: # a depth has four times the cells of the one above
+                # the finer tables would not be ready before the deadline, so the quadrants needing them stay leaves
+                fits = depths < table_depth
+                priority, index, depths, boxes = priority[fits], index[fits], depths[fits], boxes[fits]
+                continue
+            start = time.perf_counter()
+            table_depth += 1
+            tables = Integral_Image(image, bbox, table_depth, measure)
+            table_seconds = time.perf_counter() - start
+            continue
+
+        fits = np.flatnonzero(depths < table_depth)
+        size = min(max(BEST_FIRST_BATCH, len(priority) // 16), room, len(fits))
+        batch = fits if size == len(fits) else fits[np.argpartition(-priority[fits], size - 1)[:size]] # the quadrants with the most priority
+        parents.append(index[batch])
+        first_children.append(nodes + 4 * np.arange(len(batch)))
+
+        depth = np.repeat(depths[batch] + 1, 4)
+        bboxes = Child_Boxes(boxes[batch])
+        bounds, detail, colour = Level_Statistics(tables, bboxes)
+        quadrants.append((bounds, detail, colour, depth))
+
+        split = (depth <= MAX_DEPTH) & (detail >= DETAIL_THRESHOLD)
+        count = (bounds[split, 2] - bounds[split, 0]) * (bounds[split, 3] - bounds[split, 1])
+        left = np.ones(len(priority), dtype=bool)
+        left[batch] = False
+        priority = np.concatenate([priority[left], count * detail[split] ** 2])
+        index = np.concatenate([index[left], nodes + np.flatnonzero(split)])
+        depths = np.concatenate([depths[left], depth[split]])
+        boxes = np.concatenate([boxes[left], bboxes[split]])
+
+        nodes += len(bboxes)
+        deepest = max(deepest, int(depth.max()))
+        if progress:
+            progress(deepest, nodes)
+
+    bounds, detail, colour, depth = (np.concatenate(field) for field in zip(*quadrants))
+    first_child = np.full(nodes, -1, dtype=np.intp)
+    if parents:
+        first_child[np.concatenate(parents)] = np.concatenate(first_children)
+
+    # the quadrants were built best first, the QuadTree stores them breadth first with the four children of a quadrant together
+    order = [np.zeros(1, dtype=np.intp)]
+    while True:
+        children = first_child[order[-1]]
+        children = children[children >= 0]
+        if not len(children):
+            break
+        order.append((children[:, None] + np.arange(4)).ravel())
+    order = np.concatenate(order)
+    index = np.empty(nodes, dtype=np.intp)
+    index[order] = np.arange(nodes)
+    first_child = first_child[order]
+
+    tree = QuadTree(bounds[order], depth[order], detail[order], colour[order], np.where(first_child >= 0, index[first_child], -1))
+    return tree, tree.max_depth
+
+def Shared_Cell_Sums(path, x, y):
+    # Cell_Sums() of a band of the image shared through a memory-mapped file, run in a worker process
+    return Cell_Sums(np.load(path, mmap_mode='r'), x, y)
+
+def Shared_Subtree(path, bbox, depth, MAX_DEPTH, DETAIL_THRESHOLD, measure='weighted_std'):
+    # Grow_Levels() of the subtree of one quadrant of the image shared through a memory-mapped file, run in a worker process
+    tables = Integral_Image(np.load(path, mmap_mode='r'), bbox, MAX_DEPTH + 1 - depth, measure)
+    levels, _ = Grow_Levels(tables, [bbox], depth, MAX_DEPTH, DETAIL_THRESHOLD)
+    return levels
+
+@Profiled('build_subtrees')
+def Build_Subtrees(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, top_depth, map_function=map, bands=1, progress=None, measure='weighted_std'):
+    '''
+    description:
+        This function builds the quad tree of an image stored in a memory-mapped .npy file, one subtree at a time.
+        Once a quadrant is split its four subtrees no longer depend on each other, so the top levels of the tree are built
+        first and every quadrant at top_depth is then built as a subtree of its own, reading only its own pixels,
+        before the subtrees are joined back into one tree, level by level.
+    Args:
+        path: path of the .npy file with the (height, width, channels) pixels of the image, in a layout of Pixels.py
+        bbox: bounding box of the root quadrant
+        top_depth: depth of the roots of the subtrees
+        map_function: function mapping the tasks over their arguments, the map of a process pool builds the subtrees in parallel
+        bands: number of bands of rows the summed-area tables of the top levels are computed in
+        progress: function called with the deepest depth and the number of quadrants built so far after the top levels
+                  and after every subtree
+        measure: detail measure of the quadrants, see Metrics.py
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    # the summed-area tables of the top levels, with the rows of cells summed in bands
+    x, y = map(np.unique, Grid_Edges(bbox, top_depth))
+    row_bands = [y[rows[0]:rows[-1] + 2] for rows in np.array_split(np.arange(len(y) - 1), bands) if len(rows)]
+    sums, squares = zip(*map_function(Shared_Cell_Sums, repeat(path), repeat(x), row_bands))
+    tables = Summed_Area_Tables(np.concatenate(sums), np.concatenate(squares), x, y)
+    tables = Detail_Tables(tables, np.load(path, mmap_mode='r'), measure)
+
+    levels, subtree_bboxes = Grow_Levels(tables, [bbox], 0, MAX_DEPTH, DETAIL_THRESHOLD, stop_depth=top_depth, progress=progress)
+    subtrees, nodes, depth = [], sum(len(level[0]) for level in levels), len(levels) - 1
+    for subtree in map_function(Shared_Subtree, repeat(path), subtree_bboxes.tolist(), repeat(top_depth), repeat(MAX_DEPTH), repeat(DETAIL_THRESHOLD), repeat(measure)):
+        subtrees.append(subtree)
+        nodes, depth = nodes + sum(len(level[0]) for level in subtree), max(depth, top_depth + len(subtree) - 1)
+        if progress:
+            progress(depth, nodes)
+
+    # every level below the top is the same level of all subtrees, in the order of their roots, which keeps the children
+    # of the split quadrants of a level in the same order as their parents
+    for depth in range(max(map(len, subtrees), default=0)):
+        parts = [subtree[depth] for subtree in subtrees if depth < len(subtree)]
+        levels.append(tuple(np.concatenate(field) for field in zip(*parts)))
+
+    tree = QuadTree.from_levels(levels)
+    return tree, tree.max_depth
+
+def Build_Parallel(image, bbox, MAX_DEPTH, DETAIL_THRESHOLD, workers, progress=None, measure='weighted_std'):
+    '''
+    description:
+        This function builds the quad tree in several processes with Build_Subtrees(). The pixels are written once
+        to a memory-mapped file that every worker reads, instead of being sent to every task.
+    Args:
+        image: input image, or its pixels from Image_Pixels()
+        bbox: bounding box of the root quadrant
+        workers: number of worker processes
+        progress: function called with the depth and the number of quadrants built so far, see Build_Subtrees()
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    top_depth = min(MAX_DEPTH + 1, math.ceil(math.log(4 * workers, 4))) # enough subtrees for every worker to get about four
+
+    with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(workers) as executor:
+        path = os.path.join(directory, 'pixels.npy')
+        pixels = Image_Pixels(image)
+        shared = np.lib.format.open_memmap(path, mode='w+', dtype=pixels.dtype, shape=pixels.shape)
+        shared[...] = pixels
+        shared.flush()
+        del shared
+
+        return Build_Subtrees(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, top_depth, executor.map, workers, progress, measure)
+
+def Start_Rate_Control(image, MAX_DEPTH, progress=None, measure='weighted_std'):
+    '''
+    description:
+        This function builds the full quad tree of the image, splitting every quadrant with any detail down to MAX_DEPTH,
+        and the squared error of every quadrant, from which the trees of any threshold are cut, see RateControl.py.
+    Args:
+        image: input image
+        MAX_DEPTH: depth of the compressed image, the quadrants at MAX_DEPTH are not split
+        progress: function called with the depth and the number of quadrants built so far after every level
+        measure: detail measure ordering the splits, see Metrics.py
+    Returns:
+        rate: RateControl of the image
+    '''
+    image = Normalize_Image(image) # a no-op for an image opened by Open_Image()
+    bbox = image.getbbox() or (0, 0) + image.size # an all black image has no bounding box
+    tables = Integral_Image(image, bbox, MAX_DEPTH, measure)
+    levels, _ = Grow_Levels(tables, [bbox], 0, MAX_DEPTH - 1, MIN_DETAIL, progress=progress)
+    tree = QuadTree.from_levels(levels)
+
+    # squared error of painting every quadrant with its truncated average colour, expanded so it only needs the sums
+    left, top, right, bottom = tree.bbox.T
+    sums = Region_Sums(tables, 'sums', left, top, right, bottom, as_list=False)
+    squares = Region_Sums(tables, 'squares', left, top, right, bottom, as_list=False)
+    count = ((right - left) * (bottom - top)).astype(np.int64)[:, None]
+    colour = tree.colour.astype(np.int64)
+    error = (squares - 2 * colour * sums + count * colour * colour).sum(axis=1)
+
+    return RateControl(tree, error)
 
 def Floyd_Steinberg_dithering(grayscale_value):
     if grayscale_value < 128:
@@ -60,7 +581,8 @@ def Floyd_Steinberg_dithering(grayscale_value):
         bw_value = 255
     return bw_value, error
 
-def Quadrant(image, bbox, depth, color_mode='Color'):
+@Profiled('quadrant')
+def Quadrant(image, bbox, depth, measure='weighted_std'):
     quadrant = {} # dictionary to store the details of the quadrant
     quadrant['bbox'] = bbox # bounding box of the quadrant
     quadrant['depth'] = depth # depth of the quadrant in the tree
@@ -68,138 +590,103 @@ def Quadrant(image, bbox, depth, color_mode='Color'):
     quadrant['leaf'] = False # flag to check if the quadrant is a leaf node
 
     # crop image to quadrant size
-    image = image.crop(bbox) # cropping the image to the size of the quadrant using the bounding box
-    hist = image.histogram() # getting the histogram of the image which contains the pixel values 
+    with Stage('crop'):
+        image = image.crop(bbox) # cropping the image to the size of the quadrant using the bounding box
+    with Stage('histogram'):
+        hist = image.histogram() # getting the histogram of the image which contains the pixel values 
 
-    quadrant['detail'] = Get_Detail(hist) # calculating the detail intensity of the quadrant
-    quadrant['colour'] = Average_Colour(image) # calculating the average colour of the quadrant
-
-    
-    quadrant = calculate_filters(quadrant, color_mode) # calculating the filters of the quadrant
+    # calculating the detail intensity and the average colour of the quadrant from the histogram, see Metrics.py
+    quadrant['detail'], colour = Histogram_Statistics(hist, 'weighted_std' if measure == 'lab' else measure)
+    quadrant['colour'] = colour
+    if measure == 'lab':
+        quadrant['detail'] = Pixel_Detail(np.asarray(image), measure) # the histogram of every channel cannot give distances in CIELAB
 
     return quadrant
 
-def calculate_filters(quadrant, color_mode='Color'):
-    ''' 
-    description:
-        This function calculates the filters of the quadrant.
-    Args:
-        quadrant: dictionary to store the details of the quadrant
-    '''
-    
-    # extract color values
-    r, g, b = quadrant['colour']
-
-    # calculate grayscale value
-    if color_mode == 'Gray Scale':
-        grayscale_value = int(0.2989 * r + 0.5870 * g + 0.1140 * b)
-        quadrant['grayscale'] = grayscale_value
-
-    elif color_mode == 'Black and White': 
-        grayscale_value = int(0.2989 * r + 0.5870 * g + 0.1140 * b)
-        bw_value = 0 if grayscale_value < 128 else 255
-        quadrant['bw'] = bw_value
-
-    elif color_mode == 'Sepia':
-        # calculate sepia values
-        sepia_r = int(0.393 * r + 0.769 * g + 0.189 * b)
-        sepia_g = int(0.349 * r + 0.686 * g + 0.168 * b)
-        sepia_b = int(0.272 * r + 0.534 * g + 0.131 * b)
-        quadrant['sepia'] = (sepia_r, sepia_g, sepia_b)
-
-    elif color_mode == 'Inverted':
-        # calculate inverted values
-        inverted_r = 255 - r
-        inverted_g = 255 - g
-        inverted_b = 255 - b
-        quadrant['inverted'] = (inverted_r, inverted_g, inverted_b)
-
-    elif color_mode == 'Thresholded':
-        # calculate thresholded values
-        threshold_value = 128
-        thresholded_r = 255 if r > threshold_value else 0
-        thresholded_g = 255 if g > threshold_value else 0
-        thresholded_b = 255 if b > threshold_value else 0
-        quadrant['thresholded'] = (thresholded_r, thresholded_g, thresholded_b)
-    
-    elif color_mode == 'Brightened':
-        # calculate brightness adjustment values
-        brightness_adjustment = 50
-        brightness_r = min(255, r + brightness_adjustment)
-        brightness_g = min(255, g + brightness_adjustment)
-        brightness_b = min(255, b + brightness_adjustment)
-
-        # add brightness adjustment values to quadrant
-        quadrant['Brightened'] = (brightness_r, brightness_g, brightness_b)
-
-    elif color_mode == 'High Contrast':
-        # calculate contrast adjustment values
-        contrast_adjustment = 50
-        average = (r + g + b) / 3
-        contrast_r = min(255, int(average + contrast_adjustment * (r - average)))
-        contrast_g = min(255, int(average + contrast_adjustment * (g - average)))
-        contrast_b = min(255, int(average + contrast_adjustment * (b - average)))
-
-        # add contrast adjustment values to quadrant
-        quadrant['Contrast'] = (contrast_r, contrast_g, contrast_b)
-
-    elif color_mode == 'Soft Blur':
-        # calculate soft blur values
-        blur_adjustment = 100
-        blur_r = max(0, r - blur_adjustment)
-        blur_g = max(0, g - blur_adjustment)
-        blur_b = max(0, b - blur_adjustment)
-        quadrant['Soft Blur'] = (blur_r, blur_g, blur_b)
-
-    elif color_mode == 'Emboss-like':
-        # calculate emboss-like values
-        emboss_adjustment = 50
-        emboss_r = min(255, max(0, r + emboss_adjustment))
-        emboss_g = min(255, max(0, g + emboss_adjustment))
-        emboss_b = min(255, max(0, b + emboss_adjustment))
-        quadrant['Emboss-like'] = (emboss_r, emboss_g, emboss_b)
-
-    return quadrant
-
-def Split_Quadrant(quadrant, image, color_mode='Color'):
+@Profiled('split_quadrant')
+def Split_Quadrant(quadrant, image, new_quadrant=Quadrant):
     '''
     description:
         This function splits the input quadrant into 4 new quadrants.
     Args:
         quadrant: dictionary to store the details of the quadrant
-        image: input image
+        image: input image, or its summed-area tables when new_quadrant is Integral_Quadrant
+        new_quadrant: function used to create each of the 4 new quadrants
     '''
     left, top, right, bottom = quadrant['bbox'] # getting the bounding box of the quadrant
     middle_x = left + (right - left) / 2 # getting the middle x coordinate of the quadrant
     middle_y = top + (bottom - top) / 2 # getting the middle y coordinate of the quadrant
 
     # split root quadrant into 4 new quadrants
-    upper_left = Quadrant(image, (left, top, middle_x, middle_y), quadrant['depth']+1, color_mode) # creating the upper left quadrant
-    upper_right = Quadrant(image, (middle_x, top, right, middle_y), quadrant['depth']+1, color_mode) # creating the upper right quadrant
-    lower_left = Quadrant(image, (left, middle_y, middle_x, bottom), quadrant['depth']+1, color_mode) # creating the lower left quadrant
-    lower_right = Quadrant(image, (middle_x, middle_y, right, bottom), quadrant['depth']+1, color_mode) # creating the lower right quadrant
+    upper_left = new_quadrant(image, (left, top, middle_x, middle_y), quadrant['depth']+1) # creating the upper left quadrant
+    upper_right = new_quadrant(image, (middle_x, top, right, middle_y), quadrant['depth']+1) # creating the upper right quadrant
+    lower_left = new_quadrant(image, (left, middle_y, middle_x, bottom), quadrant['depth']+1) # creating the lower left quadrant
+    lower_right = new_quadrant(image, (middle_x, middle_y, right, bottom), quadrant['depth']+1) # creating the lower right quadrant
 
     quadrant['children'] = [upper_left, upper_right, lower_left, lower_right] # storing the children of the quadrant in the quadrant dictionary
 
-def Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD, color_mode='Color'):
+@Profiled('start_quadtree')
+def Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD, engine='breadth_first', workers=1, progress=None, time_budget=None, max_nodes=None, measure='weighted_std'):
     '''
     description:
         This function starts the compression of the image by creating a quad tree of the image.
+        The image is turned into its layout of Pixels.py first, and the engines using summed-area tables share
+        one array of its pixels; a grey image is built with one channel instead of three.
     Args:
-        image: input image
+        image: input image of any mode
+        engine: 'breadth_first' builds a whole level of the tree at a time from the summed-area tables of the image,
+                'best_first' splits the quadrant with the most error first from the summed-area tables of the image,
+                and can stop early, see Build_Best_First(),
+                'integral' builds the tree one quadrant at a time from the summed-area tables of the image,
+                'crop' crops and takes the histogram of the image for every quadrant
+        workers: number of processes building the 'breadth_first' tree, see Build_Parallel()
+        progress: function called with the depth and the number of quadrants built so far while the 'breadth_first'
+                  or 'best_first' tree is built, it can stop the build by raising an exception
+        time_budget: seconds after which the 'best_first' build stops splitting, counted from this call
+        max_nodes: most quadrants in the 'best_first' tree
+        measure: 'weighted_std', 'max_std', 'mad' or 'lab', the detail measure compared to DETAIL_THRESHOLD, see Metrics.py
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
     '''
-    root = Quadrant(image, image.getbbox(), 0, color_mode) # creating the root quadrant of the image
-    max_depth = Build(root, image, 0, MAX_DEPTH, DETAIL_THRESHOLD, color_mode) # building the quad tree of the image
-    return root, max_depth
+    deadline = None if time_budget is None else time.perf_counter() + time_budget # the summed-area tables count against the budget
+    if (time_budget is not None or max_nodes is not None) and engine != 'best_first':
+        raise ValueError('Only the best_first engine can stop after a time budget or a number of quadrants')
 
-def Build(root, image, max_depth, MAX_DEPTH, DETAIL_THRESHOLD, color_mode='Color'):
+    image = Normalize_Image(image) # a no-op for an image opened by Open_Image()
+    bbox = image.getbbox() or (0, 0) + image.size # an all black image has no bounding box, with alpha it leaves out the fully transparent pixels
+    pixels = Image_Pixels(image) if engine != 'crop' else None
+    if engine == 'breadth_first' and workers > 1:
+        return Build_Parallel(pixels, bbox, MAX_DEPTH, DETAIL_THRESHOLD, workers, progress, measure)
+    elif engine == 'best_first':
+        return Build_Best_First(pixels, bbox, MAX_DEPTH, DETAIL_THRESHOLD, max_nodes, deadline, progress, measure)
+    elif engine in ('breadth_first', 'integral'):
+        source = Integral_Image(pixels, bbox, MAX_DEPTH + 1, measure) # quadrants at MAX_DEPTH can still be split once more
+        if engine == 'breadth_first':
+            return Build_Levels(source, bbox, MAX_DEPTH, DETAIL_THRESHOLD, progress)
+        new_quadrant = Integral_Quadrant
+    elif engine == 'crop':
+        if measure not in MEASURES:
+            raise ValueError(f'Unknown detail measure: {measure}')
+        source, new_quadrant = image, lambda image, bbox, depth: Quadrant(image, bbox, depth, measure)
+    else:
+        raise ValueError(f'Unknown quad tree engine: {engine}')
+
+    root = new_quadrant(source, bbox, 0) # creating the root quadrant of the image
+    Build(root, source, 0, MAX_DEPTH, DETAIL_THRESHOLD, new_quadrant) # building the quad tree of the image
+    tree = QuadTree.from_quadrant(root)
+    return tree, tree.max_depth
+
+@Profiled('build')
+def Build(root, image, max_depth, MAX_DEPTH, DETAIL_THRESHOLD, new_quadrant=Quadrant):
     '''
     description:
         This function builds the quad tree of the input image.
     Args:
         quad_tree: dictionary to store the details of the quad tree
         root: dictionary to store the details of the root quadrant
-        image: input image
+        image: input image, or its summed-area tables when new_quadrant is Integral_Quadrant
+        new_quadrant: function used to create the quadrants of the tree
     '''
     if root['depth'] > MAX_DEPTH or root['detail'] < DETAIL_THRESHOLD: # checking if the depth of the quadrant is greater than the maximum depth or the detail intensity of the quadrant is less than the detail threshold
         if root['depth'] > max_depth: 
@@ -208,161 +695,510 @@ def Build(root, image, max_depth, MAX_DEPTH, DETAIL_THRESHOLD, color_mode='Color
         root['leaf'] = True # assigning the quadrant to a leaf node and stopping the recursion
         return max_depth
     
-    Split_Quadrant(root, image, color_mode) # splitting the quadrant into 4 new quadrants
+    Split_Quadrant(root, image, new_quadrant) # splitting the quadrant into 4 new quadrants
 
     for child in root['children']: # iterating through the children of the quadrant
-        max_depth = Build(child, image, max_depth, MAX_DEPTH, DETAIL_THRESHOLD, color_mode) # building the quad tree of the child
+        max_depth = Build(child, image, max_depth, MAX_DEPTH, DETAIL_THRESHOLD, new_quadrant) # building the quad tree of the child
     return max_depth
 
-def Create_Image(root, max_depth, user_depth, color_mode='Color', show_lines=False):
+@Profiled('rasterize')
+def Rasterize(tree, leaf_quadrants, colours, show_lines=False):
+    '''
+    description:
+        This function paints the leaf quadrants straight into a numpy canvas, see Rasterize_Bands().
+    Args:
+        tree: QuadTree of the image
+        leaf_quadrants: indices of the quadrants to paint, which must cover the image without overlapping
+        colours: (N, channels) uint8 array with the colour of each quadrant, in any layout of Pixels.py
+        show_lines: flag to draw a line on the left and top edges of every quadrant
+    Returns:
+        canvas: (height, width, channels) uint8 array with the painted image
+    '''
+    width, height = tree.size
+    left, top, right, bottom = tree.bbox[0].tolist()
+    (row, pixels), = Rasterize_Bands(tree, leaf_quadrants, colours, show_lines) # without a band size the image is one band
+
+    if (left, top, right, bottom) == (0, 0, width, height):
+        return pixels
+
+    canvas = np.zeros((height, width, pixels.shape[2]), dtype=np.uint8)
+    canvas[top:bottom, left:right] = pixels # the black border outside the bounding box of the image stays black
+    return canvas
+
+def Rasterize_Bands(tree, leaf_quadrants, colours, show_lines=False, band_pixels=None):
+    '''
+    description:
+        This function paints the leaf quadrants into numpy arrays, one band of pixel rows at a time. The colours are first
+        painted into a grid with one cell per quadrant of the deepest leaf depth, coarse quadrants filling a whole block
+        of cells, and the rows of the grid are then stretched to the pixel size of the image, band by band.
+    Args:
+        tree: QuadTree of the image
+        leaf_quadrants: indices of the quadrants to paint, which must cover the image without overlapping
+        colours: (N, channels) uint8 array with the colour of each quadrant, in any layout of Pixels.py
+        show_lines: flag to draw a line on the left and top edges of every quadrant
+        band_pixels: most pixels in a band, a band always holds at least one row of cells, by default there is one band
+    Returns:
+        bands: generator of (row, pixels) tuples, where pixels is a (rows, right - left, channels) uint8 array with the pixels
+               of the bounding box of the root quadrant that start at pixel row row of the image
+    '''
+    left, top, right, bottom = tree.bbox[0].tolist()
+    depths = tree.depth[leaf_quadrants]
+    depth = int(depths.max())
+    channels = colours.shape[1]
+    line = Line_Colour(channels)
+
+    if 4 ** depth > (right - left) * (bottom - top):
+        # the grid would be larger than the image, so each quadrant is painted on its own instead
+        pixels = np.zeros((bottom - top, right - left, channels), dtype=np.uint8)
+        for (quadrant_left, quadrant_top, quadrant_right, quadrant_bottom), colour in zip((tree.bbox[leaf_quadrants] - [left, top, left, top]).tolist(), colours):
+            if quadrant_right > quadrant_left and quadrant_bottom > quadrant_top:
+                pixels[quadrant_top:quadrant_bottom, quadrant_left:quadrant_right] = colour
+                if show_lines:
+                    pixels[quadrant_top:quadrant_bottom, quadrant_left] = line
+                    pixels[quadrant_top, quadrant_left:quadrant_right] = line
+        yield top, pixels
+        return
+
+    x, y = Grid_Edges((left, top, right, bottom), depth) # pixel edges of the grid cells
+
+    cells = tree.cells()[leaf_quadrants]
+    bboxes = tree.bbox[leaf_quadrants]
+    grid = np.zeros((1, 1, channels), dtype=np.uint8)
+    edges = np.zeros((1, 1, 2), dtype=np.int32) # left and top pixel edge of the quadrant covering every cell
+
+    for level in range(depth + 1): # coarse to fine, each level doubling the grid before painting its quadrants into it
+        if level:
+            grid = grid.repeat(2, axis=0).repeat(2, axis=1)
+        at_level = depths == level
+        column, row = cells[at_level].T
+        grid[row, column] = colours[at_level]
+
+        if show_lines:
+            if level:
+                edges = edges.repeat(2, axis=0).repeat(2, axis=1)
+            edges[row, column] = bboxes[at_level][:, :2]
+
+    widths, heights = np.diff(x), np.diff(y)
+    if show_lines:
+        # a pixel is on the left edge of its quadrant when it is the first pixel of a cell that starts on that edge
+        first_column = np.zeros(right - left, dtype=bool)
+        first_column[x[:-1][widths > 0] - left] = True
+
+    if band_pixels is None:
+        breaks = [0, len(heights)]
+    else:
+        # rows of cells where a new band starts, each band holding about band_pixels pixels
+        band_index = np.cumsum(heights) * (right - left) // max(band_pixels, 1)
+        breaks = [0] + (np.flatnonzero(np.diff(band_index)) + 1).tolist() + [len(heights)]
+
+    for start, stop in zip(breaks[:-1], breaks[1:]):
+        band_heights = heights[start:stop]
+        rows = grid[start:stop].repeat(widths, axis=1) # one pixel row for every row of cells, all pixel rows of a cell row being the same
+
+        if show_lines:
+            rows[(edges[start:stop, :, 0] == x[None, :-1]).repeat(widths, axis=1) & first_column] = line
+
+        pixels = rows.repeat(band_heights, axis=0)
+
+        if show_lines:
+            # and on the top edge of its quadrant when it is in the first pixel row of a cell that starts on that edge
+            first_rows = y[start:stop][band_heights > 0] - y[start]
+            top_edges = (edges[start:stop, :, 1] == y[start:stop, None])[band_heights > 0].repeat(widths, axis=1)
+            lines = pixels[first_rows]
+            lines[top_edges] = line
+            pixels[first_rows] = lines
+
+        yield int(y[start]), pixels
+
+@Profiled('create_image')
+def Create_Image(tree, max_depth, user_depth, color_mode='Color', show_lines=False, backend='array'):
     """
     Description:
         Create an image representation of the quadtree with a specified depth.
 
     Args:
-        root: Dictionary representing the root quadrant.
+        tree: QuadTree of the image.
         max_depth: Maximum depth of the quadtree.
         depth: Depth of the image to be created.
+        color_mode: Name of the colour filter applied to the quadrants, see Filters.py.
         show_lines: Flag to indicate whether to draw lines around quadrants.
+        backend: 'array' paints the quadrants with Rasterize(), 'pil' draws every quadrant with ImageDraw.
 
     Returns:
-        An Image object representing the quadtree visualization.
+        An Image object representing the quadtree visualization, in the layout of the colours of the tree after the filter.
     """
-    # Get the width and height of the image
-    width, height = root['bbox'][2], root['bbox'][3]
+    # Get leaf quadrants for the specified depth
+    leaf_quadrants = Get_Leaf_Quadrants(tree, max_depth, user_depth)
+
+    # Filter the colours of all leaf quadrants at once
+    colours = Apply_Filter(tree.colour[leaf_quadrants], color_mode)
+
+    if backend == 'array':
+        return Array_Image(Rasterize(tree, leaf_quadrants, colours, show_lines))
+    elif backend != 'pil':
+        raise ValueError(f'Unknown render backend: {backend}')
 
     # Create a blank image canvas
-    image = Image.new('RGB', (int(width), int(height)))
+    image = Image.new(LAYOUTS[colours.shape[1]], tree.size)
+    line = tuple(Line_Colour(colours.shape[1]).tolist())
     draw = ImageDraw.Draw(image)
-    draw.rectangle((0, 0, width, height), (0, 0, 0))
-
-    # Get leaf quadrants for the specified depth
-    leaf_quadrants = Get_Leaf_Quadrants(root, max_depth, user_depth)
 
     # Draw rectangle size of quadrant for each leaf quadrant
-    for quadrant in leaf_quadrants:
-        bbox = quadrant['bbox']
-        if color_mode == 'Gray Scale':
-            color = (quadrant['grayscale'],) * 3
-        elif color_mode == 'Black and White':
-            color = (quadrant['bw'],) * 3
-        elif color_mode == 'Sepia':
-            color = quadrant['sepia']
-        elif color_mode == 'Inverted':
-            color = quadrant['inverted']
-        elif color_mode == 'Thresholded':
-            color = quadrant['thresholded']
-        elif color_mode == 'Brightened':
-            color = quadrant['Brightened']
-        elif color_mode == 'High Contrast':
-            color = quadrant['Contrast']
-        elif color_mode == 'Soft Blur':
-            color = quadrant['Soft Blur']
-        elif color_mode == 'Emboss-like':
-            color = quadrant['Emboss-like']
-        else:
-            color = quadrant['colour']
+    for (left, top, right, bottom), color in zip(tree.bbox[leaf_quadrants].tolist(), map(tuple, colours.tolist())):
+        if right == left or bottom == top:
+            continue # empty quadrants cover no pixels
+
+        # the pixel bounding box is exclusive on the right and bottom, while ImageDraw includes them
+        draw.rectangle((left, top, right - 1, bottom - 1), color if len(color) > 1 else color[0])
         if show_lines:
-            draw.rectangle(bbox, color, outline=(0, 0, 0))
-        else:
-            draw.rectangle(bbox, color)
+            draw.line(((left, bottom - 1), (left, top), (right - 1, top)), line if len(line) > 1 else line[0]) # the left and top edges, the right and bottom ones belong to the next quadrants
 
     return image
 
-def Get_Leaf_Quadrants(root, max_depth, user_depth):
+def Get_Leaf_Quadrants(tree, max_depth, user_depth):
     '''
     description:
         This function gets the leaf quadrants of the quad tree.
     Args:
-        root: dictionary to store the details of the root quadrant
+        tree: QuadTree of the image
         max_depth: maximum depth of the quad tree
         depth: depth of the quad tree
     Returns:
-        quadrants: list of leaf quadrants
+        quadrants: array with the indices of the leaf quadrants
     '''
 
     if user_depth > max_depth:
         raise ValueError('A depth larger than the trees depth was given')
 
-    quandrants = []
-    Recursive_Search(root, user_depth, quandrants.append)
-    return quandrants
+    return tree.leaves_at_depth(user_depth)
 
-def Recursive_Search(quadrant, max_depth, append_leaf):
+
+def Paint_Level(canvas, tree, depth, colours, show_lines=False):
     '''
     description:
-        This function recursively searches the quad tree.
+        This function paints the quadrants at one depth of the tree onto a canvas that shows the tree cut at the depth above.
+        These are the children of the quadrants that were split at the depth above, so only they are repainted,
+        and the canvas then shows the tree cut at the given depth.
     Args:
-        quadrant: dictionary to store the details of the quadrant
+        canvas: (height, width, channels) uint8 array that is painted in place
+        tree: QuadTree of the image
+        depth: depth of the quadrants to paint
+        colours: (N, channels) uint8 array with the colour of every quadrant of the tree
+        show_lines: flag to draw a line on the left and top edges of every painted quadrant
+    '''
+    level = tree.level(depth)
+    Paint_Cells(canvas, tree.bbox[0].tolist(), depth, tree.cells()[level], colours[level], show_lines)
+
+@Profiled('paint_cells')
+def Paint_Cells(canvas, bbox, depth, cells, colours, show_lines=False):
+    '''
+    description:
+        This function paints quadrants of one depth onto a canvas, given by their grid cells instead of a QuadTree.
+    Args:
+        canvas: (height, width, channels) uint8 array that is painted in place
+        bbox: pixel bounding box of the root quadrant
+        depth: depth of the quadrants to paint
+        cells: (N, 2) array with the column and row of every quadrant to paint, see QuadTree.cells()
+        colours: (N, channels) uint8 array with the colour of every quadrant to paint
+        show_lines: flag to draw a line on the left and top edges of every painted quadrant
+    '''
+    if len(cells) == 0:
+        return
+
+    left, top, right, bottom = bbox
+    x, y = Grid_Edges((left, top, right, bottom), depth) # pixel edges of the grid cells
+    column, row = np.asarray(cells).T
+    line = Line_Colour(canvas.shape[2])
+
+    if 4 ** depth > (right - left) * (bottom - top):
+        # the grid would be larger than the image, so each quadrant is painted on its own instead
+        for left, top, right, bottom, colour in zip(x[column].tolist(), y[row].tolist(), x[column + 1].tolist(), y[row + 1].tolist(), colours):
+            if right > left and bottom > top:
+                canvas[top:bottom, left:right] = colour
+                if show_lines:
+                    canvas[top:bottom, left] = line
+                    canvas[top, left:right] = line
+        return
+
+    widths, heights = np.diff(x), np.diff(y)
+
+    grid = np.zeros((2 ** depth, 2 ** depth, canvas.shape[2]), dtype=np.uint8)
+    painted = np.zeros((2 ** depth, 2 ** depth), dtype=bool)
+    grid[row, column] = colours
+    painted[row, column] = True
+
+    rows, painted_rows = grid.repeat(widths, axis=1), painted.repeat(widths, axis=1) # one pixel row for every row of cells
+    if show_lines:
+        first_column = np.zeros(right - left, dtype=bool)
+        first_column[x[:-1][widths > 0] - left] = True
+        rows[painted_rows & first_column] = line # every cell is a quadrant of its own, so its first pixel column is its left edge
+
+    pixels, painted_pixels = rows.repeat(heights, axis=0), painted_rows.repeat(heights, axis=0)
+    if show_lines:
+        first_rows = y[:-1][heights > 0] - top
+        lines = pixels[first_rows]
+        lines[painted_pixels[first_rows]] = line # and its first pixel row is its top edge
+        pixels[first_rows] = lines
+
+    np.copyto(canvas[top:bottom, left:right], pixels, where=painted_pixels[:, :, None])
+
+def Gif_Frames(tree, max_depth, gif_depth, duration=1000, color_mode='Color', show_lines=False):
+    '''
+    description:
+        This function generates the frames of the gif of the quad tree one at a time, from the root quadrant down to gif_depth.
+        Every frame is painted on top of the one before it, so the same canvas is given for every frame.
+        A gif has no alpha channel, so the frames are opaque RGB, see Opaque_Colours().
+    Args:
+        tree: QuadTree of the image
         max_depth: maximum depth of the quad tree
-        append_leaf: flag to append the leaf quadrant
+        gif_depth: depth of the last frame
+        duration: duration of every frame, the last frame is shown four times as long
+        color_mode: name of the colour filter applied to the quadrants
+        show_lines: flag to show the lines in the gif
+    Returns:
+        frames: generator of (canvas, duration) tuples
+    '''
+    if gif_depth > max_depth:
+        raise ValueError('A depth larger than the trees depth was given')
+
+    colours = Opaque_Colours(Apply_Filter(tree.colour, color_mode))
+    width, height = tree.size
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+
+    for depth in range(gif_depth + 1):
+        Paint_Level(canvas, tree, depth, colours, show_lines)
+        yield canvas, duration if depth < gif_depth else 4 * duration
+
+@Profiled('gif_palette')
+def Gif_Palette(tree, gif_depth, color_mode='Color'):
     '''
+    description:
+        This function creates one palette for all the frames of the gif from the colours of the quadrants shown in it.
+    Returns:
+        palette: 'P' image holding the palette
+    '''
+    colours = Opaque_Colours(Apply_Filter(tree.colour[:tree.level(gif_depth).stop], color_mode))
+    palette = Image.fromarray(colours[None]).quantize(colors=255, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE).getpalette()
+
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette((palette + [0] * 765)[:765] + [0, 0, 0]) # the last colour is black, for the lines
+    return palette_image
 
-    if quadrant['leaf'] == True or quadrant['depth'] == max_depth:
-        append_leaf(quadrant)
-    elif quadrant['children'] != None:
-        for child in quadrant['children']:
-            Recursive_Search(child, max_depth, append_leaf)
+@Profiled('write_gif')
+def Write_Gif(fp, frames, loop=0):
+    '''
+    description:
+        This function writes the frames of a gif one at a time, so no more than one frame is held in memory.
+        All frames must share one palette, which is written once as the global colour table of the gif.
+    Args:
+        fp: file object to write the gif to
+        frames: iterable of ('P' image, duration) tuples
+        loop: number of times to loop the gif, 0 loops forever
+    '''
+    from PIL import GifImagePlugin
 
+    for index, (frame, duration) in enumerate(frames):
+        if index == 0:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': loop, 'duration': duration, 'optimize': False})
+            fp.write(b''.join(header))
+        for data in GifImagePlugin.getdata(frame, duration=duration):
+            fp.write(data)
+    fp.write(b';') # gif trailer
 
-def Create_Gif(root, max_depth, gif_depth, duration=1000, loop=0, color_mode='Color', show_lines=False):
+@Profiled('create_gif')
+def Create_Gif(tree, max_depth, gif_depth, duration=1000, loop=0, color_mode='Color', show_lines=False, progress=None):
     '''
     description:
         This function creates a gif of the quad tree.
     Args:
-        root: dictionary to store the details of the root quadrant
+        tree: QuadTree of the image
         max_depth: maximum depth of the quad tree
-        file_name: name of the gif file
-        duration: duration of the gif
+        gif_depth: depth of the last frame
+        duration: duration of every frame, the last frame is shown four times as long
         loop: flag to loop the gif
         show_lines: flag to show the lines in the gif
+        progress: function called with the depth and the number of quadrants shown after every frame is written
     '''
+    palette = Gif_Palette(tree, gif_depth, color_mode)
+    frames = Gif_Frames(tree, max_depth, gif_depth, duration, color_mode, show_lines)
 
-    gif = []
-    end_product_image = Create_Image(root, max_depth, gif_depth, color_mode, show_lines=show_lines)
-
-    for i in range(gif_depth):
-        image = Create_Image(root, max_depth, i, color_mode, show_lines=show_lines)
-        gif.append(image)
-    for _ in range(4):
-        gif.append(end_product_image)
+    def quantized_frames():
+        for depth, (canvas, frame_duration) in enumerate(frames):
+            yield Image.fromarray(canvas).quantize(palette=palette, dither=Image.Dither.NONE), frame_duration
+            if progress:
+                progress(depth, tree.level(depth).stop) # the frame has been written by now
 
     gif_bytes = io.BytesIO()
-    gif[0].save(
-        gif_bytes,
-        format='GIF',
-        save_all=True,
-        append_images=gif[1:],
-        duration=duration, loop=loop)
+    Write_Gif(gif_bytes, quantized_frames(), loop)
     gif_bytes.seek(0)
 
     return gif_bytes
 
-def main(image_path, option, set, need_gif=False):
+COMPRESSION_LEVELS = { # (DETAIL_THRESHOLD, MAX_DEPTH) of every compression level, the coarsest first
+    'Pixelated': (10, 7),
+    'Average': (7, 8),
+    'Refined': (3, 9),
+}
+
+def Compression_Settings(option):
+    '''
+    description:
+        This function gets the settings of a compression level.
+    Args:
+        option: a level of COMPRESSION_LEVELS, 'Pixelated', 'Average' or 'Refined'
+    Returns:
+        DETAIL_THRESHOLD: detail intensity below which a quadrant is not split
+        MAX_DEPTH: deepest depth of the quadrants that can still be split, also the depth of the compressed image
+    '''
+    if option in COMPRESSION_LEVELS:
+        return COMPRESSION_LEVELS[option]
+    raise ValueError(f'Unknown compression level: {option}')
 
+def Open_Image(data, SIZE_MULTIPLIER=1):
+    # decodes the bytes of an image into its layout of Pixels.py, resized by the size multiplier
+    with Stage('decode'):
+        image = Image.open(io.BytesIO(data)) # opening the image
+        image.load()
+        image = Normalize_Image(image) # the only conversion of the image, every later stage keeps its layout
+    if SIZE_MULTIPLIER != 1:
+        image = image.resize((image.size[0] * SIZE_MULTIPLIER, image.size[1] * SIZE_MULTIPLIER)) # resizing the image
+    return image
+
+def Png_Size(tree, color_mode='Color'):
+    # bytes of the compressed image of a tree saved as a png, the same way it is saved for download
+    data = io.BytesIO()
+    Create_Image(tree, tree.max_depth, tree.max_depth, color_mode=color_mode).save(data, format='PNG')
+    return data.tell()
+
+def Target_Tree(data, SIZE_MULTIPLIER, MAX_DEPTH, target, color_mode='Color', progress=None, measure='weighted_std'):
+    '''
+    description:
+        This function gets the tree of an image that meets a target instead of using the detail threshold of a compression level.
+        The full tree of the image is built once and cached, and the tree of every target is cut from it.
+    Args:
+        data: bytes of the image
+        target: ('leaves', budget), ('bytes', size of the png) or ('psnr', decibels), see RateControl.select()
+        color_mode: name of the colour filter, the png of a 'bytes' target is measured with it applied
+        progress: function called with the depth and the number of quadrants built so far while the full tree is built
+        measure: detail measure ordering the splits, see Metrics.py
+    Returns:
+        tree: QuadTree meeting the target
+    '''
+    kind, value = target
+    rate_key = Cache_Key(Image_Key(data), SIZE_MULTIPLIER, MAX_DEPTH, measure)
+    rate = RATE_CACHE.get(rate_key)
+    if rate is None:
+        rate = Start_Rate_Control(Open_Image(data, SIZE_MULTIPLIER), MAX_DEPTH, progress, measure)
+        RATE_CACHE.put(rate_key, rate)
+        if Active_Profile():
+            Active_Profile().count_nodes(rate.tree.depth)
+
+    splits = rate.select(kind, value, lambda tree: Png_Size(tree, color_mode))
+    return rate.prune(splits)
+
+def Compression_Tree(data, option, set, workers=1, progress=None, target=None, time_budget=None, measure='weighted_std'):
+    '''
+    description:
+        This function gets the quad tree main() compresses an image with, from the tree cache when it was built before.
+        The tree is cached by the bytes of the image and the settings it was built with, and the outputs of main() by the
+        key of the tree and the settings they were rendered with, so changing only the filter reuses the tree.
+    Args:
+        data: bytes of the image
+        progress: function called with the stage, a depth and a number of quadrants as the tree is built, see Compress_Image()
+        other arguments: see main()
+    Returns:
+        tree: QuadTree of the image
+        tree_key: cache key of the tree
+        MAX_DEPTH: maximum depth of the compression level
+    '''
     SIZE_MULTIPLIER = 1
-    if option == 'Pixelated':
-        DETAIL_THRESHOLD = 10
-        MAX_DEPTH = user_depth = 7
-    elif option == 'Average':
-        DETAIL_THRESHOLD = 7
-        MAX_DEPTH = user_depth = 8
-    elif option == 'Refined':
-        DETAIL_THRESHOLD = 3
-        MAX_DEPTH = user_depth = 9
-        
-
-    image = Image.open(image_path) # opening the image
-    image = image.resize((image.size[0] * SIZE_MULTIPLIER, image.size[1] * SIZE_MULTIPLIER)) # resizing the image
-
-    root, max_depth = Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD, color_mode=set) # starting the quad tree of the image
-    image = Create_Image(root, max_depth, user_depth, color_mode=set, show_lines=False)
-    
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
 
+    build_progress = progress and (lambda depth, nodes: progress('build', depth, nodes))
+    if target is None:
+        tree_key = Cache_Key(Image_Key(data), SIZE_MULTIPLIER, MAX_DEPTH, DETAIL_THRESHOLD, measure)
+    else:
+        target = tuple(target) # a target given as a list gets the same key
+        tree_key = Cache_Key(Image_Key(data), SIZE_MULTIPLIER, MAX_DEPTH, target, set if target[0] == 'bytes' else None, measure) # only the png size depends on the filter
+    tree = TREE_CACHE.get(tree_key)
+
+    if tree is None and target is not None:
+        tree = Target_Tree(data, SIZE_MULTIPLIER, MAX_DEPTH, target, set, build_progress, measure)
+        TREE_CACHE.put(tree_key, tree)
+    elif tree is None:
+        image = Open_Image(data, SIZE_MULTIPLIER)
+        if time_budget is None:
+            tree, _ = Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD, workers=workers, progress=build_progress, measure=measure) # starting the quad tree of the image
+        else:
+            tree, _ = Start_QuadTree(image, MAX_DEPTH, DETAIL_THRESHOLD, 'best_first', progress=build_progress, time_budget=time_budget, measure=measure)
+        if Active_Profile():
+            Active_Profile().count_nodes(tree.depth)
+
+        if time_budget is None or not np.any(tree.leaf & (tree.depth <= MAX_DEPTH) & (tree.detail >= DETAIL_THRESHOLD)):
+            TREE_CACHE.put(tree_key, tree)
+        else:
+            # a tree cut short by the time budget is not the tree of the settings, the builds stopping at the same size
+            # are the same though, so only its outputs are cached, by its size
+            tree_key = Cache_Key(tree_key, 'best_first', len(tree))
+    return tree, tree_key, MAX_DEPTH
+
+def Compress_Image(image_path, option, set, need_gif=False, workers=1, progress=None, target=None, time_budget=None, measure='weighted_std', palette=None, depth=None):
+    # the pipeline of main(), progress is an optional function called with the stage ('build', 'render' or 'gif'),
+    # a depth and a number of quadrants as the work goes on, which can stop the work by raising an exception
+    data = Image_Bytes(image_path)
+    tree, tree_key, MAX_DEPTH = Compression_Tree(data, option, set, workers, progress, target, time_budget, measure)
+    max_depth = tree.max_depth
+    user_depth = min(MAX_DEPTH if depth is None else depth, max_depth) # an image without detail has a shallower tree
+
+    image_key = Cache_Key(tree_key, set, user_depth, False)
+    image = IMAGE_CACHE.get(image_key)
+    if image is None:
+        image = Create_Image(tree, max_depth, user_depth, color_mode=set, show_lines=False)
+        IMAGE_CACHE.put(image_key, image)
+    if progress:
+        progress('render', user_depth, len(tree))
+
+    gif = None
     if need_gif == True:
-        gif = Create_Gif(root, max_depth, user_depth, duration=1000, loop=0, color_mode=set, show_lines=True)
-        return image, gif
-    return image
+        gif_key = Cache_Key(tree_key, set, user_depth, True, 1000, 0)
+        gif = GIF_CACHE.get(gif_key)
+        if gif is None:
+            gif_progress = progress and (lambda depth, nodes: progress('gif', depth, nodes))
+            gif = Create_Gif(tree, max_depth, user_depth, duration=1000, loop=0, color_mode=set, show_lines=True, progress=gif_progress).getvalue()
+            GIF_CACHE.put(gif_key, gif)
+
+    if palette:
+        palette = Tree_Palette(tree, user_depth, palette, set) # from the leaves, the image is never read back
+    return Result(image, gif, palette or None) # the cached image and gif are shared, not copied
+
+def main(image_path, option, set, need_gif=False, workers=1, progress=None, profile=False, trace_memory=False, target=None, time_budget=None, measure='weighted_std', palette=None, depth=None):
+    '''
+    description:
+        This function compresses an image, and creates the gif of its quad tree when need_gif is set.
+        With a target, ('leaves', budget), ('bytes', size of the png) or ('psnr', decibels), the detail threshold of the
+        compression level is replaced by the one meeting the target, see Target_Tree(); the level still sets the depth.
+        With a time_budget in seconds, the tree is built best first and stops splitting once the budget is spent,
+        see Build_Best_First(), so the most detailed tree that could be built in time is used; it is not used with a target.
+        The measure is the detail measure compared to the detail threshold, see Metrics.py; the thresholds of the
+        compression levels were chosen for 'weighted_std'.
+        With a palette, a number of colours, the (colours, shares) of the dominant colours of the compressed image
+        are found as well, see Tree_Palette().
+        With a depth, the tree is cut at that depth for the compressed image and the gif instead of the depth of the level.
+        With profile set, the stages of the run are profiled and the report of the profile is kept in the result,
+        see Profiling.py; setting the QUADTREE_PROFILE environment variable profiles every run for the metrics only.
+    Returns:
+        result: Result with the compressed image, which it encodes on demand, the gif when need_gif is set,
+                the dominant colours when palette is set and the profile report when profile is set, see Result.py
+    '''
+    if not (profile or PROFILE_ALL):
+        return Compress_Image(image_path, option, set, need_gif, workers, progress, target, time_budget, measure, palette, depth)
+
+    with Profile(memory=trace_memory or PROFILE_MEMORY) as run_profile:
+        result = Compress_Image(image_path, option, set, need_gif, workers, progress, target, time_budget, measure, palette, depth)
+
+    if profile:
+        result.report = run_profile.report()
+    return result
 
 # High quality image:
 # user_depth = 8, MAX_DEPTH = 8, DETAIL_THRESHOLD = 5, SIZE_MULTIPLIER = 1
@@ -0,0 +1,189 @@
+import numpy as np
+
+# The detail of a quadrant decides whether it is split. Every measure is computed for many quadrants at once, from the
+# sums and squared sums of their pixels, which the summed-area tables give for any rectangle, or from their pixels.
+#   'weighted_std': standard deviation of every channel, weighted by the sensitivity of the eye to it
+#   'max_std': standard deviation of the channel that varies the most
+#   'mad': mean absolute deviation of every channel from its average, weighted like 'weighted_std'
+#   'lab': root mean square distance of the pixels to their average in CIELAB, the CIE76 colour difference
+# The alpha channel of an image with transparency takes part in every measure, so the edges of transparent areas are split.
+MEASURES = ('weighted_std', 'max_std', 'mad', 'lab')
+LUMA_WEIGHTS = np.array([0.2989, 0.5870, 0.1140]) # eye sensitivity weights of the red, green and blue channels
+ALPHA_WEIGHT = 1.0 # weight of the alpha channel, a step in opacity counts as much as the same step in grey
+LAB_SCALE = 16 # CIELAB values are stored as integers in steps of 1 / LAB_SCALE, so they fit the summed-area tables
+
+# sRGB to CIELAB under the D65 white point
+SRGB_TO_LINEAR = np.where(np.arange(256) / 255 <= 0.04045, np.arange(256) / 255 / 12.92, ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4)
+RGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+]) / np.array([[0.95047], [1.0], [1.08883]]) # divided by the white point, so white is (1, 1, 1)
+
+def Colour_Channels(channels):
+    # number of colour channels of pixels with the given number of channels, the last channel of LA and RGBA is alpha
+    return 1 if channels <= 2 else 3
+
+def Channel_Weights(channels):
+    '''
+    description:
+        This function gets the weights of the channels in the weighted measures, for pixels with any number of channels.
+        Grey pixels have one colour channel, which takes all the weight, and the alpha channel takes ALPHA_WEIGHT.
+    Args:
+        channels: number of channels of the pixels, 1 (L), 2 (LA), 3 (RGB) or 4 (RGBA)
+    Returns:
+        weights: (channels,) array with the weight of every channel
+    '''
+    weights = np.full(channels, ALPHA_WEIGHT)
+    weights[:Colour_Channels(channels)] = LUMA_WEIGHTS if channels >= 3 else 1.0
+    return weights
+
+def Moment_Detail(sums, squares, count, measure='weighted_std'):
+    '''
+    description:
+        This function calculates the detail of many quadrants at once from the sums and the squared sums of their pixels.
+        Quadrants without pixels have no detail.
+    Args:
+        sums: (N, channels) array with the pixel sums of every quadrant, of its CIELAB pixels for 'lab', see Lab_Pixels()
+        squares: (N, channels) array with the sums of the squared pixels of every quadrant
+        count: (N,) or (N, 1) array with the number of pixels in every quadrant
+        measure: 'weighted_std', 'max_std' or 'lab', the 'mad' measure needs the pixels, see Region_Mad()
+    Returns:
+        detail: (N,) float array with the detail of every quadrant
+    '''
+    sums, squares = np.asarray(sums, dtype=np.float64), np.asarray(squares, dtype=np.float64)
+    count = np.asarray(count).reshape(-1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.maximum((squares - sums * (sums / count)) / count, 0)
+    variance[count[:, 0] == 0] = 0 # an empty quadrant has no detail to split
+
+    if measure == 'weighted_std':
+        return np.sqrt(variance) @ Channel_Weights(variance.shape[1])
+    if measure == 'max_std':
+        return np.sqrt(variance.max(axis=1))
+    if measure == 'lab':
+        return np.sqrt(variance.sum(axis=1)) / LAB_SCALE
+    if measure == 'mad':
+        raise ValueError('The mad measure needs the pixels of the quadrants, not their sums')
+    raise ValueError(f'Unknown detail measure: {measure}')
+
+def Histogram_Statistics(histogram, measure='weighted_std'):
+    '''
+    description:
+        This function calculates the detail and the average colour of a quadrant from the histogram of its pixels,
+        with 256 bins for every band of the image, as Image.histogram() gives it.
+    Args:
+        histogram: list with the pixel counts of every value of every band
+        measure: 'weighted_std', 'max_std' or 'mad', the 'lab' measure needs the pixels, see Pixel_Detail()
+    Returns:
+        detail: detail of the quadrant, 0 for a quadrant without pixels
+        colour: tuple with the truncated average of every band
+    '''
+    histogram = np.asarray(histogram, dtype=np.float64).reshape(-1, 256) # one row for every band
+    values = np.arange(256)
+    total = histogram[0].sum()
+    if total == 0:
+        return 0, (0,) * len(histogram) # an empty quadrant has no detail to split
+
+    average = histogram @ values / total
+    colour = tuple(int(value) for value in average)
+    if measure == 'mad':
+        deviation = (histogram * np.abs(values - average[:, None])).sum(axis=1) / total
+        return float(deviation @ Channel_Weights(len(histogram))), colour
+
+    sums = histogram @ values
+    squares = histogram @ (values * values)
+    return float(Moment_Detail(sums[None], squares[None], [total], measure)[0]), colour
+
+def Lab_Pixels(pixels):
+    '''
+    description:
+        This function converts sRGB pixels to CIELAB, scaled by LAB_SCALE and rounded to integers. Grey pixels are
+        converted as the RGB pixels with the same value in every channel, and the alpha channel is kept after the
+        colour, scaled from 0 to 100 like L*, so a step in opacity is as far as the same step in lightness.
+    Args:
+        pixels: (..., channels) uint8 array of the pixels
+    Returns:
+        lab: (..., 3) int32 array with the L*, a* and b* of every pixel times LAB_SCALE, (..., 4) with the alpha
+    '''
+    pixels = np.asarray(pixels)
+    channels = pixels.shape[-1]
+    rgb = pixels[..., [0, 0, 0]] if Colour_Channels(channels) == 1 else pixels[..., :3]
+    xyz = SRGB_TO_LINEAR[rgb] @ RGB_TO_XYZ.T
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+
+    lab = np.empty(f.shape[:-1] + (3 + (channels > Colour_Channels(channels)),))
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    if lab.shape[-1] == 4:
+        lab[..., 3] = pixels[..., -1] * (100 / 255)
+    return np.rint(lab * LAB_SCALE).astype(np.int32)
+
+def Pixel_Detail(pixels, measure='weighted_std'):
+    '''
+    description:
+        This function calculates the detail of a quadrant from its pixels.
+    Args:
+        pixels: (height, width, channels) or (height, width) array with the pixels of the quadrant
+        measure: any of MEASURES
+    Returns:
+        detail: detail of the quadrant, 0 for a quadrant without pixels
+    '''
+    pixels = np.asarray(pixels)
+    pixels = pixels.reshape(-1, pixels.shape[2] if pixels.ndim == 3 else 1)
+    if len(pixels) == 0:
+        return 0
+    if measure == 'mad':
+        average = pixels.mean(axis=0)
+        return float(np.abs(pixels - average).mean(axis=0) @ Channel_Weights(pixels.shape[1]))
+
+    if measure == 'lab':
+        pixels = Lab_Pixels(pixels)
+    pixels = pixels.astype(np.int64)
+    return float(Moment_Detail(pixels.sum(axis=0)[None], (pixels * pixels).sum(axis=0)[None], [len(pixels)], measure)[0])
+
+def Region_Mad(pixels, bounds, average, band_pixels=1 << 20):
+    '''
+    description:
+        This function calculates the 'mad' detail of many quadrants at once from the pixels of the image. Quadrants of
+        the same size, of which one depth of the tree has no more than four, are gathered into one array, at most
+        band_pixels pixels at a time, and a quadrant larger than that is read one band of rows at a time.
+    Args:
+        pixels: (height, width, channels) array of the image
+        bounds: (N, 4) integer array with the pixel bounding boxes of the quadrants
+        average: (N, channels) array with the average pixel of every quadrant
+        band_pixels: most pixels gathered at a time
+    Returns:
+        detail: (N,) float array with the detail of every quadrant
+    '''
+    bounds = np.asarray(bounds, dtype=np.intp).reshape(-1, 4)
+    left, top, right, bottom = bounds.T
+    width, height = np.maximum(right - left, 0), np.maximum(bottom - top, 0)
+    deviation = np.zeros(np.shape(average))
+
+    sizes, group = np.unique(np.stack([height, width], axis=1), axis=0, return_inverse=True)
+    for number, (rows, columns) in enumerate(sizes.tolist()):
+        members = np.flatnonzero(group.ravel() == number)
+        if rows * columns == 0:
+            continue
+
+        if rows * columns > band_pixels: # one quadrant at a time, in bands of rows
+            step = max(1, band_pixels // columns)
+            for index in members.tolist():
+                for row in range(top[index], bottom[index], step):
+                    band = pixels[row:min(row + step, bottom[index]), left[index]:right[index]]
+                    deviation[index] += np.abs(band - average[index]).sum(axis=(0, 1))
+            continue
+
+        for start in range(0, len(members), max(1, band_pixels // (rows * columns))):
+            chunk = members[start:start + max(1, band_pixels // (rows * columns))]
+            y = top[chunk, None] + np.arange(rows)
+            x = left[chunk, None] + np.arange(columns)
+            gathered = pixels[y[:, :, None], x[:, None, :]] # (quadrants, rows, columns, channels)
+            deviation[chunk] = np.abs(gathered - average[chunk, None, None, :]).sum(axis=(1, 2))
+
+    count = (width * height)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.where(count > 0, deviation / count, 0) # an empty quadrant has no detail to split
+    return deviation @ Channel_Weights(deviation.shape[1])
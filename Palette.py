@@ -0,0 +1,130 @@
+import math
+import numpy as np
+from Filters import Apply_Filter
+from Pixels import Opaque_Colours
+from Profiling import Profiled
+
+PALETTE_SAMPLES = 1 << 16 # most colours clustered at once, more are sampled down to this many by Dominant_Colours()
+KMEANS_RESTARTS = 4 # runs of Weighted_KMeans() from different seeds, the best one is kept
+KMEANS_ITERATIONS = 300 # most iterations of every run of Weighted_KMeans(), as scikit-learn's KMeans
+KMEANS_TOLERANCE = 1e-4 # the clustering stops when the centres move less than this times the variance of the colours
+
+def Weighted_KMeans(points, weights, k, restarts=KMEANS_RESTARTS, iterations=KMEANS_ITERATIONS, tolerance=KMEANS_TOLERANCE, seed=0):
+    '''
+    description:
+        This function clusters weighted points with k-means, a point of weight w counting as w equal points.
+        The centres are seeded with greedy k-means++, trying 2 + log(k) candidates for every centre as scikit-learn does,
+        and moved with Lloyd's iterations until they settle. The clustering is run restarts times from different seeds
+        and the one leaving the least weighted squared distance is kept. There are fewer than k clusters when the points
+        have fewer than k distinct values.
+    Args:
+        points: (N, channels) array of the points
+        weights: (N,) array with the weight of every point
+        k: number of clusters
+        restarts: number of times the clustering is run
+        iterations: most iterations of every run
+        tolerance: the iterations stop once the centres move less than tolerance times the mean variance of the points
+        seed: seed of the random seeding
+    Returns:
+        centres: (clusters, channels) float array with the centre of every cluster, the heaviest cluster first
+        shares: (clusters,) array with the fraction of the weight of the points in every cluster
+    '''
+    points, weights = np.asarray(points, dtype=np.float64), np.asarray(weights, dtype=np.float64)
+    keep = weights > 0
+    points, weights = points[keep], weights[keep]
+    if len(points) == 0 or k < 1:
+        return np.zeros((0, points.shape[1])), np.zeros(0)
+
+    rng = np.random.default_rng(seed)
+    total = weights.sum()
+    squares = (points * points).sum(axis=1)
+    mean = weights @ points / total
+    threshold = tolerance * (weights @ (points - mean) ** 2 / total).mean()
+
+    def distances(centres):
+        # squared distance of every point to every centre, expanded so no (N, k, channels) array is made
+        return np.maximum(squares[:, None] - 2 * points @ centres.T + (centres * centres).sum(axis=1), 0)
+
+    best = None
+    for _ in range(max(restarts, 1)):
+        centres = points[[rng.choice(len(points), p=weights / total)]]
+        closest = distances(centres)[:, 0]
+        while len(centres) < k:
+            potential = weights * closest
+            if potential.sum() <= 0:
+                break # every point is on a centre already
+            trials = rng.choice(len(points), size=2 + int(math.log(k)), p=potential / potential.sum())
+            trial_closest = np.minimum(closest[:, None], distances(points[trials]))
+            chosen = np.argmin(weights @ trial_closest) # the candidate leaving the least weighted distance
+            centres = np.concatenate([centres, points[trials[chosen]][None]])
+            closest = trial_closest[:, chosen]
+
+        for _ in range(iterations):
+            labels = np.argmin(distances(centres), axis=1)
+            cluster_weights = np.bincount(labels, weights, minlength=len(centres))
+            sums = np.stack([np.bincount(labels, weights * channel, minlength=len(centres)) for channel in points.T], axis=1)
+            moved, filled = centres.copy(), cluster_weights > 0 # an empty cluster keeps its centre
+            moved[filled] = sums[filled] / cluster_weights[filled, None]
+            shift = ((moved - centres) ** 2).sum()
+            centres = moved
+            if shift <= threshold:
+                break
+
+        closest = distances(centres)
+        labels = np.argmin(closest, axis=1)
+        inertia = weights @ closest[np.arange(len(points)), labels]
+        if best is None or inertia < best[0]:
+            best = (inertia, centres, labels)
+
+    _, centres, labels = best
+    shares = np.bincount(labels, weights, minlength=len(centres)) / total
+    order = np.argsort(-shares, kind='stable')
+    return centres[order], shares[order]
+
+@Profiled('palette')
+def Dominant_Colours(colours, weights=None, k=3, samples=PALETTE_SAMPLES, seed=0):
+    '''
+    description:
+        This function finds the k dominant colours of weighted colours with Weighted_KMeans(). When there are more
+        than samples colours, samples of them are drawn with a chance in proportion to their weight and clustered
+        with equal weights instead, which keeps the cost the same for any number of colours.
+    Args:
+        colours: (N, channels) array of colours
+        weights: (N,) array with the weight of every colour, like the number of pixels it covers, all equal by default
+        k: number of dominant colours
+        samples: most colours clustered at once
+        seed: seed of the sampling and of the clustering
+    Returns:
+        colours: (clusters, channels) uint8 array with the dominant colours, the most common first, at most k of them
+        shares: (clusters,) array with the fraction of the weight of the colours closest to every dominant colour
+    '''
+    colours = np.asarray(colours)
+    weights = np.ones(len(colours)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    if len(colours) > samples and weights.sum() > 0:
+        rng = np.random.default_rng(seed)
+        picked = rng.choice(len(colours), size=samples, p=weights / weights.sum())
+        colours, weights = colours[picked], np.ones(samples)
+
+    centres, shares = Weighted_KMeans(colours, weights, k, seed=seed)
+    return np.clip(np.rint(centres), 0, 255).astype(np.uint8), shares
+
+def Tree_Palette(tree, user_depth, k=3, color_mode='Color'):
+    '''
+    description:
+        This function finds the dominant colours of the compressed image of a quad tree from its leaf quadrants, each
+        weighted by its number of pixels. The compressed image is made of exactly these colours over exactly these areas,
+        so this clusters the same colours as clustering every pixel of the image, without rendering or reading it.
+    Args:
+        tree: QuadTree of the image
+        user_depth: depth the tree is cut at for the compressed image
+        k: number of dominant colours
+        color_mode: name of the colour filter applied to the compressed image
+    Returns:
+        colours: (clusters, 3) uint8 array with the dominant RGB colours, the most common first, at most k of them
+        shares: (clusters,) array with the fraction of the image covered by the colours closest to every dominant colour
+    '''
+    leaves = tree.leaves_at_depth(user_depth)
+    left, top, right, bottom = tree.bbox[leaves].T.astype(np.int64)
+    colours = Opaque_Colours(Apply_Filter(tree.colour[leaves], color_mode)) # swatches are shown opaque
+    return Dominant_Colours(colours, (right - left) * (bottom - top), k)
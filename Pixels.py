@@ -0,0 +1,96 @@
+import numpy as np
+from PIL import Image
+
+# Every image is turned into one of these channel layouts once, when it is opened, and the quad tree, its colours and
+# the compressed image keep that layout. Grey images are built with one channel, a third of the work of an RGB image,
+# and the alpha channel of an image with transparency is the last channel and takes part in the detail of the quadrants.
+LAYOUTS = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'} # Pillow mode of every number of channels
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'} # files read as images from a directory
+
+def Image_Layout(image):
+    '''
+    description:
+        This function gets the layout an image is turned into. Palette images with only grey colours and the
+        one bit, 16 bit, 32 bit and float grey modes become 'L', every other colour mode, like 'P', 'CMYK' or 'YCbCr',
+        becomes 'RGB', and either gets an alpha channel when the image has transparency, a palette or colour key included.
+    Args:
+        image: PIL image of any mode
+    Returns:
+        layout: 'L', 'LA', 'RGB' or 'RGBA'
+    '''
+    mode = image.mode
+    alpha = mode in ('LA', 'La', 'PA', 'RGBA', 'RGBa') or image.info.get('transparency') is not None
+    if mode in LAYOUTS.values() and (alpha == mode.endswith('A')):
+        return mode
+
+    grey = mode in ('1', 'L', 'La', 'F') or mode.startswith('I')
+    if mode in ('P', 'PA'):
+        palette = np.asarray(image.getpalette() or [0, 0, 0]).reshape(-1, 3)
+        grey = bool((palette == palette[:, :1]).all()) # a palette of greys, as grey pngs and gifs often have
+    return ('LA' if alpha else 'L') if grey else ('RGBA' if alpha else 'RGB')
+
+def Normalize_Image(image, layout=None):
+    '''
+    description:
+        This function turns an image into its layout, see Image_Layout(). An image already in its layout is returned as it is.
+    Args:
+        image: PIL image of any mode
+        layout: layout to turn the image into, by default the layout of the image, given for the bands of one image
+    Returns:
+        image: PIL image in the layout
+    '''
+    layout = layout or Image_Layout(image)
+    if image.mode == layout:
+        return image
+    if image.mode.startswith('I;16') and layout == 'L':
+        # Pillow clips 16 bit values to 255 instead of scaling them, the high byte keeps the whole range
+        return Image.fromarray((np.asarray(image) >> 8).astype(np.uint8))
+    return image.convert(layout)
+
+def Image_Pixels(image):
+    '''
+    description:
+        This function gets the pixels of an image as one contiguous uint8 array with a channel axis, in its layout.
+        An array is returned as it is, with a channel axis added to a (height, width) array.
+    Args:
+        image: PIL image of any mode, or a (height, width) or (height, width, channels) uint8 array
+    Returns:
+        pixels: (height, width, channels) uint8 array, with 1 to 4 channels as in LAYOUTS
+    '''
+    if isinstance(image, Image.Image):
+        image = np.ascontiguousarray(Normalize_Image(image))
+    return image[:, :, None] if image.ndim == 2 else image
+
+def Array_Image(pixels):
+    # PIL image of a (height, width, channels) uint8 array, in the layout of its number of channels
+    pixels = np.asarray(pixels)
+    return Image.fromarray(pixels[:, :, 0] if pixels.ndim == 3 and pixels.shape[2] == 1 else pixels)
+
+def Has_Alpha(channels):
+    # flag for the layouts whose last channel is alpha
+    return channels in (2, 4)
+
+def Line_Colour(channels):
+    # colour of the lines drawn around the quadrants, black and fully opaque in every layout
+    line = np.zeros(channels, dtype=np.uint8)
+    if Has_Alpha(channels):
+        line[-1] = 255
+    return line
+
+def Opaque_Colours(colours):
+    '''
+    description:
+        This function turns colours of any layout into opaque RGB colours, for outputs that have no alpha channel
+        like the gif. Grey colours are repeated in every channel and colours with alpha are laid over black,
+        the colour of the border around the root quadrant.
+    Args:
+        colours: (N, channels) uint8 array of colours
+    Returns:
+        colours: (N, 3) uint8 array of colours
+    '''
+    colours = np.asarray(colours, dtype=np.uint8)
+    channels = colours.shape[1]
+    rgb = colours[:, [0, 0, 0]] if channels <= 2 else colours[:, :3]
+    if Has_Alpha(channels):
+        rgb = (rgb.astype(np.uint16) * colours[:, -1:] // 255).astype(np.uint8)
+    return rgb
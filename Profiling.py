@@ -0,0 +1,194 @@
+import functools
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+_local = threading.local() # the Profile collecting the stages of the run on every thread, if any
+_metrics_lock = threading.Lock()
+METRICS = {'seconds': {}, 'calls': {}, 'peak_bytes': {}, 'nodes': {}, 'runs': 0} # totals of every finished Profile, see Metrics_Text()
+PROFILE_ALL = bool(os.environ.get('QUADTREE_PROFILE')) # profiles every run of main() for the metrics
+PROFILE_MEMORY = bool(os.environ.get('QUADTREE_PROFILE_MEMORY')) # and traces their allocations
+
+class Profile:
+    '''
+    description:
+        Collects the timings, call counts and allocation peaks of the profiled stages run on this thread
+        while it is active. Profiling is off unless a Profile is active, and then costs one attribute lookup per call.
+            with Profile(memory=True) as profile:
+                main(...)
+            profile.report()
+    Attributes:
+        stages: dictionary with the 'calls', 'seconds' and 'peak_bytes' of every stage that ran
+        nodes_per_depth: dictionary with the number of quadrants built at every depth
+        memory: flag to trace allocations with tracemalloc, which slows down the python code
+    '''
+
+    def __init__(self, memory=False):
+        self.stages = {}
+        self.nodes_per_depth = {}
+        self.memory = memory
+        self.seconds = 0.0
+        self._active = set() # stages running now, a stage calling itself is only timed once
+        self._peaks = [] # highest traced memory seen by every running stage, see run()
+        self._started_tracing = False
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'profile', None)
+        _local.profile = self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        _local.profile = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        Record_Metrics(self)
+
+    def run(self, stage, function, args, kwargs):
+        # runs a profiled function, adding its time and allocation peak to its stage
+        entry = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+        entry['calls'] += 1
+        if stage in self._active:
+            return function(*args, **kwargs)
+
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            # tracemalloc only keeps one peak, so the peak reached so far is saved for the stages around this one
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+
+        self._active.add(stage)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+            self._active.discard(stage)
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                entry['peak_bytes'] = max(entry['peak_bytes'], peak - current) # bytes allocated above what the stage started with
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def count_nodes(self, depths):
+        '''
+        description:
+            This function adds the quadrants of a built tree to the counts per depth.
+        Args:
+            depths: array with the depth of every quadrant
+        '''
+        for depth, count in enumerate(np.bincount(np.asarray(depths, dtype=np.intp))):
+            if count:
+                self.nodes_per_depth[depth] = self.nodes_per_depth.get(depth, 0) + int(count)
+
+    def report(self):
+        '''
+        description:
+            This function gets the profile as a dictionary that can be written as json.
+        Returns:
+            report: dictionary with the 'seconds' of the whole run, the 'stages' and the 'nodes_per_depth'
+        '''
+        return {
+            'seconds': round(self.seconds, 6),
+            'stages': {stage: dict(entry, seconds=round(entry['seconds'], 6)) for stage, entry in self.stages.items()},
+            'nodes_per_depth': dict(sorted(self.nodes_per_depth.items())),
+            'memory_traced': self.memory,
+        }
+
+def Active_Profile():
+    # the Profile active on this thread, or None when profiling is off
+    return getattr(_local, 'profile', None)
+
+def Profiled(stage):
+    '''
+    description:
+        This function is a decorator adding a function to the profiled stages under the given name.
+        Profiled functions run as they are when no Profile is active on the thread.
+    Args:
+        stage: name of the stage
+    '''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = getattr(_local, 'profile', None)
+            if profile is None:
+                return function(*args, **kwargs)
+            return profile.run(stage, function, args, kwargs)
+        return wrapper
+    return decorate
+
+class Stage:
+    '''
+    description:
+        Context manager profiling a block of code as a stage, for work that is not a function of its own,
+        like the calls into Pillow.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = getattr(_local, 'profile', None)
+        if self.profile is not None:
+            self.entry = self.profile.stages.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+            self.entry['calls'] += 1
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.entry['seconds'] += time.perf_counter() - self.start
+
+def Record_Metrics(profile):
+    # adds a finished Profile to the totals of the process
+    with _metrics_lock:
+        METRICS['runs'] += 1
+        for stage, entry in profile.stages.items():
+            METRICS['seconds'][stage] = METRICS['seconds'].get(stage, 0.0) + entry['seconds']
+            METRICS['calls'][stage] = METRICS['calls'].get(stage, 0) + entry['calls']
+            METRICS['peak_bytes'][stage] = max(METRICS['peak_bytes'].get(stage, 0), entry['peak_bytes'])
+        for depth, count in profile.nodes_per_depth.items():
+            METRICS['nodes'][depth] = METRICS['nodes'].get(depth, 0) + count
+
+    if os.environ.get('QUADTREE_METRICS_FILE'):
+        Write_Metrics(os.environ['QUADTREE_METRICS_FILE'])
+
+def Metrics_Text():
+    '''
+    description:
+        This function gets the totals of every finished Profile in the Prometheus text format.
+    Returns:
+        text: the metrics, one sample per line
+    '''
+    with _metrics_lock:
+        lines = [
+            '# HELP quadtree_runs_total Profiled runs of the pipeline.',
+            '# TYPE quadtree_runs_total counter',
+            f"quadtree_runs_total {METRICS['runs']}",
+        ]
+        for name, key, kind, help_text in (
+            ('quadtree_stage_seconds_total', 'seconds', 'counter', 'Seconds spent in every stage.'),
+            ('quadtree_stage_calls_total', 'calls', 'counter', 'Calls of every stage.'),
+            ('quadtree_stage_peak_bytes', 'peak_bytes', 'gauge', 'Most bytes allocated by one call of every stage, when memory is traced.'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{stage="{stage}"}} {value:g}' for stage, value in sorted(METRICS[key].items())]
+        lines += ['# HELP quadtree_nodes_total Quadrants built at every depth.', '# TYPE quadtree_nodes_total counter']
+        lines += [f'quadtree_nodes_total{{depth="{depth}"}} {count}' for depth, count in sorted(METRICS['nodes'].items())]
+    return '\n'.join(lines) + '\n'
+
+def Write_Metrics(path):
+    # writes the metrics to a file for a textfile scrape, replacing it at once so the scraper never reads half a file
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+    with open(temporary_path, 'w') as file:
+        file.write(Metrics_Text())
+    os.replace(temporary_path, path)
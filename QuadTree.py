@@ -0,0 +1,190 @@
+import io
+import numpy as np
+
+CHILD_OFFSETS = np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype=np.int32) # cells of the upper left, upper right, lower left and lower right children
+
+def Child_Cells(cells, split):
+    '''
+    description:
+        This function gets the grid cells of the children of the split quadrants of a level, in the order they are stored.
+        The children of the quadrant in cell (x, y) are in cells (2x, 2y), (2x + 1, 2y), (2x, 2y + 1) and (2x + 1, 2y + 1)
+        of the next depth.
+    Args:
+        cells: (N, 2) array with the column and row of every quadrant of the level
+        split: (N,) mask of the quadrants of the level that were split
+    Returns:
+        cells: (4 * split.sum(), 2) int32 array with the column and row of every quadrant of the next level
+    '''
+    return (2 * np.asarray(cells, dtype=np.int32)[split][:, None] + CHILD_OFFSETS).reshape(-1, 2)
+
+class QuadTree:
+    '''
+    description:
+        Quad tree of an image stored as one numpy array per field instead of one dictionary per quadrant.
+        The quadrants are stored breadth first, so every depth of the tree is one contiguous slice of the arrays,
+        and the four children of a split quadrant always follow each other, so a quadrant only keeps its first child.
+    Attributes:
+        bbox: (N, 4) int32 array with the pixel bounding box (left, top, right, bottom) of every quadrant
+        depth: (N,) uint8 array with the depth of every quadrant
+        detail: (N,) float32 array with the detail intensity of every quadrant
+        colour: (N, channels) uint8 array with the average colour of every quadrant, in the layout of the image, see Pixels.py
+        first_child: (N,) int32 array with the index of the first child of every quadrant, -1 for leaf quadrants
+        max_depth: maximum depth of the quad tree
+    '''
+
+    def __init__(self, bbox, depth, detail, colour, first_child):
+        self.bbox = np.ascontiguousarray(bbox, dtype=np.int32)
+        self.depth = np.ascontiguousarray(depth, dtype=np.uint8)
+        self.detail = np.ascontiguousarray(detail, dtype=np.float32)
+        self.colour = np.ascontiguousarray(colour, dtype=np.uint8)
+        self.first_child = np.ascontiguousarray(first_child, dtype=np.int32)
+        self.max_depth = int(self.depth[-1])
+        self.level_offsets = np.searchsorted(self.depth, np.arange(self.max_depth + 3)) # start of every depth in the arrays, and the end of the arrays
+        self._cells = None # grid cells of the quadrants, worked out the first time they are needed
+
+    @classmethod
+    def from_quadrant(cls, root):
+        '''
+        description:
+            This function converts a tree of quadrant dictionaries, as built by Build(), into a QuadTree.
+        Args:
+            root: dictionary to store the details of the root quadrant
+        '''
+        quadrants, first_child = [root], []
+        for quadrant in quadrants: # the list grows while it is walked, which visits the quadrants breadth first
+            if quadrant['children']:
+                first_child.append(len(quadrants))
+                quadrants.extend(quadrant['children'])
+            else:
+                first_child.append(-1)
+
+        bbox = np.array([list(map(round, quadrant['bbox'])) for quadrant in quadrants]) # rounding the bounding boxes the same way as Image.crop
+        bbox[:, 2:] = np.maximum(bbox[:, :2], bbox[:, 2:])
+
+        return cls(bbox,
+                   [quadrant['depth'] for quadrant in quadrants],
+                   [quadrant['detail'] for quadrant in quadrants],
+                   [quadrant['colour'] for quadrant in quadrants],
+                   first_child)
+
+    @classmethod
+    def from_levels(cls, levels):
+        '''
+        description:
+            This function joins the levels of a breadth first build into a QuadTree.
+        Args:
+            levels: list with a (bbox, detail, colour, split) tuple of arrays for every depth, where split marks
+                    the quadrants whose children make up the next level
+        '''
+        first_child, start = [], 0
+        for bbox, detail, colour, split in levels:
+            start += len(bbox)
+            children = np.full(len(bbox), -1, dtype=np.int32)
+            children[split] = start + 4 * np.arange(np.count_nonzero(split)) # the children of the split quadrants follow each other four at a time in the next level
+            first_child.append(children)
+
+        return cls(np.concatenate([level[0] for level in levels]),
+                   np.repeat(np.arange(len(levels)), [len(level[0]) for level in levels]),
+                   np.concatenate([level[1] for level in levels]),
+                   np.concatenate([level[2] for level in levels]),
+                   np.concatenate(first_child))
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''
+        description:
+            This function loads a QuadTree saved with to_bytes().
+        Args:
+            data: bytes of the saved tree
+        '''
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(arrays['bbox'], arrays['depth'], arrays['detail'], arrays['colour'], arrays['first_child'])
+
+    def to_bytes(self):
+        '''
+        description:
+            This function saves the arrays of the tree into bytes, keeping every field as it is.
+        '''
+        data = io.BytesIO()
+        np.savez(data, bbox=self.bbox, depth=self.depth, detail=self.detail, colour=self.colour, first_child=self.first_child)
+        return data.getvalue()
+
+    def __len__(self):
+        return len(self.depth)
+
+    def __iter__(self):
+        '''
+        description:
+            This function walks the quadrants breadth first, giving each one as a dictionary with the same keys as Quadrant().
+        '''
+        for index, (bbox, depth, detail, colour, first_child) in enumerate(zip(self.bbox.tolist(), self.depth.tolist(), self.detail.tolist(), self.colour.tolist(), self.first_child.tolist())):
+            yield {
+                'index': index,
+                'bbox': tuple(bbox),
+                'depth': depth,
+                'children': None if first_child < 0 else list(range(first_child, first_child + 4)),
+                'leaf': first_child < 0,
+                'detail': detail,
+                'colour': tuple(colour),
+            }
+
+    @property
+    def leaf(self):
+        # mask of the quadrants that were not split
+        return self.first_child < 0
+
+    @property
+    def size(self):
+        # canvas size of the image the tree was built from
+        return int(self.bbox[0, 2]), int(self.bbox[0, 3])
+
+    @property
+    def nbytes(self):
+        # memory used by the arrays of the tree
+        return sum(array.nbytes for array in (self.bbox, self.depth, self.detail, self.colour, self.first_child))
+
+    def children(self, index):
+        '''
+        description:
+            This function gets the indices of the four children of a quadrant, or an empty range for a leaf quadrant.
+        '''
+        first_child = int(self.first_child[index])
+        return range(first_child, first_child + 4) if first_child >= 0 else range(0)
+
+    def cells(self):
+        '''
+        description:
+            This function gets the grid cell of every quadrant, counting in quadrants of its own depth from the top left,
+            see Child_Cells().
+        Returns:
+            cells: (N, 2) array with the column and row of every quadrant
+        '''
+        if self._cells is None:
+            self._cells = np.zeros((len(self), 2), dtype=np.int32)
+            for depth in range(self.max_depth):
+                # the children of the split quadrants of a level are the whole next level, in the same order as their parents
+                level = self.level(depth)
+                self._cells[self.level(depth + 1)] = Child_Cells(self._cells[level], self.first_child[level] >= 0)
+        return self._cells
+
+    def level(self, depth):
+        '''
+        description:
+            This function gets the slice of the arrays holding the quadrants at the given depth.
+        '''
+        depth = min(depth, self.max_depth + 1)
+        return slice(int(self.level_offsets[depth]), int(self.level_offsets[depth + 1]))
+
+    def leaves_at_depth(self, depth):
+        '''
+        description:
+            This function gets the quadrants that make up the image when the tree is cut at the given depth,
+            which are the leaf quadrants above that depth and every quadrant at that depth.
+        Args:
+            depth: depth to cut the tree at
+        Returns:
+            indices: array with the indices of the quadrants
+        '''
+        above = self.level(depth).start # quadrants above the cut come first in the arrays
+        leaves = np.flatnonzero(self.first_child[:above] < 0)
+        return np.concatenate([leaves, np.arange(above, self.level(depth).stop)])
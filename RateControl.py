@@ -0,0 +1,204 @@
+import io
+import math
+import numpy as np
+from QuadTree import QuadTree
+
+TARGETS = ('leaves', 'bytes', 'psnr') # kinds of target a tree can be cut for, see RateControl.select()
+MAX_CONFIRMATIONS = 4 # most outputs measured for a 'bytes' target before falling back to a binary search that measures every step
+
+class RateControl:
+    '''
+    description:
+        Full quad tree of an image, where every quadrant with any detail is split down to the depth of the compressed image,
+        kept with the squared error of every quadrant. The tree of any detail threshold is this tree with the splits whose
+        path from the root holds a quadrant below the threshold taken away, so the tree meeting a leaf budget, a size or
+        a quality is cut from it instead of being built again for every threshold that is tried.
+        Splitting the quadrants in the order of their thresholds is splitting the most detailed quadrant first,
+        as a priority queue would, and since a parent is never less detailed than the path to its children,
+        every prefix of the order is a valid tree.
+    Attributes:
+        tree: full QuadTree of the image
+        error: (N,) float64 array with the squared error of painting every quadrant with its colour, summed over its pixels and channels
+        threshold: (N,) float32 array with the largest detail threshold that still builds every quadrant's split,
+                   the lowest detail on the path from the root to the quadrant
+        order: indices of the split quadrants of the full tree from the highest threshold to the lowest
+        gain: (len(order),) array with the squared error taken away by every split of the order
+    '''
+
+    def __init__(self, tree, error):
+        self.tree = tree
+        self.error = np.asarray(error, dtype=np.float64)
+
+        self.threshold = tree.detail.copy()
+        for depth in range(tree.max_depth):
+            level = tree.level(depth)
+            split = np.flatnonzero(tree.first_child[level] >= 0) + level.start
+            children = tree.first_child[split][:, None] + np.arange(4)
+            self.threshold[children] = np.minimum(self.threshold[split][:, None], tree.detail[children])
+
+        split = np.flatnonzero(~tree.leaf)
+        self.order = split[np.argsort(-self.threshold[split], kind='stable')] # ties keep the breadth first order, so parents come first
+        children = tree.first_child[self.order][:, None] + np.arange(4)
+        self.gain = self.error[self.order] - self.error[children].sum(axis=1)
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''
+        description:
+            This function loads a RateControl saved with to_bytes().
+        Args:
+            data: bytes of the saved rate control
+        '''
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            tree = QuadTree(arrays['bbox'], arrays['depth'], arrays['detail'], arrays['colour'], arrays['first_child'])
+            return cls(tree, arrays['error'])
+
+    def to_bytes(self):
+        '''
+        description:
+            This function saves the full tree and the errors of its quadrants into bytes, the order is worked out again when they are loaded.
+        '''
+        data = io.BytesIO()
+        tree = self.tree
+        np.savez(data, bbox=tree.bbox, depth=tree.depth, detail=tree.detail, colour=tree.colour, first_child=tree.first_child, error=self.error)
+        return data.getvalue()
+
+    @property
+    def nbytes(self):
+        # memory used by the arrays of the full tree and the order
+        return self.tree.nbytes + sum(array.nbytes for array in (self.error, self.threshold, self.order, self.gain))
+
+    def prune(self, splits):
+        '''
+        description:
+            This function cuts the tree made by the first splits of the order out of the full tree.
+        Args:
+            splits: number of splits to keep
+        Returns:
+            tree: QuadTree with 3 * splits + 1 leaf quadrants
+        '''
+        tree = self.tree
+        chosen = np.zeros(len(tree), dtype=bool)
+        chosen[self.order[:splits]] = True
+
+        keep = np.zeros(len(tree), dtype=bool)
+        keep[0] = True
+        keep[(tree.first_child[chosen][:, None] + np.arange(4)).ravel()] = True
+        index = np.cumsum(keep) - 1 # index of every kept quadrant in the pruned tree, which keeps the breadth first order
+
+        first_child = np.where(chosen, index[tree.first_child], -1)[keep]
+        return QuadTree(tree.bbox[keep], tree.depth[keep], tree.detail[keep], tree.colour[keep], first_child)
+
+    def leaves(self, splits):
+        # number of leaf quadrants of the tree made by the first splits of the order
+        return 3 * splits + 1
+
+    def edges(self):
+        '''
+        description:
+            This function gets the half perimeter of the leaf quadrants, summed, of the tree of every number of splits,
+            the length of the edges between quadrants, from which the size of a png of flat quadrants grows about linearly.
+            A split takes the parent off the leaves and adds its children, so every number of splits is one cumulative sum.
+        Returns:
+            edges: (len(order) + 1,) int64 array with the summed half perimeter of the leaves of 0 to len(order) splits
+        '''
+        width, height = (self.tree.bbox[:, 2:4] - self.tree.bbox[:, 0:2]).astype(np.int64).T
+        half_perimeter = np.where(width * height > 0, width + height, 0) # empty quadrants cover no pixels
+        children = self.tree.first_child[self.order][:, None] + np.arange(4)
+        added = half_perimeter[children].sum(axis=1) - half_perimeter[self.order]
+        return half_perimeter[0] + np.concatenate([[0], np.cumsum(added)])
+
+    def detail_threshold(self, splits):
+        # detail threshold building the same splits, up to the ties at the last one
+        if splits == 0:
+            return math.inf
+        return float(self.threshold[self.order[splits - 1]])
+
+    def psnr(self, splits):
+        '''
+        description:
+            This function gets the peak signal to noise ratio of the tree made by the first splits of the order
+            against the image it was built from, without rendering it.
+        Args:
+            splits: number of splits to keep
+        Returns:
+            psnr: psnr in decibels, infinite when the tree paints the image exactly
+        '''
+        error = self.error[0] - self.gain[:splits].sum()
+        return Error_Psnr(error, self.tree.size, self.tree.colour.shape[1])
+
+    def select(self, kind, value, size_of=None):
+        '''
+        description:
+            This function gets the number of splits of the order that meets a target.
+                'leaves': the most splits giving no more than value leaf quadrants
+                'psnr': the fewest splits giving a psnr of at least value decibels, or every split when none does
+                'bytes': about the most splits whose output, as measured by size_of, is no larger than value bytes, or no split
+                         when even the root is larger. The size is estimated from edges() times the ratio of the size to the
+                         edges of the last tree measured, which changes slowly with the splits, and only the trees the estimate
+                         picks are measured, starting from the full tree, so a few outputs are measured instead of one per step
+                         of a binary search, which the splits fall back to when the estimate finds no tree that fits
+        Args:
+            kind: 'leaves', 'bytes' or 'psnr'
+            value: leaf budget, byte size or psnr in decibels
+            size_of: function giving the size in bytes of the output of a QuadTree, needed for 'bytes'
+        Returns:
+            splits: number of splits to keep, see prune()
+        '''
+        if kind == 'leaves':
+            return int(min(max((value - 1) // 3, 0), len(self.order)))
+
+        if kind == 'psnr':
+            errors = self.error[0] - np.concatenate([[0.0], np.cumsum(self.gain)]) # squared error of every number of splits
+            width, height = self.tree.size
+            max_error = width * height * self.tree.colour.shape[1] * 255.0 ** 2 / 10 ** (value / 10)
+            meeting = np.flatnonzero(errors <= max_error)
+            return int(meeting[0]) if len(meeting) else len(self.order)
+
+        if kind == 'bytes':
+            if size_of is None:
+                raise ValueError('A byte size target needs a function measuring the output')
+            low, high = 0, len(self.order) # the output of low splits fits unless low is 0, the output of more than high splits does not
+            measure = lambda splits: size_of(self.prune(splits))
+            edges = self.edges()
+
+            splits, aim = high, value # aim: size the next guess is estimated to have
+            for attempt in range(MAX_CONFIRMATIONS):
+                size = measure(splits)
+                if size <= value:
+                    low, aim = splits, value
+                else:
+                    # the ratio grows towards the root, so a guess from a larger tree overshoots, aim below by as much as it did
+                    high, aim = splits - 1, aim * value / size if attempt else value
+                ratio = size / max(edges[splits], 1)
+                splits = low + int(np.searchsorted(ratio * edges[low + 1:high + 1], aim, side='right')) # the most splits estimated to fit
+                if splits == low:
+                    return low # one more split is estimated not to fit either
+            if low > 0:
+                return low
+
+            # the estimate missed even near the root, where a few large quadrants take far more bytes than their edges tell
+            while low < high:
+                middle = (low + high + 1) // 2
+                if measure(middle) <= value:
+                    low = middle
+                else:
+                    high = middle - 1
+            return low
+
+        raise ValueError(f'Unknown rate control target: {kind}')
+
+def Error_Psnr(error, size, channels=3):
+    '''
+    description:
+        This function gets the peak signal to noise ratio of an image from its squared error.
+    Args:
+        error: squared error summed over the pixels and channels
+        size: (width, height) of the image
+        channels: number of channels of the image, 3 for RGB
+    Returns:
+        psnr: psnr in decibels, infinite for no error
+    '''
+    width, height = size
+    mse = error / max(width * height * channels, 1)
+    return math.inf if mse <= 0 else 10 * math.log10(255.0 ** 2 / mse)
@@ -0,0 +1,72 @@
+import io
+import threading
+import numpy as np
+
+FORMATS = { # Pillow format of every download format, its mime type, file extension and save options
+    'PNG': ('image/png', 'png', {}),
+    'WEBP': ('image/webp', 'webp', {'lossless': True}), # lossless, the quadrants are flat so it is usually smaller than the png
+}
+
+class Result:
+    '''
+    description:
+        Outputs of one run of main(), held in memory. The compressed image is encoded to a format the first time its
+        bytes are asked for and the bytes are kept, so showing the image, reporting its size and downloading it all use
+        the same buffer and nothing is written to disk. A result can be read from several threads at once.
+    Attributes:
+        image: the compressed PIL image, shared with the image cache, so it must not be changed
+        gif: bytes of the gif of the quad tree, or None when no gif was made
+        palette: (colours, shares) of the dominant colours of the compressed image, or None, see Tree_Palette()
+        report: report of the profile of the run, or None when it was not profiled
+    '''
+
+    def __init__(self, image, gif=None, palette=None, report=None):
+        self.image = image
+        self.gif = gif
+        self.palette = palette
+        self.report = report
+        self._encoded = {} # bytes of the image in every format encoded so far
+        self._lock = threading.Lock()
+
+    @property
+    def pixels(self):
+        # (height, width, bands) uint8 array of the compressed image, read only
+        pixels = np.asarray(self.image)
+        return pixels[:, :, None] if pixels.ndim == 2 else pixels
+
+    @property
+    def nbytes(self):
+        # memory held by the result, the pixels of the image, the gif and every encoding of the image
+        with self._lock:
+            encoded = sum(len(data) for data in self._encoded.values())
+        return self.image.size[0] * self.image.size[1] * len(self.image.getbands()) + len(self.gif or b'') + encoded
+
+    def encode(self, format='PNG'):
+        '''
+        description:
+            This function gets the bytes of the compressed image in a format, encoding it only the first time.
+        Args:
+            format: 'PNG' or 'WEBP', in any case
+        Returns:
+            data: bytes of the encoded image
+        '''
+        format = format.upper()
+        if format not in FORMATS:
+            raise ValueError(f'Unknown image format: {format}')
+
+        with self._lock: # two readers asking at once encode the image once
+            if format not in self._encoded:
+                buffer = io.BytesIO()
+                self.image.save(buffer, format=format, **FORMATS[format][2])
+                self._encoded[format] = buffer.getvalue()
+            return self._encoded[format]
+
+    def size(self, format='PNG'):
+        # bytes of the compressed image in a format
+        return len(self.encode(format))
+
+    def mime(self, format='PNG'):
+        return FORMATS[format.upper()][0]
+
+    def file_name(self, name='compressed_image', format='PNG'):
+        return f'{name}.{FORMATS[format.upper()][1]}'
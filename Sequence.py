@@ -0,0 +1,490 @@
+import argparse
+import os
+import re
+import struct
+import numpy as np
+from PIL import Image, ImageSequence
+from QuadTree import QuadTree, Child_Cells
+from Main import COMPRESSION_LEVELS, BAND_PIXELS, Compression_Settings, Grid_Edges, Cell_Sums, Rasterize
+from Metrics import MEASURES, Lab_Pixels, Moment_Detail
+from Filters import Apply_Filter, FILTERS
+from Pixels import IMAGE_EXTENSIONS, Image_Layout, Normalize_Image, Image_Pixels, Array_Image
+from Codec import COMPRESSIONS, LEVEL, Read_Exactly, Read_Level
+from Profiling import Profiled
+
+# The frames of a sequence share one grid of quadrants, laid over the whole frame instead of the bounding box of
+# every frame, so the quadrant in a cell of one frame is the quadrant in the same cell of the next. A .qts stream stores
+# the trees of the frames one after another, each level laid out as in a .qtc file, see Codec.py, but with the colour of a
+# quadrant stored as the difference to the colour of the same cell in the tree of the previous frame, and its split bit
+# flipped when the cell was split the other way there. Quadrants that did not change store zeros, which compress to almost
+# nothing. Every frame ends with an empty level record and the stream ends with the file.
+SEQUENCE_MAGIC = b'QTS'
+SEQUENCE_VERSION = 1
+SEQUENCE_HEADER = struct.Struct('<3sBBB2xII') # magic, version, compression, channels, padding, width, height
+REPAINT_FRACTION = 0.5 # a frame whose changed quadrants cover more of it than this is rendered whole instead of painted over
+
+def Frame_Number(name):
+    # sort key of the file names of numbered frames, so frame_10.png comes after frame_9.png
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def Read_Frames(source):
+    '''
+    description:
+        This function reads the frames of a sequence one at a time. Every frame is turned into the layout of the first
+        frame, see Pixels.py, so the frames of an animated gif that only starts using colours keep the same channels.
+    Args:
+        source: path of an animated image, like a gif, an apng or a webp, path of a directory of numbered frames,
+                or an iterable of PIL images or (height, width, channels) arrays, which are given as they are
+    Returns:
+        frames: generator of PIL images or arrays
+    '''
+    if not isinstance(source, (str, os.PathLike)):
+        yield from source
+        return
+
+    if os.path.isdir(source):
+        names = sorted((name for name in os.listdir(source) if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS), key=Frame_Number)
+        paths = (os.path.join(source, name) for name in names)
+    else:
+        paths = None
+
+    layout = None
+    if paths is None:
+        with Image.open(source) as image:
+            for frame in ImageSequence.Iterator(image):
+                layout = layout or Image_Layout(frame)
+                yield Normalize_Image(frame, layout)
+        return
+
+    for path in paths:
+        with Image.open(path) as frame:
+            frame.load()
+            layout = layout or Image_Layout(frame)
+            yield Normalize_Image(frame, layout)
+
+def Child_Matches(previous, matches, split):
+    '''
+    description:
+        This function finds the children of the split quadrants of a level in the tree of the previous frame. A quadrant
+        in the same cell as a quadrant of the previous tree has its children in the cells of the children of that quadrant,
+        so they are found from the quadrants of the level without searching.
+    Args:
+        previous: QuadTree of the previous frame, or None
+        matches: (N,) array with the index of every quadrant of the level in the previous tree, -1 for new quadrants
+        split: (N,) mask of the quadrants of the level that were split
+    Returns:
+        matches: (4 * split.sum(),) array with the index of every quadrant of the next level in the previous tree, -1 for new quadrants
+    '''
+    parents = matches[split]
+    first = np.full(len(parents), -1, dtype=np.intp)
+    if previous is not None:
+        found = parents >= 0
+        first[found] = previous.first_child[parents[found]] # -1 when the quadrant was a leaf in the previous tree
+    children = first[:, None] + np.arange(4)
+    children[first < 0] = -1
+    return children.reshape(-1)
+
+class FrameTree:
+    '''
+    description:
+        Quad tree of the frames of a sequence, updated from one frame to the next instead of built again.
+        The sums and squared sums of the pixels of every cell of the deepest grid of the tree, and of every cell of
+        the shallower grids, are kept from frame to frame. Only the pixels that changed are read into them, as the
+        difference to the pixels they replace, and only the quadrants in cells that changed are measured again, the
+        others keep their detail, colour and split from the tree of the previous frame. With a tolerance of 0 the tree
+        of every frame is the tree Build_Levels() gives for the whole frame.
+    Attributes:
+        MAX_DEPTH, DETAIL_THRESHOLD: settings of the compression level, see Compression_Settings()
+        measure: detail measure, 'weighted_std', 'max_std' or 'lab', see Metrics.py
+        tolerance: largest change of a channel of a pixel that is ignored, the pixel is kept as it was in the frame before,
+                   so noise does not make static footage change
+        tree: QuadTree of the last frame, None before the first one
+        changed_pixels: number of pixels of the last frame that changed by more than the tolerance
+        evaluated: number of quadrants of the last frame that were measured, the others were kept
+        matches: (N,) array with the index of every quadrant of the tree in the tree of the frame before, -1 for new quadrants
+    '''
+
+    def __init__(self, MAX_DEPTH, DETAIL_THRESHOLD, measure='weighted_std', tolerance=0):
+        if measure not in MEASURES or measure == 'mad':
+            raise ValueError(f'Unsupported detail measure for a sequence: {measure}, the mad measure needs the pixels of every quadrant')
+        self.MAX_DEPTH, self.DETAIL_THRESHOLD = MAX_DEPTH, DETAIL_THRESHOLD
+        self.measure = measure
+        self.tolerance = tolerance
+        self.tree = None
+        self.changed_pixels = self.evaluated = 0
+        self.matches = None
+        self._reference = None # the pixels the sums describe, which keep the pixels that changed by no more than the tolerance
+
+    def update(self, frame):
+        '''
+        description:
+            This function gets the tree of the next frame of the sequence. A frame with another size or layout than
+            the one before starts the sequence again.
+        Args:
+            frame: PIL image or (height, width, channels) uint8 array of the frame
+        Returns:
+            tree: QuadTree of the frame
+        '''
+        pixels = Image_Pixels(frame)
+        if self._reference is None or pixels.shape != self._reference.shape:
+            self._start(pixels)
+            self.changed_pixels = pixels.shape[0] * pixels.shape[1]
+            changed = None
+        else:
+            changed = self._read_changes(pixels)
+            if changed is None:
+                self.evaluated, self.matches = 0, np.arange(len(self.tree))
+                return self.tree # nothing changed, the tree stays as it was
+
+        self.tree = self._grow(changed)
+        return self.tree
+
+    @Profiled('sequence_start')
+    def _start(self, pixels):
+        # sums of the first frame, one grid of cells for every depth the tree can reach
+        height, width, _ = pixels.shape
+        depth = self.MAX_DEPTH + 1 # quadrants at MAX_DEPTH can still be split once more
+        self._reference = np.array(pixels)
+        self._x, self._y = Grid_Edges((0, 0, width, height), depth)
+        self._columns = np.searchsorted(self._x, np.arange(width), 'right') - 1 # cell column of every pixel column
+        self._rows = np.searchsorted(self._y, np.arange(height), 'right') - 1
+
+        # the cells without pixels are left out of the sums, Cell_Sums() needs the edges to increase
+        columns, rows = np.flatnonzero(np.diff(self._x) > 0), np.flatnonzero(np.diff(self._y) > 0)
+        x, y = np.append(self._x[columns], width), np.append(self._y[rows], height)
+        tables = [Cell_Sums(pixels, x, y)]
+        if self.measure == 'lab':
+            tables.append(Cell_Sums(pixels, x, y, Lab_Pixels))
+
+        self._sums = [] # for every table, the grids of sums and of squared sums from depth 0 to the deepest depth
+        for sums, squares in tables:
+            grids = []
+            for cells in (sums, squares):
+                grid = np.zeros((2 ** depth, 2 ** depth, cells.shape[2]), dtype=np.int64)
+                grid[np.ix_(rows, columns)] = cells
+                pyramid = [grid]
+                for _ in range(depth):
+                    size = len(pyramid[0]) // 2
+                    pyramid.insert(0, pyramid[0].reshape(size, 2, size, 2, -1).sum(axis=(1, 3)))
+                grids.append(pyramid)
+            self._sums.append(grids)
+
+    @Profiled('sequence_changes')
+    def _read_changes(self, pixels):
+        '''
+        description:
+            This function finds the pixels of a frame that changed by more than the tolerance, one band of rows at a time,
+            and adds the difference they make to the sums of every cell they are in.
+        Returns:
+            changed: list with the sorted keys of the cells that changed at every depth, None when no pixel changed
+        '''
+        reference = self._reference
+        height, width, _ = pixels.shape
+        step = max(1, BAND_PIXELS // width)
+        ys, xs = [], []
+        for top in range(0, height, step):
+            old, new = reference[top:top + step], pixels[top:top + step]
+            difference = old != new if self.tolerance <= 0 else np.maximum(old, new) - np.minimum(old, new) > self.tolerance
+            changed_rows = np.flatnonzero(difference.reshape(len(difference), -1).any(axis=1)) # whole rows first, far faster than pixel by pixel
+            rows, columns = np.nonzero(difference[changed_rows].any(axis=2))
+            ys.append(changed_rows[rows] + top)
+            xs.append(columns)
+        ys, xs = np.concatenate(ys), np.concatenate(xs)
+        self.changed_pixels = len(ys)
+        if len(ys) == 0:
+            return None
+
+        old, new = reference[ys, xs], pixels[ys, xs]
+        reference[ys, xs] = new
+        depth = self.MAX_DEPTH + 1
+        cells, inverse = np.unique((self._rows[ys].astype(np.int64) << depth) | self._columns[xs], return_inverse=True)
+        rows, columns = cells >> depth, cells & ((1 << depth) - 1)
+
+        values = [(old.astype(np.int64), new.astype(np.int64))]
+        if self.measure == 'lab':
+            values.append((Lab_Pixels(old).astype(np.int64), Lab_Pixels(new).astype(np.int64)))
+        for (old, new), grids in zip(values, self._sums):
+            for change, pyramid in zip((new - old, new * new - old * old), grids):
+                cell_change = np.zeros((len(cells), change.shape[1]), dtype=np.int64)
+                np.add.at(cell_change, inverse.reshape(-1), change)
+                for level, grid in enumerate(pyramid):
+                    shift = depth - level # the cell of a shallower depth holding the cell
+                    np.add.at(grid, (rows >> shift, columns >> shift), cell_change)
+
+        return [np.unique(((rows >> (depth - level)) << level) | (columns >> (depth - level))) for level in range(depth + 1)]
+
+    @Profiled('sequence_grow')
+    def _grow(self, changed=None):
+        '''
+        description:
+            This function builds the tree of the frame level by level from the root, as Grow_Levels() does. A quadrant
+            in the same cell as a quadrant of the previous tree keeps its detail, colour and split unless its cell changed;
+            only the children of changed quadrants can be in changed cells, so only they are looked up.
+        Args:
+            changed: keys of the cells that changed at every depth, see _read_changes(), None to measure every quadrant
+        Returns:
+            tree: QuadTree of the frame
+        '''
+        previous = self.tree if changed is not None else None
+        levels, all_matches, self.evaluated = [], [], 0
+        cells = np.zeros((1, 2), dtype=np.int32)
+        matches = np.full(1, 0 if previous is not None else -1, dtype=np.intp)
+        dirty = np.ones(1, dtype=bool) # quadrants whose parent is in a changed cell
+        depth = 0
+
+        while len(cells):
+            column, row = cells[:, 0], cells[:, 1]
+            shift = self.MAX_DEPTH + 1 - depth
+            x, y = self._x[::1 << shift], self._y[::1 << shift] # the edges of a depth are every 2 ** shift deepest edge
+            bounds = np.stack([x[column], y[row], x[column + 1], y[row + 1]], axis=1)
+            detail, colour = np.zeros(len(cells), dtype=np.float32), np.zeros((len(cells), self._reference.shape[2]), dtype=np.uint8)
+
+            if previous is not None:
+                candidates = np.flatnonzero(dirty)
+                keys = (row[candidates].astype(np.int64) << depth) | column[candidates]
+                position = np.minimum(np.searchsorted(changed[depth], keys), len(changed[depth]) - 1)
+                dirty = np.zeros(len(cells), dtype=bool)
+                dirty[candidates] = changed[depth][position] == keys
+
+            keep = (matches >= 0) & ~dirty
+            if keep.any():
+                detail[keep], colour[keep] = previous.detail[matches[keep]], previous.colour[matches[keep]]
+            evaluate = ~keep
+            self.evaluated += int(np.count_nonzero(evaluate))
+            if evaluate.any():
+                detail[evaluate], colour[evaluate] = self._statistics(depth, row[evaluate], column[evaluate], bounds[evaluate])
+
+            split = detail >= self.DETAIL_THRESHOLD if depth <= self.MAX_DEPTH else np.zeros(len(cells), dtype=bool) # same split rule as Grow_Levels()
+            levels.append((bounds, detail, colour, split))
+            all_matches.append(matches)
+
+            matches = Child_Matches(previous, matches, split)
+            dirty = np.repeat(dirty[split], 4)
+            cells = Child_Cells(cells, split)
+            depth += 1
+
+        self.matches = np.concatenate(all_matches)
+        return QuadTree.from_levels(levels)
+
+    def _statistics(self, depth, row, column, bounds):
+        # detail and colour of quadrants of a depth from the sums of their cells, the same as Level_Statistics()
+        (sums, squares), *lab = [[pyramid[depth][row, column] for pyramid in grids] for grids in self._sums]
+        count = ((bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])).astype(np.int64)[:, None]
+        detail = Moment_Detail(*(lab[0] if lab else (sums, squares)), count, self.measure)
+        return detail, sums // np.maximum(count, 1)
+
+def Paint_Quadrants(canvas, bounds, colours):
+    '''
+    description:
+        This function paints quadrants of any depths onto a canvas with one numpy assignment, touching only their pixels.
+    Args:
+        canvas: (height, width, channels) uint8 array that is painted in place
+        bounds: (N, 4) array with the pixel bounding boxes of the quadrants
+        colours: (N, channels) uint8 array with the colour of every quadrant
+    '''
+    left, top, right, bottom = np.asarray(bounds, dtype=np.int64).T
+    widths, heights = right - left, bottom - top
+    areas = widths * heights
+    if areas.sum() == 0:
+        return
+    quadrant = np.repeat(np.arange(len(areas)), areas) # the quadrant of every painted pixel
+    offset = np.arange(len(quadrant)) - np.repeat(np.cumsum(areas) - areas, areas) # position of the pixel in its quadrant
+    canvas[top[quadrant] + offset // widths[quadrant], left[quadrant] + offset % widths[quadrant]] = colours[quadrant]
+
+def Sequence_Frames(frames, option='Average', color_mode='No Filter', tolerance=0, measure='weighted_std'):
+    '''
+    description:
+        This function compresses the frames of a sequence, updating one FrameTree from frame to frame, and renders the
+        compressed frames onto one canvas. Only the quadrants that are not the same as in the frame before are painted,
+        unless they cover most of the frame, so rendering near static footage costs as little as building its trees.
+    Args:
+        frames: iterable of the frames, PIL images or (height, width, channels) arrays, see Read_Frames()
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        color_mode: name of the colour filter
+        tolerance: largest change of a channel of a pixel that is ignored, see FrameTree
+        measure: detail measure, see FrameTree
+    Returns:
+        frames: generator of (height, width, channels) uint8 arrays with the compressed frames. The array is painted over
+                by the next frame, so a frame that is kept must be copied
+    '''
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+    frame_tree = FrameTree(MAX_DEPTH, DETAIL_THRESHOLD, measure, tolerance)
+    canvas, previous_tree, previous_view = None, None, None
+
+    for frame in frames:
+        tree = frame_tree.update(frame)
+        if tree is previous_tree:
+            yield canvas
+            continue
+
+        leaves = tree.leaves_at_depth(min(MAX_DEPTH, tree.max_depth)) # the depth main() cuts the tree at
+        colours = tree.colour[leaves]
+        restart = previous_tree is None or (tree.size, tree.colour.shape[1]) != (previous_tree.size, previous_tree.colour.shape[1])
+        if restart:
+            paint = np.ones(len(leaves), dtype=bool)
+        else:
+            # a quadrant shown in the previous frame in the same cell and with the same colour is already on the canvas
+            matches = frame_tree.matches[leaves]
+            index = np.maximum(matches, 0)
+            paint = (matches < 0) | ~previous_view[index] | (previous_tree.colour[index] != colours).any(axis=1)
+
+        bounds = tree.bbox[leaves[paint]]
+        area = ((bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])).sum()
+        if restart or area > REPAINT_FRACTION * tree.size[0] * tree.size[1]:
+            canvas = Rasterize(tree, leaves, Apply_Filter(colours, color_mode))
+        else:
+            Paint_Quadrants(canvas, bounds, Apply_Filter(colours[paint], color_mode))
+
+        previous_tree, previous_view = tree, np.zeros(len(tree), dtype=bool)
+        previous_view[leaves] = True
+        yield canvas
+
+def Write_Levels(fp, tree, previous, matches, compress):
+    '''
+    description:
+        This function writes the levels of the tree of one frame as the changes to the tree of the previous frame,
+        see SEQUENCE_MAGIC.
+    Args:
+        fp: file object to write to
+        tree: QuadTree of the frame
+        previous: QuadTree of the previous frame, or None for the first frame
+        matches: index of every quadrant of the tree in the previous tree, -1 for new quadrants, see FrameTree
+        compress: function compressing a payload
+    Returns:
+        written: number of bytes written
+    '''
+    written = 0
+    parents = np.zeros((1, tree.colour.shape[1]), dtype=np.uint8)
+    for depth in range(tree.max_depth + 1):
+        level = tree.level(depth)
+        colour, split = tree.colour[level], tree.first_child[level] >= 0
+        base, flip = parents, np.zeros(len(colour), dtype=bool)
+        if previous is not None:
+            index = matches[level]
+            found = index >= 0
+            base = np.where(found[:, None], previous.colour[np.maximum(index, 0)], parents)
+            flip = found & (previous.first_child[np.maximum(index, 0)] >= 0)
+
+        residuals = colour - base # wraps around, which the decoder undoes by adding the base colour back
+        payload = compress(np.packbits(split ^ flip).tobytes() + residuals.T.tobytes())
+        written += fp.write(LEVEL.pack(len(colour), len(payload))) + fp.write(payload)
+        parents = np.repeat(colour[split], 4, axis=0)
+
+    return written + fp.write(LEVEL.pack(0, 0))
+
+def Encode_Sequence(fp, frames, option='Average', compression='zlib', tolerance=0, measure='weighted_std'):
+    '''
+    description:
+        This function compresses the frames of a sequence into a .qts stream, one frame at a time, writing every tree
+        as the changes to the tree of the frame before, see SEQUENCE_MAGIC. The stream can be read while it is written.
+    Args:
+        fp: file object to write to
+        frames: iterable of the frames, which must all have the size and layout of the first one, see Read_Frames()
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        compression: 'none', 'zlib' or 'lzma'
+        tolerance: largest change of a channel of a pixel that is ignored, see FrameTree
+        measure: detail measure, see FrameTree
+    Returns:
+        written: number of bytes written
+        count: number of frames written
+    '''
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+    compression_id, compress, _ = COMPRESSIONS[compression]
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+    frame_tree = FrameTree(MAX_DEPTH, DETAIL_THRESHOLD, measure, tolerance)
+    written, count, previous = 0, 0, None
+
+    for frame in frames:
+        tree = frame_tree.update(frame)
+        if previous is None:
+            written += fp.write(SEQUENCE_HEADER.pack(SEQUENCE_MAGIC, SEQUENCE_VERSION, compression_id, tree.colour.shape[1], *tree.size))
+        elif (tree.size, tree.colour.shape[1]) != (previous.size, previous.colour.shape[1]):
+            raise ValueError('Every frame of a sequence must have the size and layout of the first frame')
+        written += Write_Levels(fp, tree, previous, frame_tree.matches if previous is not None else None, compress)
+        count, previous = count + 1, tree
+
+    return written, count
+
+def Decode_Sequence(fp):
+    '''
+    description:
+        This function reads the trees of the frames of a .qts stream one at a time. The stream does not store the detail
+        of the quadrants, so it is zero in the trees.
+    Args:
+        fp: file object to read from, placed at the start of the stream
+    Returns:
+        trees: generator of the QuadTree of every frame
+    '''
+    magic, version, compression_id, channels, width, height = SEQUENCE_HEADER.unpack(Read_Exactly(fp, SEQUENCE_HEADER.size))
+    if magic != SEQUENCE_MAGIC:
+        raise ValueError('Not a .qts stream')
+    if version != SEQUENCE_VERSION:
+        raise ValueError(f'Unsupported .qts version: {version}')
+    decompress = {value[0]: value[2] for value in COMPRESSIONS.values()}.get(compression_id)
+    if decompress is None:
+        raise ValueError(f'Unknown .qts compression id: {compression_id}')
+
+    previous = None
+    while True:
+        record = fp.read(LEVEL.size)
+        if not record:
+            return # the stream ends between two frames
+        if len(record) != LEVEL.size:
+            raise ValueError('The file is truncated')
+        levels, depth = [], 0
+        cells, parents = np.zeros((1, 2), dtype=np.int32), np.zeros((1, channels), dtype=np.uint8)
+        matches = np.zeros(1, dtype=np.intp) # the root is in the same cell in every frame
+
+        while True:
+            level = Read_Level(fp, decompress, len(cells), channels, record)
+            if level is None:
+                break
+            split, residuals = level
+            count, base = len(split), parents
+            if previous is not None:
+                found, index = matches >= 0, np.maximum(matches, 0)
+                base = np.where(found[:, None], previous.colour[index], parents)
+                split ^= found & (previous.first_child[index] >= 0)
+            colour = residuals + base
+
+            x, y = Grid_Edges((0, 0, width, height), depth)
+            column, row = cells.T
+            bounds = np.stack([x[column], y[row], x[column + 1], y[row + 1]], axis=1)
+            levels.append((bounds, np.zeros(count, dtype=np.float32), colour, split))
+            parents = np.repeat(colour[split], 4, axis=0)
+            matches = Child_Matches(previous, matches, split)
+            cells = Child_Cells(cells, split)
+            depth, record = depth + 1, None
+
+        if not levels:
+            raise ValueError('The .qts stream has a frame without quadrants')
+        previous = QuadTree.from_levels(levels)
+        yield previous
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress the frames of a sequence with the QuadTree image compressor, reusing the tree of every frame for the next.')
+    parser.add_argument('input', help='animated image, like a gif, or a directory of numbered frames')
+    parser.add_argument('output', help='.qts file for the stream of trees, or a directory for the compressed frames as pngs')
+    parser.add_argument('--level', choices=list(COMPRESSION_LEVELS), default='Average', help='compression level')
+    parser.add_argument('--filter', choices=['No Filter'] + list(FILTERS), default='No Filter', help='colour filter of the frames')
+    parser.add_argument('--tolerance', type=int, default=0, help='largest change of a pixel channel that is ignored')
+    parser.add_argument('--measure', choices=[measure for measure in MEASURES if measure != 'mad'], default='weighted_std', help='detail measure')
+    args = parser.parse_args(argv)
+
+    frames = Read_Frames(args.input)
+    if args.output.endswith('.qts'):
+        with open(args.output, 'wb') as fp:
+            written, count = Encode_Sequence(fp, frames, args.level, tolerance=args.tolerance, measure=args.measure)
+        print(f'{count} frames, {written} bytes - written to {args.output}')
+        return 0
+
+    os.makedirs(args.output, exist_ok=True)
+    count = 0
+    for count, frame in enumerate(Sequence_Frames(frames, args.level, args.filter, args.tolerance, args.measure), 1):
+        Array_Image(frame).save(os.path.join(args.output, f'frame_{count:05d}.png'))
+    print(f'{count} frames - written to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(Main())
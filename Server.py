@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# The server only imports the standard library, numpy, Pillow and the compressor are imported by the worker processes,
+# so it listens within a few tens of milliseconds and the workers are started and warmed up once it does.
+OUTPUTS = { # content type of every output of /compress
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'gif': 'image/gif', # the gif of the quad tree
+    'qtc': 'application/octet-stream', # the quad tree itself, see Codec.py
+}
+MAX_BODY_BYTES = 64 << 20 # largest image accepted
+READ_TIMEOUT = 10.0 # seconds a client gets to send its request
+REQUEST_TIMEOUT = 60.0 # seconds a compression gets, from the moment it is queued
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+               411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+               504: 'Gateway Timeout'}
+
+class BadRequest(Exception):
+    # raised by a compression in a worker process for a request that can not be compressed, answered with 400
+    pass
+
+class RequestError(Exception):
+    # raised while handling a request to answer it with an error status and message
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status, self.message, self.headers = status, message, headers or {}
+
+def Warm_Worker():
+    # initializer of the worker processes, importing the compressor before the first request needs it
+    import Main, Codec
+
+def Worker_Ready():
+    # task that makes the pool start a worker process
+    return os.getpid()
+
+def Compress_Request(data, level, color_mode, depth, output):
+    '''
+    description:
+        This function runs one compression in a worker process.
+    Args:
+        data: bytes of the image
+        level: compression level, 'Pixelated', 'Average' or 'Refined'
+        color_mode: name of the colour filter, not used by the 'qtc' output, which stores the colours as they are
+        depth: depth to cut the tree at, None for the depth of the level
+        output: 'png', 'webp', 'gif' or 'qtc'
+    Returns:
+        data: bytes of the output
+    Raises:
+        BadRequest: for an unknown level or filter and for bytes that are not an image, any other error is a bug
+    '''
+    import io
+    from PIL import Image
+    from Main import COMPRESSION_LEVELS, main, Compression_Tree
+    from Filters import FILTERS
+
+    # the level and filter are checked here, where the compressor is imported, so the server never lists them itself
+    if level not in COMPRESSION_LEVELS:
+        raise BadRequest(f'Unknown level: {level}, expected one of {", ".join(COMPRESSION_LEVELS)}')
+    if color_mode != 'No Filter' and color_mode not in FILTERS:
+        raise BadRequest(f'Unknown filter: {color_mode}')
+    try:
+        if output == 'qtc':
+            from Codec import Encode_Tree
+            tree, _, MAX_DEPTH = Compression_Tree(data, level, color_mode)
+            fp = io.BytesIO()
+            Encode_Tree(fp, tree, user_depth=MAX_DEPTH if depth is None else depth)
+            return fp.getvalue()
+
+        result = main(io.BytesIO(data), level, color_mode, need_gif=output == 'gif', depth=depth)
+        return result.gif if output == 'gif' else result.encode(output)
+    except (OSError, Image.DecompressionBombError) as error:
+        raise BadRequest(f'Cannot read the image: {error}') from None # the bytes are not an image Pillow can open
+
+def Compress_Parameters(query):
+    '''
+    description:
+        This function checks the output and depth of a /compress request, the level and filter are checked by
+        Compress_Request() in the worker, where the compressor is imported.
+    Args:
+        query: dictionary with the parameters of the query string
+    Returns:
+        level, color_mode, depth, output: see Compress_Request()
+    '''
+    output = query.get('output', 'png').lower()
+    if output not in OUTPUTS:
+        raise RequestError(400, f'Unknown output: {output}, expected one of {", ".join(OUTPUTS)}')
+
+    depth = query.get('depth')
+    if depth is not None:
+        if not depth.isdigit():
+            raise RequestError(400, f'The depth must be a whole number, not {depth}')
+        depth = int(depth)
+
+    return query.get('level', 'Average'), query.get('filter', 'No Filter'), depth, output
+
+def Json_Bytes(value):
+    return json.dumps(value).encode()
+
+async def Read_Request(reader, writer, max_body=MAX_BODY_BYTES):
+    '''
+    description:
+        This function reads an HTTP/1.1 request with a Content-Length body. A client expecting a 100 Continue
+        is told to go on once the size of its body has been checked.
+    Returns:
+        method: method of the request
+        target: path and query string of the request
+        headers: dictionary with the headers of the request, by lower case name
+        body: bytes of the body
+    '''
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise RequestError(400, 'The headers of the request are too long') from None
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError('The client closed the connection') from None
+
+    lines = head.decode('latin-1').split('\r\n')
+    request_line = lines[0].split(' ')
+    if len(request_line) != 3 or not request_line[2].startswith('HTTP/'):
+        raise RequestError(400, 'Malformed request line')
+    method, target, _ = request_line
+
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise RequestError(411, 'Chunked bodies are not supported, send a Content-Length')
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise RequestError(400, f'Malformed Content-Length: {length}')
+    if int(length) > max_body:
+        raise RequestError(413, f'The body is larger than {max_body} bytes')
+
+    if headers.get('expect', '').lower() == '100-continue':
+        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+    try:
+        body = await reader.readexactly(int(length))
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError('The client closed the connection') from None
+    return method, target, headers, body
+
+def Response_Bytes(status, content_type, payload, headers=None):
+    # the bytes of an HTTP/1.1 response, which closes the connection
+    head = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "Unknown")}', f'Content-Type: {content_type}',
+            f'Content-Length: {len(payload)}', 'Connection: close']
+    head += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload
+
+class Service:
+    '''
+    description:
+        Asyncio HTTP service compressing images in a pool of worker processes, started with the service and kept warm.
+        At most queue_size compressions are queued or running at once, a request coming when they are all taken is
+        answered with 503 at once instead of waiting, and a compression that takes longer than timeout is answered with 504.
+            GET /health: the counters of the service, as json
+            POST /compress?level=Average&filter=Sepia&depth=6&output=png: the body holds the bytes of the image,
+                the response holds the output, 'png', 'webp', 'gif' or 'qtc', see Compress_Request()
+        Errors are answered with a json object holding the 'error'.
+    Attributes:
+        workers: number of worker processes
+        queue_size: most compressions queued or running at once
+        timeout: seconds a compression gets, from the moment it is queued
+        pending: number of compressions queued or running
+        stats: dictionary counting the 'requests', the 'rejected' ones, the 'timeouts' and the 'errors'
+    '''
+
+    def __init__(self, workers=None, queue_size=None, timeout=REQUEST_TIMEOUT, executor=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or 4 * self.workers
+        self.timeout = timeout
+        self.pending = 0
+        self.stats = {'requests': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+        self._executor = executor # an executor given by the caller is not shut down by close()
+        self._own_executor = executor is None
+        self._server = None
+
+    def _start_executor(self):
+        # the workers are spawned rather than forked, a fork of the running event loop and its threads is not safe
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'), initializer=Warm_Worker)
+        self._own_executor = True # a broken pool of the caller is replaced by one of the service
+        for _ in range(self.workers):
+            self._executor.submit(Worker_Ready) # every task that finds no idle worker starts one
+
+    async def start(self, host='127.0.0.1', port=8000):
+        '''
+        description:
+            This function starts listening and then starts the worker processes, which import the compressor in the background.
+        Args:
+            host: address to listen on
+            port: port to listen on, 0 for any free port
+        Returns:
+            address: (host, port) the service listens on
+        '''
+        self._server = await asyncio.start_server(self.handle, host, port)
+        if self._executor is None:
+            self._start_executor()
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        # stops listening and, when the service started them, stops the worker processes
+        self._server.close()
+        await self._server.wait_closed()
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def handle(self, reader, writer):
+        # answers one request on a connection and closes it
+        try:
+            try:
+                method, target, _, body = await asyncio.wait_for(Read_Request(reader, writer), READ_TIMEOUT)
+                self.stats['requests'] += 1
+                status, content_type, payload = await self.respond(method, target, body)
+                headers = None
+            except asyncio.TimeoutError:
+                raise RequestError(408, f'The request was not received within {READ_TIMEOUT} seconds') from None
+        except RequestError as error:
+            status, content_type, payload, headers = error.status, 'application/json', Json_Bytes({'error': error.message}), error.headers
+        except ConnectionError:
+            writer.close()
+            return
+
+        try:
+            writer.write(Response_Bytes(status, content_type, payload, headers))
+            await writer.drain()
+        except ConnectionError:
+            pass # the client left without reading the response
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, body):
+        '''
+        description:
+            This function answers a request.
+        Returns:
+            status: HTTP status of the response
+            content_type: content type of the response
+            payload: bytes of the response
+        '''
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/health':
+            if method != 'GET':
+                raise RequestError(405, f'{url.path} only answers GET requests', {'Allow': 'GET'})
+            health = dict(self.stats, pending=self.pending, workers=self.workers, queue_size=self.queue_size)
+            return 200, 'application/json', Json_Bytes(health)
+
+        if url.path != '/compress':
+            raise RequestError(404, f'Unknown path: {url.path}')
+        if method != 'POST':
+            raise RequestError(405, f'{url.path} only answers POST requests', {'Allow': 'POST'})
+
+        level, color_mode, depth, output = Compress_Parameters(query)
+        if not body:
+            raise RequestError(400, 'The body must hold the bytes of the image')
+        return 200, OUTPUTS[output], await self.run(Compress_Request, body, level, color_mode, depth, output)
+
+    async def run(self, function, *args):
+        '''
+        description:
+            This function runs a function in the worker processes, when there is room in the queue, and waits for it
+            no longer than the timeout. A compression that timed out keeps its place in the queue until its worker
+            is done with it, so the queue always bounds the work given to the workers.
+        Returns:
+            value: what the function returned
+        '''
+        if self.pending >= self.queue_size:
+            self.stats['rejected'] += 1
+            raise RequestError(503, 'Too many compressions are queued, try again later', {'Retry-After': '1'})
+
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            future = self._executor.submit(function, *args)
+        except BrokenProcessPool:
+            # a worker died, like one killed for running out of memory, so the pool is started again
+            self._executor.shutdown(wait=False, cancel_futures=True) # stops the thread and queues of the broken pool
+            self._start_executor()
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self.pending -= 1
+            raise
+        future.add_done_callback(lambda _: self._finished(loop))
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel() # a queued compression never starts, a running one is finished by its worker and dropped
+            self.stats['timeouts'] += 1
+            raise RequestError(504, f'The compression took longer than {self.timeout} seconds') from None
+        except BadRequest as error:
+            raise RequestError(400, str(error)) from None
+        except Exception as error:
+            # a bug or a dead worker, its details are logged here and not sent to the client
+            self.stats['errors'] += 1
+            traceback.print_exception(error, file=sys.stderr)
+            raise RequestError(500, 'The compression failed') from None
+
+    def _finished(self, loop):
+        # called on the thread of the pool when a compression is done, which frees its place in the queue on the event loop
+        try:
+            loop.call_soon_threadsafe(self._free)
+        except RuntimeError:
+            pass # the event loop was closed while the worker was busy
+
+    def _free(self):
+        self.pending -= 1
+
+class Client:
+    '''
+    description:
+        Client running the service in the same process, on a free port of the running event loop, and sending
+        requests to it over a real connection, to try the service locally or in a test.
+            async with Client(Service(workers=1)) as client:
+                status, headers, body = await client.compress(data, level='Refined', output='gif')
+    Attributes:
+        service: the Service the requests are sent to
+    '''
+
+    def __init__(self, service=None):
+        self.service = service or Service()
+
+    async def __aenter__(self):
+        self.host, self.port = await self.service.start('127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.service.close()
+
+    async def request(self, method, target, body=b''):
+        '''
+        description:
+            This function sends a request to the service and reads its response.
+        Args:
+            method: method of the request
+            target: path and query string of the request
+            body: bytes of the body
+        Returns:
+            status: HTTP status of the response
+            headers: dictionary with the headers of the response, by lower case name
+            body: bytes of the body of the response
+        '''
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = f'{method} {target} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (line := (await reader.readline()).decode('latin-1').strip()):
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            return status, headers, await reader.readexactly(int(headers.get('content-length', 0)))
+        finally:
+            writer.close()
+
+    async def compress(self, data, **parameters):
+        # POST /compress with the bytes of an image, the parameters being level, filter, depth and output
+        return await self.request('POST', '/compress?' + urlencode(parameters), data)
+
+    async def health(self):
+        status, _, body = await self.request('GET', '/health')
+        return status, json.loads(body)
+
+async def Serve(host, port, workers=None, queue_size=None, timeout=REQUEST_TIMEOUT):
+    service = Service(workers, queue_size, timeout)
+    host, port = await service.start(host, port)
+    print(f'Listening on http://{host}:{port} with {service.workers} workers', flush=True)
+
+    serving = asyncio.ensure_future(service.serve_forever())
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel) # stopped the same way as by ctrl-c, so the workers stop too
+    except NotImplementedError:
+        pass # no signal handlers on Windows
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await service.close()
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the QuadTree image compressor over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes, one per cpu by default')
+    parser.add_argument('--queue', type=int, default=None, help='most compressions queued or running at once, 4 per worker by default')
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT, help='seconds a compression gets')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(Serve(args.host, args.port, args.workers, args.queue, args.timeout))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(Main())
@@ -1,13 +1,8 @@
 import streamlit as st
-import os
-import tempfile
-from Main import main
-from io import BytesIO
-import base64
+from Jobs import JOB_POOL
+from Main import COMPRESSION_LEVELS
+from Cache import Cache_Stats
 import time
-from PIL import Image
-import numpy as np
-from sklearn.cluster import KMeans
 
 st.set_page_config(page_title='QuadTree Image Compressor', layout="wide", page_icon=':camera:')
 
@@ -20,33 +15,21 @@ def convert_size(size_bytes):
     else:
         return f"{size_bytes / 1048576:.2f} MB"
     
-def display_major_colors(image_path):
-    # Load the image
-    image = Image.open(image_path)
-
-    # Convert the image to RGB
-    image = image.convert('RGB')
-
-    # Reshape the image to be a list of RGB pixels
-    pixels = np.array(image).reshape(-1, 3)
-
-    # Perform K-means clustering to find the most dominant colors
-    kmeans = KMeans(n_clusters=3)
-    kmeans.fit(pixels)
-
-    # Get the RGB values of the cluster centers
-    colors = kmeans.cluster_centers_
+def display_major_colors(palette):
+    # The dominant colours come with the compressed image, found from the colours of its quadrants weighted by their
+    # area instead of clustering every pixel of the image, see Palette.py
+    colors, shares = palette
 
     st.subheader('Dominant Colors')
     # Create a row of columns
-    cols = st.columns(3)
+    cols = st.columns(max(len(colors), 1))
     
     # Display the dominant colors
-    for i, color in enumerate(colors):
+    for i, (color, share) in enumerate(zip(colors.tolist(), shares.tolist())):
         # Convert RGB values to hexadecimal color code
-        color_hex = '#%02x%02x%02x' % (int(color[0]), int(color[1]), int(color[2]))
+        color_hex = '#%02x%02x%02x' % tuple(color)
         cols[i].markdown(f'<div style="background-color: {color_hex}; height: 50px; width: 50px;"></div>', unsafe_allow_html=True)
-        cols[i].markdown(f'<p>{color_hex}</p>', unsafe_allow_html=True)
+        cols[i].markdown(f'<p>{color_hex} ({share:.0%})</p>', unsafe_allow_html=True)
 
 # Define function for main application
 def Main():
@@ -61,14 +44,27 @@ def Main():
 
         with st.form(key='Options_Form'):
             st.title('Options')
-            compression_level = st.radio("Compression Level", ("Pixelated", "Average", "Refined"), index=1)
+            compression_level = st.radio("Compression Level", tuple(COMPRESSION_LEVELS), index=1)
+
+            # a target replaces the detail threshold of the compression level, which then only sets the depth
+            target_kind = st.selectbox('Target', ('None', 'Number of quadrants', 'Size (KB)', 'Quality (PSNR dB)'))
+            target_value = st.number_input('Target value', min_value=1.0, value=100.0, step=1.0)
+            target = {
+                'Number of quadrants': ('leaves', int(target_value)),
+                'Size (KB)': ('bytes', int(target_value * 1024)),
+                'Quality (PSNR dB)': ('psnr', target_value),
+            }.get(target_kind)
             
             
             set = st.selectbox('Set Filter On Image', ('No Filter', 'Gray Scale', 'Black and White', 'Sepia', 'Inverted', 'Thresholded', 'Brightened', 'High Contrast', 'Soft Blur', 'Emboss-like'))
 
+            palette_size = st.number_input('Dominant colours', min_value=1, max_value=16, value=3, step=1)
+
             # need_gif = st.sidebar.selectbox('Do you want a gif?', ('No', 'Yes'))
             need_gif = 'Yes' if st.checkbox('Do you want a gif?') else 'No'
 
+            download_format = st.radio('Download Format', ('PNG', 'WEBP'), horizontal=True) # webp is lossless too, and usually smaller
+
             submit_button = st.form_submit_button(label='Apply Changes', type="primary", use_container_width=True)
  
 
@@ -139,7 +135,7 @@ def Main():
     st.divider()
 
     # Image upload
-    uploaded_file = st.file_uploader("Upload Image", type=["png", "jpg", "jpeg"])
+    uploaded_file = st.file_uploader("Upload Image", type=["png", "jpg", "jpeg", "gif", "bmp", "tif", "tiff", "webp"])
 
     if uploaded_file and compression_level:
         st.subheader('Original Image')
@@ -149,54 +145,67 @@ def Main():
 
         # Progress Bar
         if st.button('Start Compression'):
-            with st.spinner('Generating image...have patience, it may take a while!'):
-                start_time = time.time()
-                if need_gif == 'Yes':
-                    compressed_image, gif = main(uploaded_file, compression_level, set, True)
-                    # Convert the BytesIO object to a base64 encoded string
-                    gif.seek(0)
-                    gif_base64 = base64.b64encode(gif.read()).decode()
-                else:
-                    compressed_image = main(uploaded_file, compression_level, set)
-                end_time = time.time()
-                st.success('Image Compression Complete!')
-
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-                compressed_image.save(temp_file.name)
-
+            # the compression runs in the shared pool of workers, so this session stays responsive while it waits its turn
+            job = JOB_POOL.submit(uploaded_file.getvalue(), compression_level, set, need_gif == 'Yes', replaces=st.session_state.get('job_id'), target=target, palette=int(palette_size))
+            st.session_state.job_id = job.id
+            st.session_state.pop('job', None) # the result of the job before is replaced
+
+        # a running job is in the pool, a finished one has been claimed by this session along with its result
+        job = JOB_POOL.get(st.session_state.get('job_id')) or st.session_state.get('job')
+        if job:
+            if not job.done() and st.button('Cancel Compression'):
+                job.cancel()
+
+            progress_bar = st.progress(0.0, text=job.message())
+            while not job.done():
+                position = JOB_POOL.position(job)
+                progress_bar.progress(job.fraction, text=f'{job.message()} ({position} jobs ahead)' if position else job.message())
+                time.sleep(0.2)
+            progress_bar.empty()
+            st.session_state.job = JOB_POOL.claim(job.id) or job # the reruns of the page, like a download click, read it from here
+
+            if job.cancelled():
+                st.warning('Compression cancelled.')
+                return
+            if job.future.exception():
+                st.error(f'Compression failed: {job.future.exception()}')
+                return
+
+            # the result holds the compressed image in memory and encodes it once, the reruns of the page reuse its bytes
+            result = job.result()
+            start_time, end_time = job.started, job.finished
+            st.success('Image Compression Complete!')
+
+            compressed_data = result.encode(download_format)
             st.subheader('Compressed Image')
-            st.image(temp_file.name, caption='Compressed Image', use_column_width=True)
-            compressed_size = os.path.getsize(temp_file.name)
+            st.image(compressed_data, caption='Compressed Image', use_column_width=True)
+            compressed_size = len(compressed_data)
             st.write('**Compressed Size:** ' + convert_size(compressed_size))
 
             # Display the major colors of the compressed image
-            display_major_colors(temp_file.name)
+            if result.palette is not None:
+                display_major_colors(result.palette)
 
             # Calculate and display the compression performance
             compression_ratio = (original_size - compressed_size) / original_size * 100
             st.success(f'**Compression Performance:** The image was compressed by {compression_ratio:.2f}%')
             st.success(f'**Time Taken:** {end_time - start_time:.2f} seconds')
-            
-            # Convert the compressed image to binary data
-            buffered = BytesIO()
-            compressed_image.save(buffered, format="PNG")
-            binary_data = buffered.getvalue()
+            st.caption('Cache: ' + ', '.join(f"{name} {stats['hits'] + stats['disk_hits']} hits / {stats['misses']} misses" for name, stats in Cache_Stats().items()))
 
             # Download button for the compressed image
-            st.download_button(label="Download Compressed Image", data=binary_data, file_name='compressed_image.png', mime='image/png')
+            st.download_button(label="Download Compressed Image", data=compressed_data, file_name=result.file_name('compressed_image', download_format), mime=result.mime(download_format))
             st.markdown("---")
 
-            
-            if need_gif == 'Yes':
+            # the gif option may have changed since the job was submitted, so the result tells whether there is one
+            if result.gif is not None:
                 st.subheader('Gif')
-                # Embed the base64 encoded string in an HTML img tag
-                st.markdown(f'<img src="data:image/gif;base64,{gif_base64}" alt="Gif" style="width:50%">', unsafe_allow_html=True)
-                gif_size = len(gif_base64)
-                st.write('**Gif Size:** ' + convert_size(gif_size))
+                # the gif bytes are shown as they are, which keeps the animation
+                gif_column, _ = st.columns(2)
+                gif_column.image(result.gif, caption='Gif', use_column_width=True)
+                st.write('**Gif Size:** ' + convert_size(len(result.gif)))
 
                 # Download button for the GIF
-                gif.seek(0)
-                st.download_button(label="Download GIF", data=gif, file_name="compressed_gif.gif", mime="image/gif")
+                st.download_button(label="Download GIF", data=result.gif, file_name="compressed_gif.gif", mime="image/gif")
             
 # Run the main application
 if __name__ == '__main__':
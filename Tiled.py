@@ -0,0 +1,280 @@
+import argparse
+import os
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from Main import COMPRESSION_LEVELS, BAND_PIXELS, Compression_Settings, Build_Subtrees, Rasterize_Bands, Get_Leaf_Quadrants
+from Filters import Apply_Filter, FILTERS
+from Codec import COMPRESSIONS, Encode_Image
+from Pixels import Image_Layout, Normalize_Image, Has_Alpha
+
+TILE_PIXELS = 1 << 24 # most pixels in the quadrant of one subtree
+PNG_COLOUR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6} # png colour type of every layout of Pixels.py: grey, grey and alpha, RGB, RGBA
+
+def Store_Pixels(image_path, path):
+    '''
+    description:
+        This function copies the pixels of an image into a memory-mapped .npy file, one band of rows at a time,
+        in the layout of the image, see Pixels.py, and finds the bounding box of the image on the way, the same as
+        Image.getbbox() does.
+        Pillow decodes most formats in one go, so the decoded image is held once while it is copied,
+        but no other copy of it is made.
+    Args:
+        image_path: path of the image to store
+        path: path of the .npy file to write
+    Returns:
+        bbox: bounding box of the image, or None for an all black image
+    '''
+    with Image.open(image_path) as image:
+        width, height = image.size
+        layout = Image_Layout(image) # found once, so every band gets the same layout
+        pixels = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, len(layout)))
+        step = max(1, BAND_PIXELS // width)
+        bbox = None
+
+        for top in range(0, height, step):
+            band = Normalize_Image(image.crop((0, top, width, min(top + step, height))), layout)
+            band_bbox = band.getbbox()
+            if band_bbox:
+                band_bbox = (band_bbox[0], band_bbox[1] + top, band_bbox[2], band_bbox[3] + top)
+                bbox = band_bbox if bbox is None else (min(bbox[0], band_bbox[0]), bbox[1], max(bbox[2], band_bbox[2]), band_bbox[3])
+            pixels[top:top + band.size[1]] = np.asarray(band).reshape(band.size[1], width, len(layout))
+
+        pixels.flush()
+        return bbox
+
+def Pixels_Bbox(pixels):
+    '''
+    description:
+        This function finds the bounding box of the pixels that are not black, one band of rows at a time,
+        the same as Image.getbbox() does, which only looks at the alpha channel of an image that has one.
+    Args:
+        pixels: (height, width, channels) array of the image
+    Returns:
+        bbox: bounding box of the image, or None for an all black image
+    '''
+    height, width, channels = pixels.shape
+    step = max(1, BAND_PIXELS // width)
+    columns, rows = np.zeros(width, dtype=bool), np.zeros(height, dtype=bool)
+
+    for top in range(0, height, step):
+        band = pixels[top:top + step]
+        filled = band[:, :, -1] != 0 if Has_Alpha(channels) else (band != 0).any(axis=2)
+        columns |= filled.any(axis=0)
+        rows[top:top + len(band)] = filled.any(axis=1)
+
+    if not rows.any():
+        return None
+    column_indices, row_indices = np.flatnonzero(columns), np.flatnonzero(rows)
+    return int(column_indices[0]), int(row_indices[0]), int(column_indices[-1]) + 1, int(row_indices[-1]) + 1
+
+def Tile_Depth(bbox, MAX_DEPTH, tile_pixels=TILE_PIXELS):
+    # the shallowest depth whose quadrants hold no more than tile_pixels pixels, which is where the subtrees start
+    left, top, right, bottom = bbox
+    depth = 0
+    while depth < MAX_DEPTH + 1 and (right - left) * (bottom - top) > tile_pixels * 4 ** depth:
+        depth += 1
+    return depth
+
+def Build_Tiled(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, tile_pixels=TILE_PIXELS, workers=1):
+    '''
+    description:
+        This function builds the quad tree of an image stored in a memory-mapped .npy file with Build_Subtrees(),
+        one tile of at most tile_pixels pixels at a time. The tiles are the quadrants of the tree at the depth where
+        they get small enough, so the subtree of every tile lines up with the grid of the whole tree.
+    Args:
+        path: path of the .npy file with the (height, width, channels) pixels of the image
+        bbox: bounding box of the root quadrant
+        tile_pixels: most pixels in a tile
+        workers: number of worker processes building the tiles
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    top_depth = Tile_Depth(bbox, MAX_DEPTH, tile_pixels)
+    if workers == 1:
+        return Build_Subtrees(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, top_depth)
+
+    with ProcessPoolExecutor(workers) as executor:
+        return Build_Subtrees(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, top_depth, executor.map, workers)
+
+def Write_Png(fp, size, bands, channels=3):
+    '''
+    description:
+        This function writes a png one band of rows at a time, so the image is never held in memory as a whole.
+        Every row is filtered with the png 'Up' filter, which turns the rows inside a quadrant into zeros.
+    Args:
+        fp: file object to write the png to
+        size: (width, height) of the image
+        bands: iterable of (rows, width, channels) uint8 arrays with the rows of the image from top to bottom
+        channels: number of channels of the image, in a layout of Pixels.py
+    '''
+    def chunk(kind, data):
+        fp.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+    width, height = size
+    fp.write(b'\x89PNG\r\n\x1a\n')
+    chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, PNG_COLOUR_TYPES[channels], 0, 0, 0)) # 8 bit channels, no interlacing
+
+    compressor = zlib.compressobj()
+    previous = np.zeros((1, width * channels), dtype=np.uint8)
+    for band in bands:
+        rows = np.asarray(band, dtype=np.uint8).reshape(len(band), width * channels)
+        filtered = np.empty((len(rows), width * channels + 1), dtype=np.uint8)
+        filtered[:, 0] = 2 # 'Up' filter
+        filtered[:, 1:] = rows - np.concatenate([previous, rows[:-1]]) # wraps around, as the filter expects
+        previous = rows[-1:]
+
+        data = compressor.compress(filtered.tobytes())
+        if data:
+            chunk(b'IDAT', data)
+    chunk(b'IDAT', compressor.flush())
+    chunk(b'IEND', b'')
+
+def Image_Bands(tree, leaf_quadrants, colours, show_lines=False, band_pixels=BAND_PIXELS):
+    '''
+    description:
+        This function gets the whole rows of the image from the bands of Rasterize_Bands(), adding the black border
+        outside the bounding box of the root quadrant.
+    Returns:
+        bands: generator of (rows, width, channels) uint8 arrays with the rows of the image from top to bottom
+    '''
+    width, height = tree.size
+    left, top, right, bottom = tree.bbox[0].tolist()
+    step = max(1, band_pixels // max(width, 1))
+    channels = colours.shape[1]
+
+    for row in range(0, top, step):
+        yield np.zeros((min(step, top - row), width, channels), dtype=np.uint8)
+
+    for row, pixels in Rasterize_Bands(tree, leaf_quadrants, colours, show_lines, band_pixels):
+        if (left, right) == (0, width):
+            yield pixels
+        else:
+            band = np.zeros((len(pixels), width, channels), dtype=np.uint8)
+            band[:, left:right] = pixels
+            yield band
+
+    for row in range(bottom, height, step):
+        yield np.zeros((min(step, height - row), width, channels), dtype=np.uint8)
+
+def Mapped_Pixels(input_path, directory):
+    '''
+    description:
+        This function gets a memory-mapped .npy file with the pixels of an image. A (height, width, channels) uint8 .npy
+        image is used as it is, with channels in a layout of Pixels.py. A (height, width) .npy image is grey, layout L,
+        and is copied into a (height, width, 1) .npy file in the directory one band of rows at a time, as is any other
+        image with Store_Pixels().
+    Args:
+        input_path: path of the image
+        directory: directory to write the .npy file to
+    Returns:
+        path: path of the .npy file
+        bbox: bounding box of the root quadrant, the whole image when it is all black
+    '''
+    if input_path.endswith('.npy'):
+        pixels = np.load(input_path, mmap_mode='r')
+        if pixels.dtype != np.uint8:
+            raise ValueError(f'A .npy image must hold uint8 pixels, not {pixels.dtype}')
+        if pixels.ndim not in (2, 3) or pixels.ndim == 3 and pixels.shape[2] not in PNG_COLOUR_TYPES:
+            raise ValueError(f'A .npy image must have the shape (height, width) or (height, width, channels) with 1 to 4 channels, not {pixels.shape}')
+
+        path = input_path
+        if pixels.ndim == 2:
+            path = os.path.join(directory, 'pixels.npy')
+            grey = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=pixels.shape + (1,))
+            step = max(1, BAND_PIXELS // max(pixels.shape[1], 1))
+            for top in range(0, len(pixels), step):
+                grey[top:top + step, :, 0] = pixels[top:top + step]
+            grey.flush()
+            pixels = grey
+        bbox = Pixels_Bbox(pixels)
+    else:
+        path = os.path.join(directory, 'pixels.npy')
+        bbox = Store_Pixels(input_path, path)
+
+    height, width = np.load(path, mmap_mode='r').shape[:2]
+    return path, bbox or (0, 0, width, height) # an all black image has no bounding box
+
+def Compress_Tiled(input_path, output_path, option='Average', color_mode='No Filter', tile_pixels=TILE_PIXELS, workers=1, show_lines=False):
+    '''
+    description:
+        This function compresses an image too large to hold in memory. A .npy image is memory-mapped as it is,
+        any other image is first copied into a temporary memory-mapped .npy file. The tree is built tile by tile
+        with Build_Tiled() and the compressed png is rendered and written one band of rows at a time.
+    Args:
+        input_path: path of the image to compress
+        output_path: path to write the compressed png to
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        color_mode: name of the colour filter
+        tile_pixels: most pixels in a tile
+        workers: number of worker processes building the tiles
+        show_lines: flag to draw the lines of the quadrants
+    Returns:
+        tree: QuadTree of the image
+        max_depth: maximum depth of the quad tree
+    '''
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path, bbox = Mapped_Pixels(input_path, directory)
+        tree, max_depth = Build_Tiled(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, tile_pixels, workers)
+
+    leaf_quadrants = Get_Leaf_Quadrants(tree, max_depth, min(MAX_DEPTH, max_depth))
+    colours = Apply_Filter(tree.colour[leaf_quadrants], color_mode)
+    with open(output_path, 'wb') as fp:
+        Write_Png(fp, tree.size, Image_Bands(tree, leaf_quadrants, colours, show_lines), colours.shape[1])
+
+    return tree, max_depth
+
+def Encode_Tiled(input_path, output_path, option='Average', compression='zlib'):
+    '''
+    description:
+        This function writes the quad tree of an image too large to hold in memory to a .qtc file with Codec.Encode_Image(),
+        reading the memory-mapped pixels one band at a time and writing every level of the tree as soon as it is built,
+        so neither the image nor the tree is ever held in memory as a whole.
+    Args:
+        input_path: path of the image to compress, or a .npy file with its pixels
+        output_path: path to write the .qtc file to
+        option: compression level, 'Pixelated', 'Average' or 'Refined'
+        compression: 'none', 'zlib' or 'lzma'
+    Returns:
+        written: number of bytes written
+    '''
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path, bbox = Mapped_Pixels(input_path, directory)
+        with open(output_path, 'wb') as fp:
+            return Encode_Image(fp, np.load(path, mmap_mode='r'), bbox, MAX_DEPTH, DETAIL_THRESHOLD, compression)
+
+def Main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress an image too large for memory with the QuadTree image compressor.')
+    parser.add_argument('input', help='image to compress, or a .npy file with its (height, width) or (height, width, channels) uint8 pixels')
+    parser.add_argument('output', help='path of the compressed png, or of a .qtc file to store the quad tree itself')
+    parser.add_argument('--level', choices=list(COMPRESSION_LEVELS), default='Average', help='compression level')
+    parser.add_argument('--filter', choices=['No Filter'] + list(FILTERS), default='No Filter', help='colour filter')
+    parser.add_argument('--tile-pixels', type=int, default=TILE_PIXELS, help='most pixels in a tile')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes building the tiles')
+    parser.add_argument('--lines', action='store_true', help='draw the lines of the quadrants')
+    parser.add_argument('--compression', choices=list(COMPRESSIONS), default='zlib', help='compression of a .qtc output')
+    args = parser.parse_args(argv)
+
+    Image.MAX_IMAGE_PIXELS = None # the images given on the command line are trusted to be as large as they are
+    try:
+        if args.output.endswith('.qtc'):
+            written = Encode_Tiled(args.input, args.output, args.level, args.compression)
+            print(f'{written} bytes - written to {args.output}')
+            return 0
+
+        tree, max_depth = Compress_Tiled(args.input, args.output, args.level, args.filter, args.tile_pixels, args.jobs, args.lines)
+    except ValueError as error: # a .npy image that is not uint8 pixels in a layout of Pixels.py
+        parser.error(str(error))
+    print(f'{len(tree)} quadrants, depth {max_depth} - written to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(Main())
@@ -0,0 +1,26 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# the modules of the compressor are flat files at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def Synthetic_Pixels(channels, width=97, height=75, seed=0):
+    # flat blocks, a gradient and noise, so the tree has both leaves near the root and deep levels
+    rng = np.random.default_rng(seed)
+    pixels = np.zeros((height, width, channels), dtype=np.uint8)
+    pixels[:, :] = np.linspace(0, 255, width, dtype=np.uint8)[:, None]
+    pixels[10:40, 20:70] = rng.integers(0, 256, channels)
+    pixels[45:, 50:] = rng.integers(0, 256, (height - 45, width - 50, channels))
+    return pixels
+
+@pytest.fixture(params=[1, 2, 3, 4], ids=['L', 'LA', 'RGB', 'RGBA'])
+def pixels(request):
+    # pixels of a small image in every layout of Pixels.py
+    return Synthetic_Pixels(request.param)
+
+def Assert_Same_Tree(tree, expected, detail=True):
+    # the two QuadTrees hold the same quadrants in the same order
+    for field in ('bbox', 'depth', 'colour', 'first_child') + (('detail',) if detail else ()):
+        np.testing.assert_array_equal(getattr(tree, field), getattr(expected, field), err_msg=field)
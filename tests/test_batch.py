@@ -0,0 +1,85 @@
+import csv
+import os
+import pytest
+import Batch
+from Batch import Compress_File, Run_Batch, Main
+from Pixels import Array_Image
+from conftest import Synthetic_Pixels
+
+@pytest.fixture
+def in_dir(tmp_path):
+    # two images, one of them in a folder, and a file with an image extension that is not an image
+    in_dir = tmp_path / 'in'
+    (in_dir / 'folder').mkdir(parents=True)
+    Array_Image(Synthetic_Pixels(3)).save(in_dir / 'a.png')
+    Array_Image(Synthetic_Pixels(4, seed=1)).save(in_dir / 'folder' / 'b.png')
+    (in_dir / 'broken.png').write_bytes(b'not an image')
+    return in_dir
+
+def Statuses(rows):
+    # status of every row by the name of its input
+    return {os.path.basename(row['input']): row['status'] for row in rows}
+
+def Dying_Compress(input_path, *args):
+    # Compress_File() whose worker process dies on the image named dies.png, as one killed for running out of memory would
+    if os.path.basename(input_path) == 'dies.png':
+        os._exit(1)
+    return Compress_File(input_path, *args)
+
+def test_compresses_and_reports_broken_images(in_dir, tmp_path):
+    out_dir = tmp_path / 'out'
+    rows = list(Run_Batch(str(in_dir), str(out_dir), jobs=2))
+    assert Statuses(rows) == {'a.png': 'done', 'b.png': 'done', 'broken.png': 'failed'}
+    assert next(row for row in rows if row['status'] == 'failed')['error'].startswith('UnidentifiedImageError')
+
+    assert (out_dir / 'a.png').exists() and (out_dir / 'folder' / 'b.png').exists()
+    assert not (out_dir / 'broken.png').exists()
+
+def test_skips_outputs_up_to_date(in_dir, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    list(Run_Batch(str(in_dir), out_dir, jobs=1))
+
+    assert Statuses(Run_Batch(str(in_dir), out_dir, jobs=1)) == {'a.png': 'skipped', 'b.png': 'skipped', 'broken.png': 'failed'}
+    assert Statuses(Run_Batch(str(in_dir), out_dir, jobs=1, force=True))['a.png'] == 'done'
+
+    # outputs made with other settings, or older than their image, are made again
+    assert Statuses(Run_Batch(str(in_dir), out_dir, 'Refined', jobs=1))['a.png'] == 'done'
+    assert Statuses(Run_Batch(str(in_dir), out_dir, 'Refined', 'Sepia', jobs=1))['a.png'] == 'done'
+    assert Statuses(Run_Batch(str(in_dir), out_dir, 'Refined', 'Sepia', jobs=1, need_gif=True))['a.png'] == 'done'
+    assert Statuses(Run_Batch(str(in_dir), out_dir, 'Refined', 'Sepia', jobs=1))['a.png'] == 'skipped' # a gif made before does no harm
+
+    later = os.path.getmtime(os.path.join(out_dir, 'a.png')) + 10
+    os.utime(in_dir / 'a.png', (later, later))
+    assert Statuses(Run_Batch(str(in_dir), out_dir, 'Refined', 'Sepia', jobs=1)) == {'a.png': 'done', 'b.png': 'skipped', 'broken.png': 'failed'}
+
+def test_images_sharing_a_stem(tmp_path):
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    Array_Image(Synthetic_Pixels(3)).save(in_dir / 'a.png')
+    Array_Image(Synthetic_Pixels(3)).save(in_dir / 'a.bmp')
+    rows = list(Run_Batch(str(in_dir), str(tmp_path / 'out'), jobs=1))
+    assert sorted(os.path.basename(row['output']) for row in rows) == ['a_bmp.png', 'a_png.png']
+
+def test_dead_worker_fails_only_its_image(in_dir, tmp_path, monkeypatch):
+    for index in range(3):
+        Array_Image(Synthetic_Pixels(1, seed=index)).save(in_dir / f'c{index}.png')
+    (in_dir / 'dies.png').write_bytes((in_dir / 'a.png').read_bytes())
+    monkeypatch.setattr(Batch, 'Compress_File', Dying_Compress)
+
+    rows = list(Run_Batch(str(in_dir), str(tmp_path / 'out'), jobs=2))
+    statuses = Statuses(rows)
+    assert statuses.pop('dies.png') == 'failed' and statuses.pop('broken.png') == 'failed'
+    assert set(statuses.values()) == {'done'} and len(statuses) == 5
+
+def test_reports_of_reruns_are_kept(in_dir, tmp_path):
+    out_dir, report_path = str(tmp_path / 'out'), str(tmp_path / 'report.csv')
+    assert Main([str(in_dir), out_dir, '--report', report_path, '-j', '1']) == 1 # the broken image failed
+    assert Main([str(in_dir), out_dir, '--report', report_path, '-j', '1']) == 1
+
+    with open(report_path, newline='') as report:
+        rows = list(csv.DictReader(report))
+    assert [row['status'] for row in rows].count('done') == 2 and [row['status'] for row in rows].count('skipped') == 2
+
+def test_output_directory_must_not_be_input(in_dir):
+    with pytest.raises(SystemExit):
+        Main([str(in_dir), str(in_dir)])
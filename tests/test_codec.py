@@ -0,0 +1,61 @@
+import io
+import numpy as np
+import pytest
+from Main import Start_QuadTree, Create_Image
+from Codec import COMPRESSIONS, Encode_Tree, Encode_Image, Decode_Tree, Decode_Image, Preview_Image
+from Pixels import Array_Image
+
+MAX_DEPTH, DETAIL_THRESHOLD = 5, 10 # a small tree with its leaves spread over several depths
+
+@pytest.fixture
+def tree(pixels):
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    return tree
+
+@pytest.mark.parametrize('compression', list(COMPRESSIONS))
+@pytest.mark.parametrize('user_depth', [None, 0, 2, MAX_DEPTH])
+def test_round_trip(tree, compression, user_depth):
+    data = io.BytesIO()
+    Encode_Tree(data, tree, compression, user_depth)
+    data.seek(0)
+    decoded, max_depth = Decode_Tree(data)
+
+    # the decoded tree is the tree cut at the depth, the quadrants at that depth becoming leaves
+    last = tree.max_depth if user_depth is None else min(user_depth, tree.max_depth)
+    kept = slice(0, tree.level(last).stop)
+    assert max_depth == last
+    np.testing.assert_array_equal(decoded.bbox, tree.bbox[kept])
+    np.testing.assert_array_equal(decoded.depth, tree.depth[kept])
+    np.testing.assert_array_equal(decoded.colour, tree.colour[kept])
+    np.testing.assert_array_equal(decoded.leaf, tree.leaf[kept] | (tree.depth[kept] == last))
+
+    data.seek(0)
+    expected = Create_Image(tree, tree.max_depth, last)
+    np.testing.assert_array_equal(np.asarray(Decode_Image(data)), np.asarray(expected))
+
+def test_encode_image_matches_encode_tree(pixels, tree):
+    streamed, whole = io.BytesIO(), io.BytesIO()
+    Encode_Image(streamed, pixels, tuple(tree.bbox[0].tolist()), MAX_DEPTH, DETAIL_THRESHOLD)
+    Encode_Tree(whole, tree)
+    assert streamed.getvalue() == whole.getvalue()
+
+def test_preview(tree, tmp_path):
+    path = tmp_path / 'tree.qtc'
+    with open(path, 'wb') as file:
+        Encode_Tree(file, tree)
+
+    for depth in range(tree.max_depth + 1):
+        preview = Preview_Image(path, max_size=None, user_depth=depth)
+        np.testing.assert_array_equal(np.asarray(preview), np.asarray(Create_Image(tree, tree.max_depth, depth)))
+
+    assert max(Preview_Image(path, max_size=32).size) == 32
+
+def test_truncated_and_corrupt_files(tree):
+    data = io.BytesIO()
+    Encode_Tree(data, tree, 'none')
+    whole = data.getvalue()
+
+    with pytest.raises(ValueError):
+        Decode_Tree(io.BytesIO(whole[:len(whole) // 2]))
+    with pytest.raises(ValueError):
+        Decode_Tree(io.BytesIO(b'XYZ' + whole[3:]))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from Main import MEASURES, Compression_Settings, Start_QuadTree
+from Pixels import Array_Image
+from conftest import Assert_Same_Tree
+
+MAX_DEPTH, DETAIL_THRESHOLD = 5, 10 # a small tree with its leaves spread over several depths
+
+def Crop_Tree(pixels, measure='weighted_std'):
+    # the tree of the original engine, which crops the image and takes the histogram of every quadrant
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, 'crop', measure=measure)
+    return tree
+
+@pytest.mark.parametrize('engine', ['integral', 'breadth_first'])
+@pytest.mark.parametrize('measure', list(MEASURES))
+def test_summed_area_engines_match_crop(pixels, engine, measure):
+    tree, max_depth = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, engine, measure=measure)
+    Assert_Same_Tree(tree, Crop_Tree(pixels, measure))
+    assert max_depth == tree.max_depth
+
+def test_all_black_image():
+    # an all black image has no bounding box, so the root is the whole image
+    pixels = np.zeros((20, 30, 3), dtype=np.uint8)
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    Assert_Same_Tree(tree, Crop_Tree(pixels))
+    assert len(tree) == 1 and tree.bbox[0].tolist() == [0, 0, 30, 20]
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_tree_matches_breadth_first(pixels, workers):
+    tree, max_depth = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, workers=workers)
+    expected, expected_depth = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    Assert_Same_Tree(tree, expected)
+    assert max_depth == expected_depth
+
+@pytest.mark.parametrize('measure', list(MEASURES))
+def test_unbounded_best_first_matches_breadth_first(pixels, measure):
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, 'best_first', measure=measure)
+    expected, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, measure=measure)
+    Assert_Same_Tree(tree, expected)
+
+def test_best_first_with_distant_deadline_matches_breadth_first(pixels):
+    # with a deadline the summed-area tables start coarse and are rebuilt finer for the deep quadrants
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings('Refined')
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, 'best_first', time_budget=3600)
+    expected, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    Assert_Same_Tree(tree, expected)
+
+@pytest.mark.parametrize('max_nodes', [1, 5, 50, 200])
+def test_best_first_node_budget(pixels, max_nodes):
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD, 'best_first', max_nodes=max_nodes)
+    full, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    assert len(tree) <= max(max_nodes, 1)
+
+    # the tree is the full tree with some splits left out
+    full_quadrants = {tuple(bbox) for bbox in full.bbox.tolist()}
+    assert {tuple(bbox) for bbox in tree.bbox.tolist()} <= full_quadrants
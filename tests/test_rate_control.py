@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from Main import Start_Rate_Control, Png_Size
+from Pixels import Array_Image
+from RateControl import RateControl
+
+MAX_DEPTH = 5
+
+@pytest.fixture
+def rate(pixels):
+    return Start_Rate_Control(Array_Image(pixels), MAX_DEPTH)
+
+def Half_Perimeter(tree):
+    # summed half perimeter of the leaves of a tree, an output size growing exactly with RateControl.edges()
+    width, height = (tree.bbox[tree.leaf, 2:4] - tree.bbox[tree.leaf, 0:2]).astype(np.int64).T
+    return int(np.where(width * height > 0, width + height, 0).sum())
+
+def test_round_trip(rate):
+    loaded = RateControl.from_bytes(rate.to_bytes())
+    np.testing.assert_array_equal(loaded.order, rate.order)
+    np.testing.assert_array_equal(loaded.error, rate.error)
+
+@pytest.mark.parametrize('budget', [0, 1, 4, 50, 301, 10 ** 9])
+def test_leaves_target(rate, budget):
+    splits = rate.select('leaves', budget)
+    leaves = int(rate.prune(splits).leaf.sum())
+    assert leaves == rate.leaves(splits)
+    assert leaves <= max(budget, 1) and (splits == len(rate.order) or rate.leaves(splits + 1) > budget)
+
+@pytest.mark.parametrize('decibels', [10, 20, 30, 45, 200])
+def test_psnr_target(rate, decibels):
+    splits = rate.select('psnr', decibels)
+    if splits < len(rate.order):
+        assert rate.psnr(splits) >= decibels
+    assert splits == 0 or rate.psnr(splits - 1) < decibels # the fewest splits
+
+def test_edges(rate):
+    edges = rate.edges()
+    for splits in [0, 1, 7, len(rate.order) // 2, len(rate.order)]:
+        assert edges[splits] == Half_Perimeter(rate.prune(splits))
+
+@pytest.mark.parametrize('fraction', [0.3, 0.6, 0.95])
+def test_bytes_target_of_exact_estimate(rate, fraction):
+    # an output growing exactly with the edges is found with the full tree and one guess
+    measured = []
+    size_of = lambda tree: measured.append(tree) or 3 * Half_Perimeter(tree)
+    value = int(fraction * 3 * rate.edges()[-1])
+
+    splits = rate.select('bytes', value, size_of)
+    assert splits == np.flatnonzero(3 * rate.edges() <= value)[-1]
+    assert len(measured) <= 2
+
+@pytest.mark.parametrize('fraction', [0, 0.5, 0.8, 1])
+def test_bytes_target(rate, fraction):
+    root, full = Png_Size(rate.prune(0)), Png_Size(rate.prune(len(rate.order)))
+    value = int(root + fraction * (full - root))
+    splits = rate.select('bytes', value, Png_Size)
+    assert Png_Size(rate.prune(splits)) <= value
+    assert fraction < 1 or splits == len(rate.order)
+
+def test_bytes_target_below_root(rate):
+    assert rate.select('bytes', 10, Png_Size) == 0
+    with pytest.raises(ValueError):
+        rate.select('bytes', 10)
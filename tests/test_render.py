@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from Main import Start_QuadTree, Create_Image
+from Filters import FILTERS, Apply_Filter
+from Pixels import Array_Image
+
+MAX_DEPTH, DETAIL_THRESHOLD = 5, 10 # a small tree with its leaves spread over several depths
+
+def Old_Filter(colour, color_mode):
+    # the colour the quadrant was drawn with before the filters were a registry, one quadrant at a time
+    r, g, b = colour
+    grey = int(0.2989 * r + 0.5870 * g + 0.1140 * b)
+    average = (r + g + b) / 3
+    filtered = {
+        'Gray Scale': (grey,) * 3,
+        'Black and White': (0 if grey < 128 else 255,) * 3,
+        'Sepia': (int(0.393 * r + 0.769 * g + 0.189 * b), int(0.349 * r + 0.686 * g + 0.168 * b), int(0.272 * r + 0.534 * g + 0.131 * b)),
+        'Inverted': (255 - r, 255 - g, 255 - b),
+        'Thresholded': tuple(255 if value > 128 else 0 for value in colour),
+        'Brightened': tuple(min(255, value + 50) for value in colour),
+        'High Contrast': tuple(min(255, int(average + 50 * (value - average))) for value in colour),
+        'Soft Blur': tuple(max(0, value - 100) for value in colour),
+        'Emboss-like': tuple(min(255, max(0, value + 50)) for value in colour),
+    }.get(color_mode, colour)
+
+    # drawn with ImageDraw, which clips the values out of range
+    image = Image.new('RGB', (1, 1))
+    ImageDraw.Draw(image).rectangle((0, 0, 0, 0), filtered)
+    return image.getpixel((0, 0))
+
+@pytest.mark.parametrize('color_mode', ['Color'] + list(FILTERS))
+def test_filters_match_old_filters(color_mode):
+    rng = np.random.default_rng(0)
+    colours = np.concatenate([rng.integers(0, 256, (200, 3)), [[0, 0, 0], [255, 255, 255], [128, 128, 128], [255, 0, 0]]]).astype(np.uint8)
+    expected = np.array([Old_Filter(tuple(colour), color_mode) for colour in colours.tolist()], dtype=np.uint8)
+    np.testing.assert_array_equal(Apply_Filter(colours, color_mode), expected)
+
+@pytest.mark.parametrize('color_mode', list(FILTERS))
+def test_filters_of_every_layout(pixels, color_mode):
+    # grey colours are filtered as the RGB colours with the same value in every channel and the alpha channel is kept
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    channels = tree.colour.shape[1]
+    colour, alpha = tree.colour[:, :3 if channels >= 3 else 1], tree.colour[:, 3 if channels >= 3 else 1:]
+    expected = Apply_Filter(np.repeat(colour, 3, axis=1) if colour.shape[1] == 1 else colour, color_mode)
+
+    filtered = Apply_Filter(tree.colour, color_mode)
+    np.testing.assert_array_equal(filtered[:, filtered.shape[1] - alpha.shape[1]:], alpha)
+    colour_channels = filtered[:, :filtered.shape[1] - alpha.shape[1]]
+    np.testing.assert_array_equal(np.broadcast_to(colour_channels, expected.shape), expected)
+
+@pytest.mark.parametrize('color_mode', ['Color', 'Sepia', 'Black and White'])
+@pytest.mark.parametrize('show_lines', [False, True])
+def test_array_backend_matches_pil(pixels, color_mode, show_lines):
+    tree, max_depth = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    for user_depth in range(max_depth + 1):
+        painted = Create_Image(tree, max_depth, user_depth, color_mode, show_lines, backend='array')
+        drawn = Create_Image(tree, max_depth, user_depth, color_mode, show_lines, backend='pil')
+        assert painted.mode == drawn.mode
+        np.testing.assert_array_equal(np.asarray(painted), np.asarray(drawn))
@@ -0,0 +1,73 @@
+import io
+import numpy as np
+import pytest
+from Main import Compression_Settings, Integral_Image, Build_Levels, Create_Image
+from Sequence import FrameTree, Sequence_Frames, Encode_Sequence, Decode_Sequence
+from conftest import Assert_Same_Tree
+
+def Moving_Frames(channels, count=4, width=90, height=70, seed=0):
+    # a blocky background with a noisy square moving over it, and a frame that does not change at all
+    rng = np.random.default_rng(seed)
+    background = rng.integers(1, 256, (height // 8 + 1, width // 8 + 1, channels), dtype=np.uint8)
+    background = background.repeat(8, axis=0).repeat(8, axis=1)[:height, :width]
+    frames = []
+    for index in range(count):
+        frame = background.copy()
+        top, left = 5 + 3 * index, 10 + 5 * index
+        frame[top:top + 20, left:left + 20] = rng.integers(0, 256, (20, 20, channels), dtype=np.uint8)
+        frames.append(frame)
+    return frames + [frames[-1].copy()]
+
+def Full_Tree(pixels, option, measure):
+    # the tree Build_Levels() builds over the whole frame, the grid every frame of a sequence shares
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+    height, width = pixels.shape[:2]
+    bbox = (0, 0, width, height)
+    tree, _ = Build_Levels(Integral_Image(pixels, bbox, MAX_DEPTH + 1, measure), bbox, MAX_DEPTH, DETAIL_THRESHOLD)
+    return tree
+
+@pytest.mark.parametrize('channels', [1, 2, 3, 4])
+@pytest.mark.parametrize('measure', ['weighted_std', 'lab'])
+def test_frame_tree_matches_build_levels(channels, measure):
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings('Average')
+    frame_tree = FrameTree(MAX_DEPTH, DETAIL_THRESHOLD, measure)
+    for frame in Moving_Frames(channels):
+        Assert_Same_Tree(frame_tree.update(frame), Full_Tree(frame, 'Average', measure))
+
+@pytest.mark.parametrize('option', ['Pixelated', 'Refined'])
+@pytest.mark.parametrize('compression', ['none', 'zlib', 'lzma'])
+def test_stream_round_trip(option, compression):
+    frames = Moving_Frames(3)
+    data = io.BytesIO()
+    written, count = Encode_Sequence(data, frames, option, compression)
+    assert (written, count) == (len(data.getvalue()), len(frames))
+
+    data.seek(0)
+    trees = list(Decode_Sequence(data))
+    assert len(trees) == len(frames)
+    for tree, frame in zip(trees, frames):
+        Assert_Same_Tree(tree, Full_Tree(frame, option, 'weighted_std'), detail=False) # the stream does not store the detail
+
+def test_stream_is_truncated():
+    data = io.BytesIO()
+    Encode_Sequence(data, Moving_Frames(3))
+    with pytest.raises(ValueError):
+        list(Decode_Sequence(io.BytesIO(data.getvalue()[:-3])))
+
+def test_rendered_frames():
+    frames = Moving_Frames(4)
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings('Average')
+    for canvas, frame in zip(Sequence_Frames(frames, 'Average', 'Sepia'), frames):
+        tree = Full_Tree(frame, 'Average', 'weighted_std')
+        expected = np.asarray(Create_Image(tree, tree.max_depth, min(MAX_DEPTH, tree.max_depth), 'Sepia'))
+        np.testing.assert_array_equal(canvas.reshape(expected.shape), expected)
+
+def test_tolerance_ignores_small_changes():
+    frame = Moving_Frames(3, count=1)[0]
+    noisy = frame.copy()
+    noisy[::3, ::5] = np.minimum(noisy[::3, ::5].astype(np.int16) + 1, 255).astype(np.uint8)
+
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings('Average')
+    frame_tree = FrameTree(MAX_DEPTH, DETAIL_THRESHOLD, tolerance=1)
+    tree = frame_tree.update(frame)
+    assert frame_tree.update(noisy) is tree and frame_tree.changed_pixels == 0
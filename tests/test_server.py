@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from PIL import Image
+from Server import Service, Client
+from Pixels import Array_Image
+from conftest import Synthetic_Pixels
+
+def Png_Bytes(pixels):
+    data = io.BytesIO()
+    Array_Image(pixels).save(data, format='PNG')
+    return data.getvalue()
+
+def Run_Client(test, threads=True, **service):
+    # runs a test coroutine with a Client of a Service, whose compressions run on a thread, which takes no time to start,
+    # or on the worker processes of the service
+    async def run(executor):
+        async with Client(Service(workers=1, executor=executor, **service)) as client:
+            return await test(client)
+
+    if not threads:
+        return asyncio.run(run(None))
+    with ThreadPoolExecutor(1) as executor:
+        return asyncio.run(run(executor))
+
+@pytest.mark.parametrize('parameters, message', [
+    ({'level': 'Bogus'}, 'Unknown level'),
+    ({'filter': 'Bogus'}, 'Unknown filter'),
+    ({'output': 'bmp'}, 'Unknown output'),
+    ({'depth': 'deep'}, 'whole number'),
+])
+def test_bad_parameters(parameters, message):
+    status, headers, body = Run_Client(lambda client: client.compress(Png_Bytes(Synthetic_Pixels(3)), **parameters))
+    assert status == 400 and headers['content-type'] == 'application/json'
+    assert message in json.loads(body)['error']
+
+@pytest.mark.parametrize('data', [b'', b'not an image'], ids=['empty', 'not an image'])
+def test_bad_images(data):
+    status, _, body = Run_Client(lambda client: client.compress(data))
+    assert status == 400 and json.loads(body)['error']
+
+@pytest.mark.parametrize('method, target, allowed', [('GET', '/compress', 'POST'), ('POST', '/health', 'GET')])
+def test_wrong_method(method, target, allowed):
+    status, headers, _ = Run_Client(lambda client: client.request(method, target))
+    assert status == 405 and headers['allow'] == allowed
+
+def test_unknown_path():
+    status, _, _ = Run_Client(lambda client: client.request('GET', '/nowhere'))
+    assert status == 404
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+
+    async def test(client):
+        blocked = asyncio.ensure_future(client.service.run(release.wait)) # takes the only place in the queue
+        while client.service.pending < 1:
+            await asyncio.sleep(0.01)
+        try:
+            status, headers, body = await client.compress(Png_Bytes(Synthetic_Pixels(3)))
+        finally:
+            release.set()
+        await blocked
+        health_status, health = await client.health()
+        return status, headers, health
+
+    status, headers, health = Run_Client(test, queue_size=1)
+    assert status == 503 and headers['retry-after'] == '1'
+    assert health['rejected'] == 1
+
+@pytest.mark.parametrize('output', ['png', 'webp', 'gif'])
+def test_compress(pixels, output):
+    status, headers, body = Run_Client(lambda client: client.compress(Png_Bytes(pixels), level='Pixelated', output=output))
+    assert status == 200 and headers['content-type'] == f'image/{output}'
+    with Image.open(io.BytesIO(body)) as image:
+        assert image.size == (pixels.shape[1], pixels.shape[0])
+
+def test_compress_in_worker_processes():
+    status, _, body = Run_Client(lambda client: client.compress(Png_Bytes(Synthetic_Pixels(3)), level='Pixelated'), threads=False)
+    assert status == 200 and body.startswith(b'\x89PNG')
@@ -0,0 +1,69 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from Main import Compression_Settings, Start_QuadTree, Create_Image
+from Codec import Encode_Tree
+from Pixels import Array_Image
+from Tiled import Build_Tiled, Compress_Tiled, Encode_Tiled, Mapped_Pixels
+from conftest import Synthetic_Pixels, Assert_Same_Tree
+
+def Memory_Tree(pixels, option='Average'):
+    # the tree of the image held in memory
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings(option)
+    tree, _ = Start_QuadTree(Array_Image(pixels), MAX_DEPTH, DETAIL_THRESHOLD)
+    return tree
+
+@pytest.mark.parametrize('tile_pixels', [64, 1000, 1 << 24])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_tiled_tree_matches_memory(pixels, tmp_path, tile_pixels, workers):
+    path = tmp_path / 'pixels.npy'
+    np.save(path, pixels)
+    DETAIL_THRESHOLD, MAX_DEPTH = Compression_Settings('Average')
+
+    path, bbox = Mapped_Pixels(str(path), str(tmp_path))
+    tree, max_depth = Build_Tiled(path, bbox, MAX_DEPTH, DETAIL_THRESHOLD, tile_pixels, workers)
+    Assert_Same_Tree(tree, Memory_Tree(pixels))
+    assert max_depth == tree.max_depth
+
+@pytest.mark.parametrize('color_mode, show_lines', [('No Filter', False), ('Sepia', True)])
+def test_tiled_png_matches_memory(pixels, tmp_path, color_mode, show_lines):
+    input_path, output_path = tmp_path / 'input.png', tmp_path / 'output.png'
+    Array_Image(pixels).save(input_path)
+    tree, max_depth = Compress_Tiled(str(input_path), str(output_path), 'Average', color_mode, tile_pixels=500, show_lines=show_lines)
+
+    expected_tree = Memory_Tree(pixels)
+    Assert_Same_Tree(tree, expected_tree)
+    _, MAX_DEPTH = Compression_Settings('Average')
+    expected = Create_Image(expected_tree, expected_tree.max_depth, min(MAX_DEPTH, expected_tree.max_depth), color_mode, show_lines)
+    with Image.open(output_path) as image:
+        assert image.mode == expected.mode
+        np.testing.assert_array_equal(np.asarray(image), np.asarray(expected))
+
+def test_encode_tiled_matches_encode_tree(pixels, tmp_path):
+    input_path, output_path = tmp_path / 'input.npy', tmp_path / 'output.qtc'
+    np.save(input_path, pixels)
+    written = Encode_Tiled(str(input_path), str(output_path))
+
+    expected = io.BytesIO()
+    Encode_Tree(expected, Memory_Tree(pixels))
+    assert output_path.read_bytes() == expected.getvalue() and written == len(expected.getvalue())
+
+def test_two_dimensional_npy_is_grey(tmp_path):
+    grey = Synthetic_Pixels(1)
+    flat_path, grey_path = tmp_path / 'flat.npy', tmp_path / 'grey.npy'
+    np.save(flat_path, grey[:, :, 0])
+    np.save(grey_path, grey)
+
+    tree, _ = Compress_Tiled(str(flat_path), str(tmp_path / 'flat.png'), tile_pixels=500)
+    expected, _ = Compress_Tiled(str(grey_path), str(tmp_path / 'grey.png'), tile_pixels=500)
+    Assert_Same_Tree(tree, expected)
+    assert (tmp_path / 'flat.png').read_bytes() == (tmp_path / 'grey.png').read_bytes()
+
+@pytest.mark.parametrize('array', [np.zeros((8, 8), dtype=np.float32), np.zeros((8, 8, 5), dtype=np.uint8), np.zeros(8, dtype=np.uint8)],
+                         ids=['float', 'five channels', 'one dimension'])
+def test_invalid_npy_is_rejected(tmp_path, array):
+    path = tmp_path / 'pixels.npy'
+    np.save(path, array)
+    with pytest.raises(ValueError, match='.npy image'):
+        Mapped_Pixels(str(path), str(tmp_path))